@@ -0,0 +1,58 @@
+# coding: utf-8
+"""
+Benchmark of the time taken to import pypvwatts in a fresh interpreter.
+
+Each module is imported in new processes, and the median of the cumulative
+time python -X importtime reports for it is printed, with the heaviest
+modules it pulled in, leaving out the ones imported at startup.
+
+    python -m benchmarks.import_time [--runs 15] [--module pypvwatts]
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+
+
+def import_times(code):
+    """
+    Return {module: cumulative microseconds} of the imports of code run in
+    a new interpreter
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--module', action='append',
+                        help='module to import, repeatable '
+                             '(default pypvwatts)')
+    parser.add_argument('--top', type=int, default=8,
+                        help='heaviest imported modules listed')
+    args = parser.parse_args()
+
+    startup = import_times('pass')
+    for module in args.module or ['pypvwatts']:
+        runs = [import_times('import ' + module) for _ in range(args.runs)]
+        totals = sorted(run[module] for run in runs)
+        print('%-28s %7.1f ms' % (module, totals[len(totals) // 2] / 1000.0))
+        heaviest = sorted((time, name) for name, time in runs[-1].items()
+                          if name != module and name not in startup)
+        for time, name in heaviest[::-1][:args.top]:
+            print('    %-24s %7.1f ms' % (name, time / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
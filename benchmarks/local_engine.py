@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+Benchmark of the local simulation engine on a 10k site portfolio.
+
+Sites are spread over 50 synthetic weather stations with random layouts,
+and simulated with LocalPVWatts.request_many, then a sample of them one at
+a time with LocalPVWatts.request for comparison.
+
+    python -m benchmarks.local_engine [--sites 10000] [--stations 50]
+"""
+from __future__ import print_function
+
+import argparse
+import resource
+import time
+
+import numpy
+
+from pypvwatts.local import LocalPVWatts, solar_position
+from pypvwatts.weather import Weather
+
+
+def synthetic_weather(lat, lon, tz, seed):
+    """
+    Return a Weather of clear sky irradiance dimmed by random daily clouds
+    """
+    random = numpy.random.RandomState(seed)
+    day = numpy.arange(8760) // 24
+    hour = numpy.arange(8760) % 24 + 0.5
+    zenith = solar_position(day, hour, lat, lon, tz)[0]
+    cos_z = numpy.maximum(numpy.cos(numpy.radians(zenith)), 0)
+    clear = numpy.repeat(1 - 0.8 * random.rand(365) ** 2, 24)
+    dni = numpy.where(cos_z > 0, 1000 * 0.7 ** (
+        1 / numpy.maximum(cos_z, 0.05)) ** 0.678, 0) * clear
+    dhi = numpy.where(cos_z > 0, 60 + 150 * (1 - clear), 0) * cos_z ** 0.5
+    return Weather(lat=lat, lon=lon, tz=tz, ghi=dni * cos_z + dhi, dni=dni,
+                   dhi=dhi, wspd=random.gamma(2, 1.5, 8760),
+                   tamb=(15 - 12 * numpy.cos(2 * numpy.pi * day / 365) +
+                         8 * cos_z - abs(lat - 35) / 2),
+                   day=day, hour=hour, location=str(seed),
+                   file_id='station-%d' % seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sites', type=int, default=10000)
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--sample', type=int, default=200,
+                        help='sites simulated one at a time')
+    parser.add_argument('--chunk-size', type=int, default=64)
+    args = parser.parse_args()
+
+    random = numpy.random.RandomState(0)
+    stations = [synthetic_weather(random.uniform(25, 48),
+                                  random.uniform(-124, -70), -6, seed)
+                for seed in range(args.stations)]
+    local = LocalPVWatts(stations, chunk_size=args.chunk_size)
+    batch = [dict(system_capacity=round(random.uniform(2, 500), 1),
+                  lat=random.uniform(25, 48), lon=random.uniform(-124, -70),
+                  tilt=round(random.uniform(0, 45)),
+                  azimuth=round(random.uniform(90, 270)),
+                  array_type=int(random.choice([0, 1, 2, 3, 4])),
+                  module_type=int(random.choice([0, 1, 2])),
+                  losses=14, dc_ac_ratio=round(random.uniform(1, 1.5), 2))
+             for _ in range(args.sites)]
+
+    start = time.time()
+    total = 0.0
+    for _, result in local.request_many(batch):
+        total += result.ac_annual
+    batched = time.time() - start
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.time()
+    for kwargs in batch[:args.sample]:
+        local.request(**kwargs)
+    single = (time.time() - start) / args.sample
+
+    print('sites:            %d over %d stations' % (args.sites,
+                                                    args.stations))
+    print('request_many:     %.2f s, %.2f ms per site, peak RSS %.0f MB' % (
+        batched, 1000 * batched / args.sites, peak / 1e6))
+    print('request:          %.2f ms per site' % (1000 * single))
+    print('portfolio output: %.0f MWh per year' % (total / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+Benchmark of response decoding and post-processing over process pools.
+
+Synthetic hourly responses are decoded and summarized by a postprocess
+function, first in threads of this interpreter as request_many does, then
+with ProcessDecoder pools of 1, 2, 4... processes up to the CPU count.
+
+    python -m benchmarks.process_pool [--responses 400] [--threads 8]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from pypvwatts.processing import ProcessDecoder, decode_body
+from pypvwatts.pvwattsresult import PVWattsResult
+
+
+def summarize(result):
+    """
+    Derived metrics of a result, run in the worker processes
+    """
+    ac = result.ac
+    daily = result.daily('ac').sum(axis=1)
+    return {'peak': float(ac.max()),
+            'monthly': [float(month.sum()) for month in result.monthly('ac')],
+            'p90_day': float(numpy.percentile(daily, 90)),
+            'clipped_hours': int((ac >= 0.98 * ac.max()).sum()),
+            'temperature_loss': float(
+                ((result.tcell - 25).clip(0) * result.poa).sum())}
+
+
+def synthetic_body(seed):
+    random = numpy.random.RandomState(seed)
+    outputs = {'ac_annual': 6000.0, 'ac_monthly': [500.0] * 12}
+    for name in PVWattsResult.hourly_fields:
+        outputs[name] = (random.rand(8760) * 1000).round(3).tolist()
+    return json.dumps({'inputs': {'system_capacity': '4'}, 'errors': [],
+                       'warnings': [], 'station_info': {},
+                       'outputs': outputs}).encode('utf8')
+
+
+def run(decode, bodies, threads):
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(decode, bodies))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--responses', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    bodies = [synthetic_body(seed % 20) for seed in range(args.responses)]
+    megabytes = sum(len(body) for body in bodies) / 1e6
+    cpus = os.cpu_count() or 1
+    print('responses: %d, %.0f MB of JSON, %d CPUs' % (
+        len(bodies), megabytes, cpus))
+
+    def in_thread(body):
+        data = decode_body(body)[0]
+        return data, summarize(PVWattsResult(data, columnar=True))
+
+    baseline = run(in_thread, bodies, args.threads)
+    print('threads only:    %6.1f responses/s' % (len(bodies) / baseline))
+    processes = 1
+    while processes <= cpus:
+        with ProcessDecoder(processes, postprocess=summarize) as decoder:
+            # start the workers before timing
+            run(decoder.decode, bodies[:processes], processes)
+            elapsed = run(decoder.decode, bodies,
+                          max(args.threads, 2 * processes))
+        print('%2d processes:    %6.1f responses/s, x%.2f' % (
+            processes, len(bodies) / elapsed, baseline / elapsed))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# coding: utf-8
+"""
+Benchmark suite of the PVWatts clients against a local stub server.
+
+Each scenario is timed for throughput and per request latency (p50, p99),
+then run again, shorter, under tracemalloc for its peak memory. Results are
+written to a JSON report, and compared to a previous report with --compare,
+exiting with status 1 when a scenario got slower than the tolerance.
+
+The suite needs Python 3 and is run from the repository root:
+
+    python -m benchmarks.suite --output report.json
+    python -m benchmarks.suite --compare report.json --tolerance 0.2
+    python -m benchmarks.suite --scenarios request_hourly,request_many
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from pypvwatts import PVWatts
+from pypvwatts.__version__ import VERSION
+from pypvwatts.asyncpvwatts import AsyncPVWatts
+from pypvwatts.hooks import Hooks, MetricsCollector
+from pypvwatts.ratelimit import RateLimiter, RetryPolicy
+from pypvwatts.stubserver import StubServer
+from pypvwatts.transport import RequestsTransport
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SITE = dict(system_capacity=4, lat=40, lon=-105)
+HOURLY = dict(SITE, timeframe='hourly')
+
+
+class TimedPVWatts(PVWatts):
+    """
+    PVWatts recording the latency of each request
+    """
+    def __init__(self, *args, **kwargs):
+        PVWatts.__init__(self, *args, **kwargs)
+        self.latencies = []
+
+    def get_data(self, params={}, use_cache=True):
+        start = time.time()
+        data = super(TimedPVWatts, self).get_data(params, use_cache)
+        self.latencies.append(time.time() - start)
+        return data
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def sequential(server, count, **options):
+    """
+    PVWatts.request one request at a time
+    """
+    kwargs = options.pop('kwargs', SITE)
+    if 'transport' in options:
+        options['transport'] = options['transport']()
+    with TimedPVWatts(**options) as p:
+        p.PVWATTS_QUERY_URL = server.url
+        for _ in range(count):
+            p.request(**kwargs)
+        return p.latencies
+
+
+def batch(server, count, **options):
+    """
+    PVWatts.request_many over a thread pool
+    """
+    kwargs = options.pop('kwargs', SITE)
+    workers = options.pop('workers', 16)
+    with TimedPVWatts(pool_maxsize=workers, **options) as p:
+        p.PVWATTS_QUERY_URL = server.url
+        for _ in p.request_many([kwargs] * count, max_workers=workers):
+            pass
+        return p.latencies
+
+
+def asynchronous(server, count, **options):
+    """
+    AsyncPVWatts.request_many
+    """
+    kwargs = options.pop('kwargs', SITE)
+    latencies = []
+
+    class TimedAsyncPVWatts(AsyncPVWatts):
+        async def get_data(self, params, timeout=None, use_cache=True):
+            start = time.time()
+            data = await super(TimedAsyncPVWatts, self).get_data(
+                params, timeout, use_cache)
+            latencies.append(time.time() - start)
+            return data
+
+    async def run():
+        async with TimedAsyncPVWatts(max_concurrency=16, **options) as p:
+            p.PVWATTS_QUERY_URL = server.url
+            async for _ in p.request_many([kwargs] * count):
+                pass
+
+    asyncio.run(run())
+    return latencies
+
+
+def attribute_access(server, count, columnar=False, compact=False):
+    """
+    Reading scalar and hourly fields of an hourly result
+    """
+    with PVWatts(columnar=columnar, compact=compact) as p:
+        p.PVWATTS_QUERY_URL = server.url
+        response = p.get_data(p.build_params(**HOURLY))
+    latencies = []
+    for _ in range(count):
+        start = time.time()
+        result = p.make_result(response)
+        total = result.ac_annual + sum(result.ac_monthly)
+        for name in ('ac', 'dc', 'poa'):
+            total += max(getattr(result, name))
+        latencies.append(time.time() - start)
+    return latencies
+
+
+# name: (function, count, server options, function options)
+SCENARIOS = [
+    ('request_monthly', sequential, 500, {}, {}),
+    ('request_monthly_metrics', sequential, 500, {},
+     {'hooks': Hooks(MetricsCollector())}),
+    ('request_monthly_requests', sequential, 500, {},
+     {'transport': RequestsTransport}),
+    ('request_hourly', sequential, 60, {}, {'kwargs': HOURLY}),
+    ('request_hourly_streaming', sequential, 60, {},
+     {'kwargs': HOURLY, 'streaming': True}),
+    ('attribute_access', attribute_access, 200, {}, {}),
+    ('attribute_access_columnar', attribute_access, 200, {},
+     {'columnar': True}),
+    ('attribute_access_compact', attribute_access, 200, {},
+     {'compact': True}),
+    ('request_many', batch, 1000, {'latency': 0.02}, {}),
+    ('request_many_hourly', batch, 100, {'latency': 0.02},
+     {'kwargs': HOURLY}),
+    ('request_many_faults', batch, 500,
+     {'latency': 0.02, 'rate_limited': 0.05, 'server_errors': 0.02,
+      'limit': 100000, 'seed': 0},
+     {'retry': RetryPolicy(max_retries=5, backoff_factor=0.01)}),
+    ('request_many_paced', batch, 300, {'latency': 0.02, 'limit': 100000},
+     {'rate_limiter': RateLimiter()}),
+    ('async_request_many', asynchronous, 1000, {'latency': 0.02}, {}),
+]
+
+
+def run_scenario(function, count, server_options, options):
+    """
+    Return the measures of a scenario: a timed run, then a run of a fifth
+    of the requests under tracemalloc
+    """
+    with StubServer(**server_options) as server:
+        start = time.time()
+        latencies = function(server, count, **dict(options))
+        elapsed = time.time() - start
+        tracemalloc.start()
+        try:
+            function(server, max(1, count // 5), **dict(options))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        replies = dict((str(status), number)
+                       for status, number in server.replies.items())
+    return {'operations': count, 'seconds': elapsed,
+            'throughput': count / elapsed,
+            'p50_ms': 1000 * percentile(latencies, 0.5),
+            'p99_ms': 1000 * percentile(latencies, 0.99),
+            'peak_memory': peak, 'replies': replies}
+
+
+def compare(report, baseline, tolerance):
+    """
+    Print the throughput change of each scenario against a baseline report
+    and return the names of the scenarios that regressed
+    """
+    regressed = []
+    for name, measures in sorted(report['scenarios'].items()):
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        ratio = measures['throughput'] / before['throughput']
+        flag = ''
+        if ratio < 1 - tolerance:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print('%-28s %8.1f -> %8.1f ops/s  x%.2f%s' % (
+            name, before['throughput'], measures['throughput'], ratio, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', help='JSON report path')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='previous JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='throughput drop counted as a regression')
+    parser.add_argument('--scenarios', help='comma separated scenario names')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of requests')
+    args = parser.parse_args()
+
+    selected = args.scenarios.split(',') if args.scenarios else None
+    report = {'version': VERSION, 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'scenarios': {}}
+    for name, function, count, server_options, options in SCENARIOS:
+        if selected and name not in selected:
+            continue
+        if 'columnar' in options or 'streaming' in options:
+            if numpy is None:
+                continue
+        measures = run_scenario(function, max(1, int(count * args.scale)),
+                                server_options, options)
+        report['scenarios'][name] = measures
+        print('%-28s %8.1f ops/s  p50 %7.2f ms  p99 %7.2f ms  peak %6.1f MB'
+              % (name, measures['throughput'], measures['p50_ms'],
+                 measures['p99_ms'], measures['peak_memory'] / 1e6))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
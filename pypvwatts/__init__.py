@@ -1,2 +1,15 @@
+import sys
+
 from .pypvwatts import PVWatts
 from .pvwattserror import PVWattsValidationError
+
+__all__ = ['PVWatts', 'PVWattsValidationError']
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # asyncio is only imported when AsyncPVWatts is used
+        if name == 'AsyncPVWatts':
+            from .asyncpvwatts import AsyncPVWatts
+            return AsyncPVWatts
+        raise AttributeError('module %r has no attribute %r'
+                             % (__name__, name))
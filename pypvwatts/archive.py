@@ -0,0 +1,264 @@
+# coding: utf-8
+"""
+Compact binary archives of PVWatts results.
+
+An archive holds any number of results. Each entry stores a small JSON
+header (inputs, station_info, version, scalar outputs...) followed by the
+numeric output fields as fixed width little endian columns, aligned to 8
+bytes. An index of entry offsets is written at the end of the file, so
+opening an archive only reads the index, and with memory mapping column
+data is only read when it is used.
+
+Layout::
+
+    b'PVWATTSA' | version (u4) | reserved (u4)
+    entries:  length of the rest of the entry (u8) | header length (u4) |
+              reserved (u4) | header JSON, padded | columns, each padded
+    index:    offset (u8) for each entry
+    footer:   index offset (u8) | count (u8) | b'PVWATTSI'
+"""
+from .pvwattsresult import PVWattsResult, import_numpy
+from .pvwattserror import PVWattsError
+
+import json
+import os
+import struct
+
+MAGIC = b'PVWATTSA'
+INDEX_MAGIC = b'PVWATTSI'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<QII')
+_FOOTER = struct.Struct('<QQ8s')
+
+
+def _padding(size, fill=b'\0'):
+    return fill * (-size % 8)
+
+
+def _check_header(header, path):
+    """
+    Check the file header of an archive, of this format version
+    """
+    if len(header) < _HEADER.size or header[:8] != MAGIC:
+        raise PVWattsError('%s is not a PVWatts archive' % path)
+    version = _HEADER.unpack(header)[1]
+    if version != FORMAT_VERSION:
+        raise PVWattsError('Unsupported archive version %d, expected %d'
+                           % (version, FORMAT_VERSION))
+
+
+class ArchiveWriter(object):
+    """
+    Writes results to an archive one at a time, so a batch never has to be
+    held in memory
+
+    :param path: Archive file path
+    :param append: Add to an existing archive instead of replacing it. An
+                   archive left without index by an interrupted writer is
+                   recovered up to its last complete entry.
+    :param dtype: dtype of the hourly columns, by default arrays keep their
+                  own dtype and lists are stored as float64
+    """
+    def __init__(self, path, append=False, dtype=None):
+        self.numpy = import_numpy()
+        self.path = path
+        self.dtype = dtype
+        self.offsets = []
+        if append and os.path.exists(path):
+            self.file = open(path, 'r+b')
+            try:
+                self._recover()
+            except Exception:
+                self.file.close()
+                raise
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _recover(self):
+        size = os.fstat(self.file.fileno()).st_size
+        _check_header(self.file.read(_HEADER.size), self.path)
+        end = _HEADER.size
+        index = _read_index(self.file, size)
+        if index is not None:
+            end, count = index
+            self.file.seek(end)
+            self.offsets = self.numpy.frombuffer(
+                self.file.read(8 * count), dtype='<u8').tolist()
+        else:
+            # no index, walk the entries up to the last complete one
+            while end + _ENTRY.size <= size:
+                self.file.seek(end)
+                length = _ENTRY.unpack(self.file.read(_ENTRY.size))[0]
+                if end + _ENTRY.size + length > size:
+                    break
+                self.offsets.append(end)
+                end += _ENTRY.size + length
+        self.file.seek(end)
+        self.file.truncate()
+
+    def tell(self):
+        """
+        Return the offset where the next entry will be written
+        """
+        return self.file.tell()
+
+    def write(self, result):
+        """
+        Append a PVWattsResult, or a decoded response, to the archive
+        """
+        numpy = self.numpy
+        raw = result if isinstance(result, dict) else result.result
+        outputs = dict(raw.get('outputs') or {})
+        columns, blobs, offset = [], [], 0
+        for name in PVWattsResult.shortcut_fields:
+            value = outputs.get(name)
+            if not isinstance(value, (list, numpy.ndarray)):
+                continue
+            if self.dtype is not None and name in \
+                    PVWattsResult.hourly_fields:
+                dtype = self.dtype
+            elif isinstance(value, numpy.ndarray):
+                dtype = value.dtype
+            else:
+                dtype = 'float64'
+            try:
+                array = numpy.asarray(value, dtype=numpy.dtype(dtype)
+                                      .newbyteorder('<'))
+            except (TypeError, ValueError):
+                continue
+            data = array.tobytes()
+            del outputs[name]
+            columns.append([name, array.dtype.str, offset, len(array)])
+            blobs.append(data + _padding(len(data)))
+            offset += len(blobs[-1])
+
+        header = dict(raw, outputs=outputs)
+        meta = json.dumps({'result': header, 'columns': columns},
+                          separators=(',', ':')).encode('utf8')
+        meta += _padding(len(meta), b' ')
+        entry_offset = self.file.tell()
+        self.file.write(_ENTRY.pack(len(meta) + offset, len(meta), 0))
+        self.file.write(meta)
+        for blob in blobs:
+            self.file.write(blob)
+        self.offsets.append(entry_offset)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """
+        Write the index and close the file
+        """
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(self.numpy.asarray(self.offsets, dtype='<u8')
+                        .tobytes())
+        self.file.write(_FOOTER.pack(index_offset, len(self.offsets),
+                                     INDEX_MAGIC))
+        self.file.close()
+
+
+def _read_index(file, size):
+    """
+    Return the (offset, count) of the index stored in the footer, None if
+    the archive has no index
+    """
+    if size < _HEADER.size + _FOOTER.size:
+        return None
+    file.seek(size - _FOOTER.size)
+    index_offset, count, magic = _FOOTER.unpack(file.read(_FOOTER.size))
+    if magic != INDEX_MAGIC or index_offset + 8 * count + _FOOTER.size \
+            != size:
+        return None
+    return index_offset, count
+
+
+class PVWattsArchive(object):
+    """
+    Read access to an archive, results are loaded on demand
+
+    :param path: Archive file path
+    :param mmap: Memory map the file, columns are then views of the mapping
+                 and are only read from disk when touched. Otherwise each
+                 entry is read in full when loaded.
+    """
+    def __init__(self, path, mmap=True):
+        self.numpy = import_numpy()
+        self.path = path
+        self.mmap = mmap
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            _check_header(file.read(_HEADER.size), path)
+            index = _read_index(file, size)
+            if index is None:
+                raise PVWattsError('%s has no index, it was not closed'
+                                   % path)
+            index_offset, count = index
+            if mmap:
+                self._data = self.numpy.memmap(path, mode='r')
+                self.offsets = self.numpy.frombuffer(
+                    self._data, dtype='<u8', count=count,
+                    offset=index_offset)
+            else:
+                self._data = None
+                file.seek(index_offset)
+                self.offsets = self.numpy.frombuffer(
+                    file.read(8 * count), dtype='<u8')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        """
+        Load the result at index as a columnar PVWattsResult. Hourly fields
+        are arrays, views of the file when memory mapped, monthly ones are
+        lists as in responses.
+        """
+        numpy = self.numpy
+        offset = int(self.offsets[index])
+        if self._data is not None:
+            length, meta_length = _ENTRY.unpack(
+                self._data[offset:offset + _ENTRY.size].tobytes())[:2]
+            data, start = self._data, offset + _ENTRY.size
+        else:
+            with open(self.path, 'rb') as file:
+                file.seek(offset)
+                length, meta_length = _ENTRY.unpack(
+                    file.read(_ENTRY.size))[:2]
+                data = numpy.frombuffer(file.read(length), dtype='u1')
+            start = 0
+        meta = json.loads(data[start:start + meta_length].tobytes()
+                          .decode('utf8'))
+        result = meta['result']
+        columns = start + meta_length
+        for name, dtype, column_offset, count in meta['columns']:
+            column = numpy.frombuffer(data, dtype=dtype, count=count,
+                                      offset=columns + column_offset)
+            if name not in PVWattsResult.hourly_fields:
+                column = column.tolist()
+            result['outputs'][name] = column
+        return PVWattsResult(result, columnar=True)
+
+    def close(self):
+        """
+        Release the file mapping, results loaded before keep it alive
+        """
+        self._data = None
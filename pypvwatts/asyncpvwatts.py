@@ -0,0 +1,403 @@
+# coding: utf-8
+"""
+asyncio client for NREL PVWatt version 6, built on aiohttp.
+"""
+from .pypvwatts import CacheLookup, PVWatts
+from .pvwattsresult import CompactPVWattsResult, PVWattsResult
+from .pvwattserror import (PVWattsError, PVWattsRateLimitError,
+                           PVWattsValidationError)
+from .pvwattscache import cache_key
+from .ratelimit import RetryPolicy
+from .streaming import StreamingDecoder
+from .transport import USER_AGENT
+
+import asyncio
+import json
+import time
+
+
+class AsyncSingleFlight(object):
+    """
+    Runs one call per key at a time for concurrent tasks, see
+    pypvwatts.singleflight.SingleFlight. The call runs in its own task, so
+    a cancelled caller does not cancel it for the others, it is only
+    cancelled once every caller is gone.
+
+    :ivar calls: Number of calls actually made
+    :ivar coalesced: Number of calls served by a call already in flight
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced,
+                'in_flight': len(self)}
+
+    async def do(self, key, func):
+        """
+        Return await func(), or wait for the call in flight for key and
+        return its result
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(func())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda _: self._land(key, flight))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if flight[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+class AsyncPVWatts(object):
+    '''
+    asyncio counterpart of PVWatts, requests are validated with the same
+    PVWatts.build_params and return the same PVWattsResult
+    '''
+
+    PVWATTS_QUERY_URL = PVWatts.PVWATTS_QUERY_URL
+
+    def __init__(self, api_key='DEMO_KEY', max_concurrency=10, timeout=None,
+                 proxy=None, cache=None, rate_limiter=None, retry=None,
+                 columnar=False, dtype='float64', streaming=False,
+                 chunk_size=65536, single_flight=None, rescale=False,
+                 rescale_strict=False, station_index=None, key_pool=None,
+                 hooks=None, compact=False):
+        """
+        :param api_key: NREL API key
+        :param max_concurrency: Maximum number of requests in flight
+        :param timeout: Default total timeout in seconds for each request
+        :param proxy: Proxy URL used for all requests
+        :param cache: Response cache, see pypvwatts.pvwattscache
+        :param rate_limiter: RateLimiter pacing requests, see
+                             pypvwatts.ratelimit
+        :param retry: RetryPolicy for 429 and 5xx responses
+        :param columnar: Hourly fields as numpy arrays, see PVWattsResult
+        :param dtype: Hourly arrays dtype in columnar mode
+        :param compact: Results as CompactPVWattsResult
+        :param streaming: Decode responses incrementally, see
+                          pypvwatts.streaming
+        :param chunk_size: Bytes read at a time when streaming
+        :param single_flight: AsyncSingleFlight coalescing identical
+                              concurrent requests
+        :param rescale: Rescale cached responses to other system capacities,
+                        see pypvwatts.rescale
+        :param rescale_strict: Still send rescaled requests and check the
+                               rescaled response against the actual one
+        :param station_index: StationIndex sharing cache entries between
+                              sites of the same weather station, see
+                              pypvwatts.stations
+        :param key_pool: KeyPool spreading requests over several API keys,
+                         see pypvwatts.keypool
+        :param hooks: Hooks notified of request lifecycle events, see
+                      pypvwatts.hooks
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('AsyncPVWatts requires aiohttp, install it '
+                              'with pip install pypvwatts[async]')
+        self._aiohttp = aiohttp
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.proxy = proxy
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.columnar = columnar
+        self.dtype = dtype
+        self.compact = compact
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.single_flight = single_flight
+        self.rescale = rescale
+        self.rescale_strict = rescale_strict
+        self.station_index = station_index
+        self.key_pool = key_pool
+        self.hooks = hooks
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def get_session(self):
+        """
+        Return the aiohttp session, creating it on first use. Must be called
+        from within the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            aiohttp = self._aiohttp
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                headers={'User-Agent': USER_AGENT})
+        return self._session
+
+    async def close(self):
+        """
+        Close the session and its connections
+        """
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    def build_params(self, **kwargs):
+        """
+        Validate request arguments, see PVWatts.build_params
+        """
+        if self.hooks is None:
+            params = PVWatts.build_params(**kwargs)
+        else:
+            start = time.time()
+            try:
+                params = PVWatts.build_params(**kwargs)
+            except PVWattsValidationError as e:
+                self.hooks.emit('error', {'params': None, 'error': e,
+                                          'stage': 'validate'})
+                raise
+            self.hooks.emit('validate', {'seconds': time.time() - start})
+        params['api_key'] = self.api_key
+        return params
+
+    def make_result(self, data):
+        """
+        Wrap a decoded response in a PVWattsResult
+        """
+        cls = CompactPVWattsResult if self.compact else PVWattsResult
+        return cls(data, columnar=self.columnar, dtype=self.dtype)
+
+    async def get_data(self, params, timeout=None, use_cache=True):
+        """
+        Make the request and return the deserialized JSON from the response
+
+        :param params: Dictionary mapping (string) query parameters to values
+        :param timeout: Total timeout in seconds, overrides the default one.
+                        asyncio.TimeoutError is raised when exceeded.
+        :param use_cache: Set to False to bypass the response cache
+        """
+        hooks = self.hooks
+        if hooks is not None:
+            start = time.time()
+        lookup = CacheLookup(self, params, use_cache)
+        data = lookup.get()
+        if data is not None:
+            return data
+        if hooks is None:
+            data = await self._send(params, timeout)
+        else:
+            state = {'stage': 'send'}
+            try:
+                data = await self._send(params, timeout, hooks, state)
+            except Exception as e:
+                hooks.emit('error', {'params': params, 'error': e,
+                                     'stage': state['stage']})
+                raise
+            now = time.time()
+            hooks.emit('decoded', {
+                'params': params, 'seconds': now - state['received'],
+                'total': now - start, 'bytes': state['bytes']})
+        lookup.set(data)
+        return data
+
+    async def _send(self, params, timeout, hooks=None, state=None):
+        """
+        Send the request, with pacing and retries, and return the decoded
+        response. With hooks, state records the stage reached, when the
+        response was received and its size.
+        """
+        session = self.get_session()
+        query = dict((name, str(value)) for name, value in params.items()
+                     if value is not None)
+        if timeout is None:
+            timeout = self.timeout
+        limiter = self.rate_limiter
+        pool = self.key_pool
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await asyncio.sleep(limiter.reserve())
+            if pool is not None:
+                key, delay = pool.reserve()
+                query['api_key'] = key
+                await asyncio.sleep(delay)
+            async with self._semaphore:
+                if hooks is not None:
+                    hooks.emit('send', {'params': query, 'attempt': attempt})
+                    sent = time.time()
+                async with session.get(
+                        self.PVWATTS_QUERY_URL, params=query,
+                        proxy=self.proxy,
+                        timeout=self._aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    status = response.status
+                    headers = response.headers
+                    if hooks is not None:
+                        state['received'] = time.time()
+                        hooks.emit('first_byte', {
+                            'params': query, 'attempt': attempt,
+                            'status': status,
+                            'seconds': state['received'] - sent})
+                    if limiter is not None:
+                        limiter.update(headers, status)
+                    if pool is not None:
+                        pool.update(key, headers, status)
+                    if status not in (403, 429) and status < 500:
+                        if hooks is not None:
+                            state['stage'] = 'decode'
+                        data, size = await self._decode(response)
+                        if hooks is not None:
+                            state['bytes'] = size
+            if status == 403 and pool is not None and len(pool):
+                if hooks is not None:
+                    hooks.emit('retry', {'params': query, 'attempt': attempt,
+                                         'status': status, 'delay': 0.0})
+                continue
+            if not self.retry.should_retry(status, attempt):
+                break
+            delay = 0.0
+            if pool is None or status != 429:
+                delay = self.retry.backoff(attempt, headers)
+            if hooks is not None:
+                hooks.emit('retry', {'params': query, 'attempt': attempt,
+                                     'status': status, 'delay': delay})
+            if delay:
+                await asyncio.sleep(delay)
+            attempt += 1
+
+        if status == 403:
+            raise PVWattsError("Forbidden, 403")
+        if status == 429:
+            raise PVWattsRateLimitError("Too many requests, 429")
+        if status >= 500:
+            raise PVWattsError("Server error, %d" % status)
+        return data
+
+    async def _decode(self, response):
+        """
+        Return the decoded response and its size in bytes
+        """
+        if not self.streaming:
+            body = await response.read()
+            return json.loads(body.decode('utf8')), len(body)
+        decoder = StreamingDecoder(dtype=self.dtype)
+        size = 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            decoder.feed(chunk)
+        return decoder.close(), size
+
+    async def fetch(self, params, timeout=None, use_cache=True):
+        """
+        Return the PVWattsResult for validated params, shared with
+        concurrent callers asking for the same params when single_flight
+        is set
+        """
+        async def fetch():
+            return self.make_result(await self.get_data(
+                params, timeout=timeout, use_cache=use_cache))
+
+        if self.single_flight is None:
+            return await fetch()
+        return await self.single_flight.do((cache_key(params), use_cache),
+                                           fetch)
+
+    async def request(self, timeout=None, use_cache=True, **kwargs):
+        """
+        Make a request, takes the same arguments as PVWatts.request
+
+        :param timeout: Total timeout in seconds for this request
+        :param use_cache: Set to False to bypass the response cache
+        :rtype: PVWattsResult
+        """
+        params = self.build_params(**kwargs)
+        return await self.fetch(params, timeout=timeout, use_cache=use_cache)
+
+    async def _fetch(self, index, params, timeout):
+        try:
+            if isinstance(params, Exception):
+                raise params
+            return index, await self.fetch(params, timeout=timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return index, e
+
+    async def request_many(self, batch, ordered=True, timeout=None):
+        """
+        Make many requests concurrently, at most max_concurrency at a time,
+        keeping tasks for at most twice as many items. Every item is
+        validated before anything is sent and failures are reported per
+        item. Cancelling the consumer cancels all pending requests.
+
+        :param batch: Iterable of dictionaries with request() arguments
+        :param ordered: Yield results in input order, otherwise as soon as
+                        each one finishes
+        :param timeout: Total timeout in seconds for each request
+        :return: Asynchronous generator of (index, result) tuples, result
+                 being a PVWattsResult or the exception raised for that item
+        """
+        queries = []
+        for kwargs in batch:
+            try:
+                queries.append(self.build_params(**kwargs))
+            except (PVWattsValidationError, TypeError) as e:
+                queries.append(e)
+
+        self.get_session()
+        # like dispatch, at most twice max_concurrency tasks at a time, in
+        # submission order
+        window = 2 * self.max_concurrency
+        pending = {}
+        items = enumerate(queries)
+
+        def submit():
+            for index, params in items:
+                task = asyncio.ensure_future(self._fetch(index, params,
+                                                         timeout))
+                pending[task] = index
+                if len(pending) >= window:
+                    return
+
+        try:
+            submit()
+            while pending:
+                if ordered:
+                    done = [next(iter(pending))]
+                    await asyncio.wait(done)
+                else:
+                    done, _ = await asyncio.wait(
+                        list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del pending[task]
+                    yield task.result()
+                submit()
+        finally:
+            pending = [task for task in pending if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
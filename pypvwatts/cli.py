@@ -0,0 +1,413 @@
+# coding: utf-8
+"""
+Command line interface, installed as the pypvwatts console script.
+
+    pypvwatts run sites.jsonl results.jsonl
+    pypvwatts run sites.csv results.pvw --workers 8 --resume
+    pypvwatts warm sites.csv --cache /shared/pvwatts/ --until 06:00
+
+Each input row is a JSON object, or a CSV row, of PVWatts.request
+arguments. Rows are validated and sent window by window, so the batch is
+never held in memory, and each result or error is written as soon as it is
+in order. A checkpoint of the rows done and of the output size is saved as
+the job goes, and --resume continues a killed job from it. warm fills a
+cache with the responses of a file of requests and reports its coverage.
+"""
+from __future__ import print_function
+
+from .pypvwatts import CacheLookup, PVWatts
+from .keypool import KeyPool
+from .pvwattscache import DirectoryCache, SQLiteCache
+from .pvwattserror import PVWattsError
+from .singleflight import FileSingleFlight
+from .ratelimit import RateLimiter
+from .transport import HTTPClientTransport, ReplayTransport
+from . import validation
+from .__version__ import VERSION
+
+import argparse
+import collections
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+
+def _value(name, text):
+    # only numeric parameters are converted, strings such as a file_id or
+    # an address of digits stay as they are
+    field = validation.FIELDS.get(name)
+    if field is None or field.types is not validation.NUMBER:
+        return text
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def read_rows(path, format=None):
+    """
+    Return a generator of request arguments dictionaries from a JSONL or
+    CSV file. Empty CSV values are left out and values of numeric
+    parameters are converted.
+    """
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    with io.open(path, newline='' if format == 'csv' else None,
+                 encoding='utf8') as file:
+        if format == 'csv':
+            for row in csv.DictReader(file):
+                yield dict((name, _value(name, value))
+                           for name, value in row.items() if value != '')
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _record(row, result):
+    if isinstance(result, Exception):
+        return {'row': row, 'error': str(result),
+                'type': result.__class__.__name__}
+    return {'row': row, 'result': result.raw}
+
+
+class JSONLOutput(object):
+    """
+    Writes one JSON line per row, results and errors alike
+    """
+    def __init__(self, path, offsets=None):
+        if offsets:
+            self.file = io.open(path, 'r+b')
+            self.file.seek(offsets[0])
+            self.file.truncate()
+        else:
+            self.file = io.open(path, 'wb')
+
+    def write(self, row, result):
+        line = json.dumps(_record(row, result), separators=(',', ':'))
+        self.file.write(line.encode('utf8') + b'\n')
+
+    def sync(self):
+        """
+        Flush the output to disk and return its offsets
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return [self.file.tell()]
+
+    def close(self):
+        self.file.close()
+
+
+class ArchiveOutput(object):
+    """
+    Writes results to an archive, with their row number, and errors to a
+    JSONL file next to it
+    """
+    def __init__(self, path, offsets=None, dtype=None):
+        from .archive import ArchiveWriter
+        self.errors = JSONLOutput(path + '.errors.jsonl',
+                                  offsets and offsets[1:])
+        if offsets:
+            with io.open(path, 'r+b') as file:
+                file.truncate(offsets[0])
+        self.writer = ArchiveWriter(path, append=bool(offsets), dtype=dtype)
+
+    def write(self, row, result):
+        if isinstance(result, Exception):
+            self.errors.write(row, result)
+        else:
+            self.writer.write(dict(result.result, row=row))
+
+    def sync(self):
+        self.writer.flush()
+        os.fsync(self.writer.file.fileno())
+        return [self.writer.tell()] + self.errors.sync()
+
+    def close(self):
+        self.writer.close()
+        self.errors.close()
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Replace the checkpoint file atomically
+    """
+    temporary = path + '.tmp'
+    with io.open(temporary, 'w', encoding='utf8') as file:
+        file.write(json.dumps(checkpoint, ensure_ascii=False))
+        file.flush()
+        os.fsync(file.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(temporary, path)
+    else:
+        os.rename(temporary, path)
+
+
+def load_checkpoint(path):
+    with io.open(path, encoding='utf8') as file:
+        return json.loads(file.read())
+
+
+def run(args):
+    output_format = args.output_format
+    if output_format is None:
+        output_format = 'jsonl' if args.output.lower().endswith(
+            ('.jsonl', '.json')) else 'archive'
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+    checkpoint = {'input': os.path.abspath(args.input),
+                  'output': os.path.abspath(args.output),
+                  'rows_done': 0, 'errors': 0, 'output_offset': None}
+    if args.resume and os.path.exists(checkpoint_path):
+        saved = load_checkpoint(checkpoint_path)
+        if (saved['input'], saved['output']) != (checkpoint['input'],
+                                                 checkpoint['output']):
+            raise SystemExit('%s is the checkpoint of another job'
+                             % checkpoint_path)
+        checkpoint = saved
+
+    if output_format == 'jsonl':
+        output = JSONLOutput(args.output, checkpoint['output_offset'])
+    else:
+        output = ArchiveOutput(args.output, checkpoint['output_offset'])
+
+    client = build_client(args)
+    rows = itertools.islice(read_rows(args.input, args.input_format),
+                            checkpoint['rows_done'], None)
+    decoder = None
+    if args.processes:
+        from .processing import ProcessDecoder
+        decoder = ProcessDecoder(args.processes)
+    done = checkpoint['rows_done']
+    try:
+        with client:
+            while True:
+                window = list(itertools.islice(rows, args.window))
+                if not window:
+                    break
+                for _, result in client.request_many(
+                        window, max_workers=args.workers,
+                        processes=decoder):
+                    output.write(done, result)
+                    done += 1
+                    if isinstance(result, Exception):
+                        checkpoint['errors'] += 1
+                    if done % args.checkpoint_every == 0:
+                        checkpoint.update(rows_done=done,
+                                          output_offset=output.sync())
+                        save_checkpoint(checkpoint_path, checkpoint)
+                if not args.quiet:
+                    print('%d rows done, %d errors' % (
+                        done, checkpoint['errors']), file=sys.stderr)
+        checkpoint.update(rows_done=done, output_offset=output.sync())
+        save_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        output.close()
+        if decoder is not None:
+            decoder.close()
+    return 1 if checkpoint['errors'] and args.strict else 0
+
+
+def open_cache(path):
+    """
+    Return the cache at path: a DirectoryCache, shared by processes and
+    hosts, for a directory or a path ending with a separator, otherwise a
+    SQLiteCache in WAL mode, shared by the processes of one host
+    """
+    if path.endswith(('/', os.sep)) or os.path.isdir(path):
+        return DirectoryCache(path)
+    return SQLiteCache(path, wal=True)
+
+
+def build_client(args):
+    """
+    Return the PVWatts client of the command line options
+    """
+    keys = args.api_keys or os.environ.get('NREL_API_KEY',
+                                           'DEMO_KEY').split(',')
+    transport = None
+    if getattr(args, 'replay', None):
+        transport = ReplayTransport(args.replay)
+    elif getattr(args, 'record', None):
+        transport = ReplayTransport(args.record, HTTPClientTransport(
+            pool_maxsize=args.workers))
+    cache = open_cache(args.cache) if args.cache else None
+    single_flight = None
+    if isinstance(cache, DirectoryCache):
+        # processes sharing the cache wait for each other's requests
+        single_flight = FileSingleFlight(os.path.join(cache.path, 'locks'))
+    client = PVWatts(api_key=keys[0], pool_maxsize=args.workers,
+                     cache=cache, single_flight=single_flight,
+                     rate_limiter=RateLimiter() if args.pace else None,
+                     key_pool=KeyPool(keys) if len(keys) > 1 else None,
+                     transport=transport)
+    client.PVWATTS_QUERY_URL = args.url
+    return client
+
+
+def deadline(until):
+    """
+    Return the timestamp of the next HH:MM local time
+    """
+    hour, minute = (int(part) for part in until.split(':'))
+    now = datetime.datetime.now()
+    moment = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if moment <= now:
+        moment += datetime.timedelta(days=1)
+    return time.mktime(moment.timetuple())
+
+
+def warm(args):
+    """
+    Request the rows missing from the cache, until the deadline, and print
+    a JSON report of the cache coverage of the valid rows
+    """
+    client = build_client(args)
+    stop = deadline(args.until) if args.until else None
+    report = collections.OrderedDict(
+        (name, 0) for name in ('rows', 'invalid', 'cached', 'fetched',
+                               'failed', 'skipped'))
+    rows = read_rows(args.input, args.input_format)
+    with client:
+        while True:
+            window = list(itertools.islice(rows, args.window))
+            if not window:
+                break
+            report['rows'] += len(window)
+            missing = []
+            for kwargs in window:
+                try:
+                    params = client.build_params(**kwargs)
+                except (PVWattsError, TypeError):
+                    report['invalid'] += 1
+                    continue
+                if CacheLookup(client, params, True).get() is not None:
+                    report['cached'] += 1
+                else:
+                    missing.append(kwargs)
+            if stop is not None and time.time() >= stop:
+                report['skipped'] += len(missing)
+                continue
+            results = client.request_many(missing, max_workers=args.workers,
+                                          ordered=False)
+            done = 0
+            for _, result in results:
+                report['failed' if isinstance(result, Exception)
+                       else 'fetched'] += 1
+                done += 1
+                if stop is not None and time.time() >= stop:
+                    # cancels the requests not sent yet
+                    results.close()
+                    break
+            report['skipped'] += len(missing) - done
+            if not args.quiet:
+                print('%d rows done, %d fetched' % (
+                    report['rows'], report['fetched']), file=sys.stderr)
+    valid = report['rows'] - report['invalid']
+    report['coverage'] = float(report['cached'] + report['fetched']) / \
+        valid if valid else 1.0
+    print(json.dumps(report))
+    return 1 if args.strict and report['coverage'] < 1 else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='pypvwatts', description='NREL PVWatts API client')
+    parser.add_argument('--version', action='version', version=VERSION)
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser(
+        'run', help='send a file of requests, streaming results to a file')
+    command.add_argument('input', help='JSONL or CSV file of request '
+                         'arguments, one request per row')
+    command.add_argument('output', help='JSONL file, or archive, of results')
+    command.add_argument('--input-format', choices=('jsonl', 'csv'),
+                         help='by default guessed from the extension')
+    command.add_argument('--output-format', choices=('jsonl', 'archive'),
+                         help='by default jsonl for .jsonl and .json files, '
+                         'archive otherwise, with errors in '
+                         'OUTPUT.errors.jsonl')
+    command.add_argument('--api-key', action='append', dest='api_keys',
+                         metavar='KEY', help='repeat it to spread requests '
+                         'over several keys, defaults to the comma separated '
+                         'keys of $NREL_API_KEY')
+    command.add_argument('--url', default=PVWatts.PVWATTS_QUERY_URL,
+                         help='PVWatts API endpoint')
+    command.add_argument('--workers', type=int, default=4,
+                         help='concurrent requests (default 4)')
+    command.add_argument('--processes', type=int, metavar='N',
+                         help='decode responses in N processes')
+    command.add_argument('--window', type=int, default=1000,
+                         help='rows read and validated at a time')
+    command.add_argument('--cache', metavar='PATH',
+                         help='response cache: a directory, shared by '
+                         'processes and hosts, or a sqlite file')
+    command.add_argument('--pace', action='store_true',
+                         help='pace requests to the key rate limit')
+    replay = command.add_mutually_exclusive_group()
+    replay.add_argument('--record', metavar='PATH',
+                        help='append the responses to a JSONL recording')
+    replay.add_argument('--replay', metavar='PATH',
+                        help='replay the responses of a recording, offline')
+    command.add_argument('--checkpoint', metavar='PATH',
+                         help='defaults to OUTPUT.checkpoint')
+    command.add_argument('--checkpoint-every', type=int, default=100,
+                         metavar='ROWS')
+    command.add_argument('--resume', action='store_true',
+                         help='continue from the checkpoint')
+    command.add_argument('--strict', action='store_true',
+                         help='exit with status 1 when any row failed')
+    command.add_argument('--quiet', action='store_true')
+    command.set_defaults(func=run)
+
+    command = commands.add_parser(
+        'warm', help='fill a cache with the responses of a file of requests '
+        'and report its coverage')
+    command.add_argument('input', help='JSONL or CSV file of request '
+                         'arguments, one request per row')
+    command.add_argument('--cache', metavar='PATH', required=True,
+                         help='a directory, shared by processes and hosts, '
+                         'or a sqlite file')
+    command.add_argument('--input-format', choices=('jsonl', 'csv'),
+                         help='by default guessed from the extension')
+    command.add_argument('--api-key', action='append', dest='api_keys',
+                         metavar='KEY', help='repeat it to spread requests '
+                         'over several keys, defaults to the comma separated '
+                         'keys of $NREL_API_KEY')
+    command.add_argument('--url', default=PVWatts.PVWATTS_QUERY_URL,
+                         help='PVWatts API endpoint')
+    command.add_argument('--workers', type=int, default=4,
+                         help='concurrent requests (default 4)')
+    command.add_argument('--window', type=int, default=1000,
+                         help='rows read and validated at a time')
+    command.add_argument('--pace', action='store_true',
+                         help='pace requests to the key rate limit')
+    command.add_argument('--until', metavar='HH:MM',
+                         help='stop sending requests at this local time, '
+                         'the end of the off-peak hours')
+    command.add_argument('--strict', action='store_true',
+                         help='exit with status 1 unless every valid row is '
+                         'cached')
+    command.add_argument('--quiet', action='store_true')
+    command.set_defaults(func=warm)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# coding: utf-8
+"""
+Portfolio aggregates over the hourly series of many PVWattsResult.
+
+FleetAggregator consumes results one at a time, stacking their hourly
+fields into a fixed size block that is reduced into running hourly sums,
+minimums, maximums and histograms once full. Memory therefore stays the
+same whatever the number of sites, and aggregates computed in separate
+processes can be merged, or saved and loaded, as long as they were created
+with the same settings.
+
+Quantiles are read from the hourly histograms, so they are approximate to
+a bin width. ac and dc histograms are of the output per kW of system
+capacity (W/kW), comparable between sites of any size.
+"""
+from .pvwattsresult import MONTH_BOUNDS, PVWattsResult, import_numpy
+from .pvwattserror import PVWattsError
+from .rescale import response_capacity
+
+# Histogram range of each hourly field, ac and dc are per kW of capacity
+BOUNDS = {
+    'ac': (0.0, 1200.0),
+    'dc': (0.0, 1200.0),
+    'poa': (0.0, 1500.0),
+    'dn': (0.0, 1200.0),
+    'df': (0.0, 800.0),
+    'tamb': (-50.0, 60.0),
+    'tcell': (-50.0, 100.0),
+    'wspd': (0.0, 40.0),
+}
+PER_KW = ('ac', 'dc')
+HOURS = 8760
+
+
+class FleetAggregator(object):
+    """
+    Running hourly aggregates of a fleet of sites
+
+    :param fields: Hourly output fields to aggregate
+    :param bins: Histogram bins per hour, the quantile resolution
+    :param bounds: Histogram range of each field, defaults to BOUNDS.
+                   Values out of range are counted in the edge bins.
+    :param block: Number of sites stacked before reducing them
+    :ivar sites: Number of sites aggregated
+    :ivar capacity: Total system capacity of the sites, in kW
+    :ivar errors: Number of exceptions skipped by update()
+    """
+    def __init__(self, fields=('ac',), bins=120, bounds=None, block=256):
+        numpy = import_numpy()
+        self.fields = tuple(fields)
+        self.bins = bins
+        self.bounds = dict(BOUNDS, **(bounds or {}))
+        self.block = block
+        self.sites = 0
+        self.capacity = 0.0
+        self.errors = 0
+        # sum of the peak of each site, for the peak coincidence factor
+        self.peak_sum = dict((name, 0.0) for name in self.fields)
+        self.sum = dict((name, numpy.zeros(HOURS)) for name in self.fields)
+        self.min = dict((name, numpy.full(HOURS, numpy.inf))
+                        for name in self.fields)
+        self.max = dict((name, numpy.full(HOURS, -numpy.inf))
+                        for name in self.fields)
+        self.histogram = dict(
+            (name, numpy.zeros((HOURS, bins), dtype='int64'))
+            for name in self.fields)
+        self._stack = dict((name, numpy.empty((block, HOURS)))
+                           for name in self.fields)
+        self._capacities = numpy.empty(block)
+        self._stacked = 0
+
+    def _check(self, other):
+        if (self.fields, self.bins, self.bounds) != \
+                (other.fields, other.bins, other.bounds):
+            raise PVWattsError('Cannot merge aggregates with different '
+                               'fields, bins or bounds')
+
+    def add(self, result):
+        """
+        Add the hourly series of a PVWattsResult, or of a raw response
+        """
+        if isinstance(result, dict):
+            result = PVWattsResult(result)
+        capacity = response_capacity(result.result)
+        if capacity is None and any(name in PER_KW for name in self.fields):
+            raise PVWattsError('Response has no system_capacity input')
+        row = self._stacked
+        for name in self.fields:
+            values = result.column(name)
+            if len(values) != HOURS:
+                raise PVWattsError('Response has no hourly %s output' % name)
+            self._stack[name][row] = values
+        self._capacities[row] = capacity or 0.0
+        self._stacked += 1
+        self.sites += 1
+        self.capacity += capacity or 0.0
+        if self._stacked == self.block:
+            self.flush()
+
+    def update(self, results):
+        """
+        Add every result of an iterable, which may also be the (index,
+        result) tuples of request_many. Exceptions are counted in errors.
+
+        :return: self
+        """
+        for result in results:
+            if isinstance(result, tuple):
+                result = result[1]
+            if isinstance(result, Exception):
+                self.errors += 1
+            else:
+                self.add(result)
+        return self
+
+    def flush(self):
+        """
+        Reduce the stacked sites into the aggregates
+        """
+        numpy = import_numpy()
+        count = self._stacked
+        if not count:
+            return
+        capacities = self._capacities[:count]
+        offsets = numpy.arange(HOURS) * self.bins
+        for name in self.fields:
+            stack = self._stack[name][:count]
+            self.sum[name] += stack.sum(axis=0)
+            numpy.minimum(self.min[name], stack.min(axis=0),
+                          out=self.min[name])
+            numpy.maximum(self.max[name], stack.max(axis=0),
+                          out=self.max[name])
+            self.peak_sum[name] += float(stack.max(axis=1).sum())
+            if name in PER_KW:
+                stack = stack / capacities[:, None]
+            low, high = self.bounds[name]
+            index = ((stack - low) * (self.bins / (high - low))).astype(
+                'int64')
+            numpy.clip(index, 0, self.bins - 1, out=index)
+            index += offsets
+            self.histogram[name] += numpy.bincount(
+                index.ravel(), minlength=HOURS * self.bins).reshape(
+                    HOURS, self.bins)
+        self._stacked = 0
+
+    def merge(self, other):
+        """
+        Add the aggregates of another FleetAggregator, for instance one
+        computed in another process
+
+        :return: self
+        """
+        numpy = import_numpy()
+        self._check(other)
+        self.flush()
+        other.flush()
+        for name in self.fields:
+            self.sum[name] += other.sum[name]
+            numpy.minimum(self.min[name], other.min[name], out=self.min[name])
+            numpy.maximum(self.max[name], other.max[name], out=self.max[name])
+            self.histogram[name] += other.histogram[name]
+            self.peak_sum[name] += other.peak_sum[name]
+        self.sites += other.sites
+        self.capacity += other.capacity
+        self.errors += other.errors
+        return self
+
+    def total(self, name='ac'):
+        """
+        Return the hourly fleet total of a field
+        """
+        self.flush()
+        return self.sum[name]
+
+    def mean(self, name='ac'):
+        """
+        Return the hourly mean of a field over the sites
+        """
+        self.flush()
+        return self.sum[name] / max(self.sites, 1)
+
+    def monthly(self, name='ac'):
+        """
+        Return the fleet total of a field for each month
+        """
+        numpy = import_numpy()
+        return numpy.add.reduceat(self.total(name), (0,) + MONTH_BOUNDS)
+
+    def quantile(self, q, name='ac'):
+        """
+        Return the approximate hourly q quantile (0 to 1) of a field over
+        the sites, per kW of capacity for ac and dc
+        """
+        numpy = import_numpy()
+        self.flush()
+        histogram = self.histogram[name]
+        cumulative = numpy.cumsum(histogram, axis=1)
+        rank = q * (cumulative[:, -1] - 1)
+        # bin of the rank, then linear interpolation within the bin
+        index = (cumulative <= rank[:, None]).sum(axis=1)
+        index = numpy.minimum(index, self.bins - 1)
+        hours = numpy.arange(HOURS)
+        below = numpy.where(index > 0, cumulative[hours, index - 1], 0)
+        inside = histogram[hours, index]
+        fraction = (rank - below + 0.5) / numpy.maximum(inside, 1)
+        low, high = self.bounds[name]
+        width = (high - low) / self.bins
+        return low + (index + numpy.clip(fraction, 0, 1)) * width
+
+    def peak(self, name='ac'):
+        """
+        Return the hour and value of the fleet peak, and the coincidence
+        factor: the fleet peak over the sum of the peaks of each site
+        """
+        total = self.total(name)
+        hour = int(total.argmax())
+        value = float(total[hour])
+        return {'hour': hour, 'value': value,
+                'coincidence': value / self.peak_sum[name]
+                if self.peak_sum[name] else None}
+
+    def save(self, path):
+        """
+        Save the aggregates to a numpy .npz file
+        """
+        numpy = import_numpy()
+        self.flush()
+        arrays = {'meta': numpy.array([self.sites, self.capacity,
+                                       self.errors, self.bins, self.block]),
+                  'fields': numpy.array(self.fields)}
+        for name in self.fields:
+            arrays['bounds_' + name] = numpy.array(self.bounds[name])
+            arrays['peak_sum_' + name] = numpy.array(self.peak_sum[name])
+            arrays['sum_' + name] = self.sum[name]
+            arrays['min_' + name] = self.min[name]
+            arrays['max_' + name] = self.max[name]
+            arrays['histogram_' + name] = self.histogram[name]
+        with open(path, 'wb') as file:
+            numpy.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load aggregates saved with save()
+        """
+        numpy = import_numpy()
+        with numpy.load(path) as arrays:
+            names = arrays['fields'].tolist()
+            sites, capacity, errors, bins, block = arrays['meta'].tolist()
+            bounds = dict((name, tuple(arrays['bounds_' + name].tolist()))
+                          for name in names)
+            aggregator = cls(fields=names, bins=int(bins), block=int(block),
+                             bounds=bounds)
+            aggregator.sites = int(sites)
+            aggregator.capacity = capacity
+            aggregator.errors = int(errors)
+            for name in names:
+                aggregator.peak_sum[name] = float(arrays['peak_sum_' + name])
+                aggregator.sum[name] = arrays['sum_' + name]
+                aggregator.min[name] = arrays['min_' + name]
+                aggregator.max[name] = arrays['max_' + name]
+                aggregator.histogram[name] = arrays['histogram_' + name]
+        return aggregator
@@ -0,0 +1,166 @@
+# coding: utf-8
+"""
+Instrumentation of the request lifecycle.
+
+Clients given a Hooks emit these events, each with an info dictionary:
+
+- validate: request arguments validated, with seconds
+- send: request about to be sent, with params and attempt
+- first_byte: response headers received, with params, attempt, status and
+  seconds since send
+- retry: response about to be retried, with params, attempt, status and
+  the delay in seconds
+- decoded: response body decoded, with params, bytes, seconds since the
+  first byte and total seconds since the lookup started
+- cache_hit: response served from the cache, with params
+- error: request failed, with params (None when validating), error and
+  stage (validate, send or decode)
+
+The params of events are the query parameters without the api_key, so
+handlers and metrics logs never see the keys.
+
+Without hooks, clients only check that there are none, so instrumentation
+costs nothing when unused. Handlers run in the requesting thread and their
+exceptions propagate to the caller.
+"""
+from .transport import _without_key
+
+import bisect
+import collections
+import threading
+
+EVENTS = ('validate', 'send', 'first_byte', 'retry', 'decoded', 'cache_hit',
+          'error')
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class Hooks(object):
+    """
+    Registry of event handlers
+
+    :param listeners: Callables of (event, info) called for every event
+    """
+    def __init__(self, *listeners):
+        self._listeners = list(listeners)
+        self._handlers = {}
+
+    def on(self, event, handler):
+        """
+        Call handler(event, info) for each event of that name
+        """
+        if event not in EVENTS:
+            raise ValueError('Unknown event %r, not one of %s'
+                             % (event, ', '.join(EVENTS)))
+        self._handlers.setdefault(event, []).append(handler)
+        return handler
+
+    def listen(self, listener):
+        """
+        Call listener(event, info) for every event
+        """
+        self._listeners.append(listener)
+        return listener
+
+    def emit(self, event, info):
+        params = info.get('params')
+        if params is not None and 'api_key' in params:
+            info = dict(info, params=_without_key(params))
+        for listener in self._listeners:
+            listener(event, info)
+        for handler in self._handlers.get(event, ()):
+            handler(event, info)
+
+
+class Histogram(object):
+    """
+    Counts of observations in fixed buckets
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[min(bisect.bisect_left(self.buckets, value),
+                        len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket of the q quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    @property
+    def stats(self):
+        return {'count': self.count, 'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': list(zip(self.buckets, self.counts))}
+
+
+class MetricsCollector(object):
+    """
+    In process metrics, listening to every event of a Hooks: event
+    counters, bytes received, replies by status, errors by type and
+    latency histograms of validation, time to first byte, decoding and
+    whole requests
+
+        >>> metrics = MetricsCollector()
+        >>> p = PVWatts(hooks=Hooks(metrics))
+    """
+    LATENCIES = {'validate': 'validate', 'first_byte': 'first_byte',
+                 'decoded': 'decode'}
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = collections.Counter()
+            self.statuses = collections.Counter()
+            self.errors = collections.Counter()
+            self.bytes = 0
+            self.histograms = dict(
+                (name, Histogram(self.buckets)) for name in
+                ('validate', 'first_byte', 'decode', 'request'))
+
+    def __call__(self, event, info):
+        with self._lock:
+            self.counters[event] += 1
+            name = self.LATENCIES.get(event)
+            if name is not None:
+                self.histograms[name].observe(info['seconds'])
+            if event == 'first_byte':
+                self.statuses[info['status']] += 1
+            elif event == 'decoded':
+                self.bytes += info['bytes']
+                self.histograms['request'].observe(info['total'])
+            elif event == 'error':
+                self.errors[info['error'].__class__.__name__] += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'statuses': dict(self.statuses),
+                    'errors': dict(self.errors), 'bytes': self.bytes,
+                    'latencies': dict((name, histogram.stats) for
+                                      name, histogram in
+                                      self.histograms.items())}
@@ -0,0 +1,111 @@
+# coding: utf-8
+"""
+Spreading requests over several API keys.
+
+Every NREL API key has its own hourly quota. A KeyPool hands each request
+the key with the most quota left, paces every key with its own
+RateLimiter, and takes keys out of rotation: for Retry-After seconds, or
+cooldown, after a 429, and for good after a 403 (invalid or revoked key).
+"""
+from .pvwattserror import PVWattsError
+from .ratelimit import RateLimiter, _int_header
+
+import threading
+import time
+
+
+class KeyPool(object):
+    """
+    Pool of API keys with per key quota accounting
+
+    :param keys: NREL API keys
+    :param limit: Requests allowed per window for each key, learned from the
+                  X-RateLimit-Limit header when not given
+    :param window: Quota window in seconds, NREL limits are hourly
+    :param cooldown: Seconds a rate limited key is left out when the 429
+                     response has no Retry-After header
+    :ivar usage: Number of requests sent with each key
+    """
+    def __init__(self, keys, limit=None, window=3600.0, cooldown=60.0):
+        self.keys = list(keys)
+        if not self.keys:
+            raise ValueError('KeyPool needs at least one API key')
+        self.cooldown = cooldown
+        self.limiters = dict((key, RateLimiter(limit, window))
+                             for key in self.keys)
+        self.usage = dict((key, 0) for key in self.keys)
+        self.disabled = set()
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of keys still in rotation or cooling down
+        """
+        return len(self.keys) - len(self.disabled)
+
+    def _state(self, key, now):
+        if key in self.disabled:
+            return 'disabled'
+        if self._until.get(key, 0) > now:
+            return 'cooling'
+        return 'active'
+
+    def reserve(self):
+        """
+        Pick the key with the most quota left, the least used one among
+        equals, and return it with the seconds to wait before sending
+        """
+        with self._lock:
+            now = time.time()
+            usable = [key for key in self.keys if key not in self.disabled]
+            if not usable:
+                raise PVWattsError('Every API key of the pool was refused')
+            ready = [key for key in usable if self._until.get(key, 0) <= now]
+            if ready:
+                key = max(ready, key=lambda key: (
+                    self.limiters[key].budget['tokens'], -self.usage[key]))
+                delay = self.limiters[key].reserve()
+            else:
+                key = min(usable, key=self._until.get)
+                delay = self._until[key] - now + \
+                    self.limiters[key].reserve()
+            self.usage[key] += 1
+            return key, max(delay, 0.0)
+
+    def acquire(self):
+        """
+        Return a key, blocking until a request may be sent with it
+        """
+        key, delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return key
+
+    def update(self, key, headers, status=None):
+        """
+        Account for the response to a request sent with key
+        """
+        self.limiters[key].update(headers, status)
+        with self._lock:
+            if status == 403:
+                self.disabled.add(key)
+            elif status == 429:
+                retry_after = _int_header(headers, 'Retry-After')
+                self._until[key] = time.time() + (
+                    self.cooldown if retry_after is None else retry_after)
+
+    @property
+    def stats(self):
+        """
+        Requests sent, quota and state of each key
+        """
+        now = time.time()
+        stats = {}
+        for key in self.keys:
+            budget = self.limiters[key].budget
+            stats[key] = {'requests': self.usage[key],
+                          'remaining': budget['remaining'],
+                          'tokens': budget['tokens'],
+                          'state': self._state(key, now)}
+        return stats
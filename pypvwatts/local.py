@@ -0,0 +1,695 @@
+# coding: utf-8
+"""
+Offline simulation engine following the PVWatts model, computed from local
+weather files with numpy, for many systems at once.
+
+The model is the one documented for PVWatts version 5, which version 6
+keeps (Dobos, PVWatts Version 5 Manual, NREL/TP-6A20-62641, 2014):
+
+- sun position at the middle of each hour (Spencer's series for declination
+  and equation of time)
+- fixed, 1-axis (with or without backtracking) and 2-axis orientations,
+  trackers rotate up to 45 degrees
+- Perez 1990 sky diffuse transposition and isotropic ground reflection
+- beam transmittance of the module cover (Fresnel and absorption, anti
+  reflective cover for premium modules)
+- the PVWatts heat transfer model of the cell temperature (Fuentes, A
+  Simplified Thermal Model for Flat-Plate Photovoltaic Arrays, SAND85-0330,
+  1987), calibrated to the INOCT of open rack and roof mount arrays
+- DC power from plane of array irradiance with the module temperature
+  coefficient, less the system losses
+- the PVWatts inverter part load efficiency curve, scaled to inv_eff and
+  clipped at the AC rating given by dc_ac_ratio
+
+Shading, snow and spectral effects are not modeled, so results are close
+to, not equal to, the API ones.
+"""
+from .pypvwatts import PVWatts
+from .pvwattsresult import PVWattsResult, MONTH_BOUNDS, MONTH_HOURS, \
+    import_numpy
+from .pvwattserror import PVWattsError, PVWattsValidationError
+from .weather import Weather, read_weather
+from .__version__ import VERSION
+
+import math
+
+# Defaults of the optional inputs
+DC_AC_RATIO = 1.2
+GCR = 0.4
+INV_EFF = 96.0
+ALBEDO = 0.2
+# Tracker rotation limit, degrees
+ROTATION_LIMIT = 45.0
+
+# Temperature coefficient of power (1/C) and cover refractive index of
+# each module_type: standard, premium and thin film
+MODULES = ((-0.0047, 1.526), (-0.0035, 1.3), (-0.0020, 1.526))
+# Cover absorption, extinction coefficient (1/m) times thickness (m)
+COVER_ABSORPTION = 4 * 0.002
+# Heat transfer model: installed nominal operating cell temperature (C) of
+# open rack and roof mount arrays, module emissivity and absorptivity,
+# thermal capacity (J/m2/K), hydraulic diameter (m) of the module, heights
+# (m) of the module and of the wind measurement, and the Stefan-Boltzmann
+# constant as Fuentes has it
+INOCT = (45.0, 49.0)
+EMISSIVITY = 0.84
+ABSORPTIVITY = 0.83
+THERMAL_CAPACITY = 11000.0
+MODULE_DIAMETER = 0.5
+MODULE_HEIGHT = 5.0
+WIND_HEIGHT = 9.144
+STEFAN_BOLTZMANN = 5.669e-8
+# Sweeps over the hours solving the heat transfer model, at most, the
+# largest change (C) of the temperature of sunlit hours ending them, and
+# the number of systems solved at a time, whose arrays stay in cache
+THERMAL_SWEEPS = 10
+THERMAL_TOLERANCE = 0.01
+THERMAL_BLOCK = 8
+# Air properties at sea level, powers of the temperature T (K): density
+# AIR_DENSITY / T, kinematic viscosity VISCOSITY * T ** 1.76 and
+# conductivity CONDUCTIVITY * T ** 0.84. Air heat capacity is 1007 J/kg/K
+# and its Prandtl number 0.71.
+AIR_DENSITY = 0.003484 * 101325.0
+VISCOSITY = 0.24237e-6 / AIR_DENSITY
+CONDUCTIVITY = 2.1695e-4
+# Free convection coefficient cubed, times delta ** 0.96 * T ** -1.8192,
+# the tilt taken as 30 degrees as in Fuentes' model
+FREE_CONVECTION = (0.21 * CONDUCTIVITY / MODULE_DIAMETER) ** 3 * (
+    0.71 * 9.8 * 0.5 * MODULE_DIAMETER ** 3 / VISCOSITY ** 2) ** 0.96
+# Inverter part load curve of the PVWatts inverter model
+INV_EFF_REF = 0.9637
+INV_CURVE = (-0.0162, -0.0059, 0.9858)
+
+# Perez 1990 sky clearness bins and their coefficients
+# f11, f12, f13, f21, f22, f23
+PEREZ_BINS = (1.065, 1.23, 1.5, 1.95, 2.8, 4.5, 6.2)
+PEREZ = (
+    (-0.008, 0.588, -0.062, -0.060, 0.072, -0.022),
+    (0.130, 0.683, -0.151, -0.019, 0.066, -0.029),
+    (0.330, 0.487, -0.221, 0.055, -0.064, -0.026),
+    (0.568, 0.187, -0.295, 0.109, -0.152, -0.014),
+    (0.873, -0.392, -0.362, 0.226, -0.462, 0.001),
+    (1.132, -1.237, -0.412, 0.288, -0.823, 0.056),
+    (1.060, -1.600, -0.359, 0.264, -1.127, 0.131),
+    (0.678, -0.327, -0.250, 0.156, -1.377, 0.251),
+)
+
+# Cosines of the angle of incidence the cover transmittance is tabulated at
+AOI_TABLE_SIZE = 2049
+
+MILE = 1609.344
+EARTH_RADIUS = 6371008.8
+
+
+def solar_position(day, hour, lat, lon, tz):
+    """
+    Return the sun zenith and azimuth (degrees, azimuth clockwise from
+    north) and the extraterrestrial normal irradiance (W/m2)
+
+    :param day: Day of the year, starting at 0
+    :param hour: Local standard time, hours since midnight
+    """
+    numpy = import_numpy()
+    b = 2 * numpy.pi * day / 365.0
+    cos_b, sin_b = numpy.cos(b), numpy.sin(b)
+    cos_2b, sin_2b = numpy.cos(2 * b), numpy.sin(2 * b)
+    declination = (0.006918 - 0.399912 * cos_b + 0.070257 * sin_b -
+                   0.006758 * cos_2b + 0.000907 * sin_2b -
+                   0.002697 * numpy.cos(3 * b) + 0.00148 * numpy.sin(3 * b))
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * cos_b -
+                                 0.032077 * sin_b - 0.014615 * cos_2b -
+                                 0.040849 * sin_2b)
+    solar_time = hour + (4 * (lon - 15 * tz) + equation_of_time) / 60.0
+    hour_angle = numpy.radians(15 * (solar_time - 12))
+    phi = numpy.radians(lat)
+    cos_zenith = (numpy.sin(phi) * numpy.sin(declination) +
+                  numpy.cos(phi) * numpy.cos(declination) *
+                  numpy.cos(hour_angle))
+    zenith = numpy.degrees(numpy.arccos(numpy.clip(cos_zenith, -1, 1)))
+    azimuth = numpy.degrees(numpy.arctan2(
+        numpy.sin(hour_angle),
+        numpy.cos(hour_angle) * numpy.sin(phi) -
+        numpy.tan(declination) * numpy.cos(phi))) + 180
+    extraterrestrial = 1367 * (1.00011 + 0.034221 * cos_b + 0.00128 * sin_b +
+                               0.000719 * cos_2b + 0.000077 * sin_2b)
+    return zenith, azimuth % 360, extraterrestrial
+
+
+def _unit_vector(zenith, azimuth):
+    """
+    Return the east, north and up components of a direction
+    """
+    numpy = import_numpy()
+    zenith, azimuth = numpy.radians(zenith), numpy.radians(azimuth)
+    return (numpy.sin(zenith) * numpy.sin(azimuth),
+            numpy.sin(zenith) * numpy.cos(azimuth), numpy.cos(zenith))
+
+
+def surface_orientation(zenith, azimuth, array_type, tilt, surface_azimuth,
+                        gcr=GCR):
+    """
+    Return the cosine of the angle of incidence, and the tilt and azimuth
+    (degrees) of the array surface at each hour
+
+    :param array_type: 0 or 1 fixed, 2 1-axis, 3 1-axis backtracking,
+                       4 2-axis. For 1-axis trackers tilt and
+                       surface_azimuth are those of the rotation axis.
+    """
+    numpy = import_numpy()
+    sun = _unit_vector(zenith, azimuth)
+    if array_type == 4:
+        normal = sun
+    elif array_type in (2, 3):
+        beta = numpy.radians(tilt)
+        gamma = numpy.radians(surface_azimuth)
+        # surface normal at rest, and its direction of rotation towards west
+        rest = (numpy.sin(beta) * numpy.sin(gamma),
+                numpy.sin(beta) * numpy.cos(gamma), numpy.cos(beta))
+        west = (numpy.cos(gamma), -numpy.sin(gamma), 0)
+        rotation = numpy.arctan2(sun[0] * west[0] + sun[1] * west[1],
+                                 sum(s * r for s, r in zip(sun, rest)))
+        if array_type == 3:
+            # backtrack to avoid row to row shading (Lorenzo et al. 2011)
+            shade = numpy.abs(numpy.cos(rotation)) / gcr
+            rotation = numpy.where(
+                shade < 1,
+                rotation - numpy.sign(rotation) *
+                numpy.arccos(numpy.minimum(shade, 1)),
+                rotation)
+        limit = numpy.radians(ROTATION_LIMIT)
+        rotation = numpy.clip(rotation, -limit, limit)
+        cos_r, sin_r = numpy.cos(rotation), numpy.sin(rotation)
+        normal = tuple(cos_r * r + sin_r * w for r, w in zip(rest, west))
+    else:
+        normal = _unit_vector(tilt, surface_azimuth)
+    cos_aoi = numpy.clip(sum(s * n for s, n in zip(sun, normal)), -1, 1)
+    up = numpy.clip(normal[2], -1, 1) + numpy.zeros_like(cos_aoi)
+    surface_tilt = numpy.degrees(numpy.arccos(up))
+    surface_azimuth = numpy.degrees(
+        numpy.arctan2(normal[0], normal[1])) % 360
+    return cos_aoi, surface_tilt, surface_azimuth
+
+
+def perez(dni, dhi, ghi, zenith, extraterrestrial, cos_aoi, surface_tilt,
+          albedo=ALBEDO):
+    """
+    Return the beam, sky diffuse and ground reflected plane of array
+    irradiance (W/m2), with the Perez 1990 sky model
+    """
+    numpy = import_numpy()
+    up = zenith < 90
+    z = numpy.radians(zenith)
+    cos_z = numpy.cos(z)
+    kappa_z3 = 1.041 * z ** 3
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        clearness = ((dhi + dni) / dhi + kappa_z3) / (1 + kappa_z3)
+        air_mass = 1 / (cos_z + 0.50572 *
+                        (96.07995 - numpy.minimum(zenith, 90)) ** -1.6364)
+    clearness = numpy.where(dhi > 0, clearness, 1)
+    brightness = numpy.where(up, dhi * air_mass / extraterrestrial, 0)
+    bins = numpy.digitize(clearness, PEREZ_BINS)
+    table = numpy.asarray(PEREZ)
+    f1 = numpy.maximum(0, table[bins, 0] + table[bins, 1] * brightness +
+                       table[bins, 2] * z)
+    f2 = table[bins, 3] + table[bins, 4] * brightness + table[bins, 5] * z
+
+    beta = numpy.radians(surface_tilt)
+    cos_beta = numpy.cos(beta)
+    circumsolar = numpy.maximum(cos_aoi, 0) / numpy.maximum(
+        math.cos(math.radians(85)), cos_z)
+    sky = dhi * ((1 - f1) * (1 + cos_beta) / 2 + f1 * circumsolar +
+                 f2 * numpy.sin(beta))
+    sky = numpy.where(up, numpy.maximum(sky, 0), 0)
+    beam = numpy.where(up, dni * numpy.maximum(cos_aoi, 0), 0)
+    ground = ghi * albedo * (1 - cos_beta) / 2
+    return beam, sky, ground
+
+
+def cover_transmittance(cos_aoi, refraction=1.526):
+    """
+    Return the beam transmittance of the module cover relative to normal
+    incidence
+    """
+    numpy = import_numpy()
+    theta = numpy.clip(numpy.arccos(numpy.clip(cos_aoi, 0, 1)),
+                       1e-6, numpy.pi / 2 - 1e-6)
+    theta_r = numpy.arcsin(numpy.sin(theta) / refraction)
+    reflected = (numpy.sin(theta_r - theta) ** 2 /
+                 numpy.sin(theta_r + theta) ** 2 +
+                 numpy.tan(theta_r - theta) ** 2 /
+                 numpy.tan(theta_r + theta) ** 2) / 2
+    transmitted = numpy.exp(-COVER_ABSORPTION / numpy.cos(theta_r)) * \
+        (1 - reflected)
+    normal = math.exp(-COVER_ABSORPTION) * \
+        (1 - ((refraction - 1) / (refraction + 1)) ** 2)
+    return transmitted / normal
+
+
+def _transmittance(cos_aoi, refraction):
+    """
+    cover_transmittance interpolated from a table for each distinct
+    refraction index, much faster on large arrays
+    """
+    numpy = import_numpy()
+    grid = numpy.linspace(0, 1, AOI_TABLE_SIZE)
+    position = numpy.clip(cos_aoi, 0, 1) * (AOI_TABLE_SIZE - 1)
+    index = numpy.minimum(position.astype(int), AOI_TABLE_SIZE - 2)
+    position -= index
+    transmittance = None
+    for refraction_index in numpy.unique(refraction):
+        table = cover_transmittance(grid, refraction_index)
+        values = table[index] + position * numpy.diff(table)[index]
+        transmittance = values if transmittance is None else numpy.where(
+            refraction == refraction_index, values, transmittance)
+    return transmittance
+
+
+def _forced_convection(wind):
+    """
+    Return the terms of the forced convection coefficient of modules in
+    wind (m/s): the laminar and turbulent coefficients cubed, times T **
+    -0.36 and T ** -1.944, and the log of the temperature below which the
+    flow is turbulent, its Reynolds number being above 1.2e5
+    """
+    numpy = import_numpy()
+    ratio = VISCOSITY / MODULE_DIAMETER
+    laminar = (0.86 * 1007 / 0.71 ** 0.67 * AIR_DENSITY) ** 3 * \
+        ratio ** 1.5 * wind ** 1.5
+    turbulent = (0.0282 * 1007 / 0.71 ** 0.4 * AIR_DENSITY) ** 3 * \
+        ratio ** 0.6 * wind ** 2.4
+    threshold = numpy.log(wind / (ratio * 1.2e5)) / 1.76
+    return laminar, turbulent, threshold
+
+
+def _convection(tave, delta, forced):
+    """
+    Return the convective heat transfer coefficient (W/m2/K) of the top of
+    a module, free and forced convection of Fuentes' model combined, at the
+    mean air temperature tave (K) and delta (K) between module and air.
+    Air properties being powers of tave, so are the coefficients, computed
+    from its log.
+    """
+    numpy = import_numpy()
+    log = numpy.log(tave)
+    laminar, turbulent, threshold = forced
+    forced = numpy.where(log < threshold,
+                         turbulent * numpy.exp(-1.944 * log),
+                         laminar * numpy.exp(-0.36 * log))
+    with numpy.errstate(divide='ignore'):
+        free = FREE_CONVECTION * numpy.exp(0.96 * numpy.log(delta) -
+                                           1.8192 * log)
+    return numpy.cbrt(free + forced)
+
+
+def _thermal_calibration(inoct):
+    """
+    Return the ground temperature ratio, the ratio of the total to the top
+    convection and the thermal capacity of modules of an INOCT (C), from
+    the energy balance at the nominal operating conditions: 800 W/m2,
+    20 C and 1 m/s of wind
+    """
+    tinoct = inoct + 273.15
+    rise = tinoct - 293.15
+    radiation = EMISSIVITY * STEFAN_BOLTZMANN
+    top = float(_convection((tinoct + 293.15) / 2, rise,
+                            _forced_convection(1.0)))
+    ground = radiation * (tinoct ** 2 + 293.15 ** 2) * (tinoct + 293.15)
+    back = (ABSORPTIVITY * 800 - radiation * (tinoct ** 4 - 282.21 ** 4) -
+            top * rise) / ((ground + top) * rise)
+    tground = (tinoct ** 4 - back * (tinoct ** 4 - 293.15 ** 4)) ** 0.25
+    tground = min(max(tground, 293.15), tinoct)
+    convection = (ABSORPTIVITY * 800 - radiation * (
+        2 * tinoct ** 4 - 282.21 ** 4 - tground ** 4)) / (top * rise)
+    capacity = THERMAL_CAPACITY
+    if tinoct > 321.15:
+        # roof mounts are coupled with the thermal mass of the roof
+        capacity *= 1 + (tinoct - 321.15) / 12
+    return (tground - 293.15) / rise, float(convection), capacity
+
+
+def cell_temperature(poa, tamb, wspd, array_type, sweeps=THERMAL_SWEEPS,
+                     tolerance=THERMAL_TOLERANCE):
+    """
+    Return the hourly cell temperature (C) of the PVWatts heat transfer
+    model: the energy balance of the module with sky and ground radiation,
+    free and forced convection and the thermal mass, calibrated to the
+    INOCT of the mounting. Values are shaped (..., hours) and cover whole
+    years, the first hour following the last one.
+
+    The model carries each hour's temperature over to the next one.
+    Instead of a loop over the hours, each sweep solves every hour from the
+    temperatures of the previous sweep, converging to the same solution as
+    the thermal lag is a matter of minutes. Sweeps end once no sunlit hour
+    changes by more than tolerance.
+    """
+    numpy = import_numpy()
+    inoct = INOCT[array_type == 1]
+    calibration = _thermal_calibration(inoct)
+    tamb = numpy.asarray(tamb, dtype=float) + 273.15
+    # wind measured at 30 ft, at the height of the modules
+    wind = numpy.asarray(wspd, dtype=float) * \
+        (MODULE_HEIGHT / WIND_HEIGHT) ** 0.2 + 1e-4
+    # absorbed irradiance
+    sun = ABSORPTIVITY * numpy.asarray(poa, dtype=float)
+    shape = numpy.broadcast(sun, tamb, wind).shape
+    sun, tamb, wind = (numpy.broadcast_to(values, shape).reshape(
+        -1, shape[-1]) for values in (sun, tamb, wind))
+    tmod = numpy.empty(sun.shape)
+    for start in range(0, len(tmod), THERMAL_BLOCK):
+        rows = slice(start, start + THERMAL_BLOCK)
+        tmod[rows] = _module_temperature(
+            sun[rows], tamb[rows], _forced_convection(wind[rows]), inoct,
+            calibration, sweeps, tolerance)
+    return tmod.reshape(shape) - 273.15
+
+
+def _module_temperature(sun, tamb, forced, inoct, calibration, sweeps,
+                        tolerance):
+    """
+    Return the module temperatures (K) of rows of hours, see
+    cell_temperature
+    """
+    numpy = import_numpy()
+    ground_ratio, convection_ratio, capacity = calibration
+    radiation = EMISSIVITY * STEFAN_BOLTZMANN
+    tsky = 0.68 * 0.0552 * tamb ** 1.5 + 0.32 * tamb
+    # irradiance of the hour before, varying linearly to the hour's
+    sun0 = numpy.roll(sun, 1, axis=-1)
+    sunlit = sun > 0
+    # first guess scaled from the nominal operating conditions
+    tmod = tamb + (inoct - 20) * sun / (ABSORPTIVITY * 800)
+    for _ in range(sweeps):
+        previous = tmod
+        tmod0 = numpy.roll(tmod, 1, axis=-1)
+        hconv = convection_ratio * _convection(
+            (tmod + tamb) / 2, numpy.abs(tmod - tamb), forced)
+        hsky = radiation * (tmod * tmod + tsky * tsky) * (tmod + tsky)
+        tground = tamb + ground_ratio * (tmod - tamb)
+        hground = radiation * (tmod * tmod + tground * tground) * \
+            (tmod + tground)
+        total = hconv + hsky + hground
+        eigen = -total / capacity * 3600
+        lag = numpy.where(eigen > -10, numpy.exp(eigen), 0)
+        tmod = tmod0 * lag + ((1 - lag) * (
+            hconv * tamb + hsky * tsky + hground * tground + sun0 +
+            (sun - sun0) / eigen) + sun - sun0) / total
+        if numpy.abs(tmod - previous)[sunlit].max(initial=0) < tolerance:
+            break
+    return tmod
+
+
+def inverter(dc, pdc0, dc_ac_ratio=DC_AC_RATIO, inv_eff=INV_EFF):
+    """
+    Return the AC output (W) of the PVWatts inverter model, clipped at
+    pdc0 / dc_ac_ratio
+    """
+    numpy = import_numpy()
+    pac0 = pdc0 / dc_ac_ratio
+    nominal = inv_eff / 100.0
+    load = dc * nominal / pac0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        efficiency = nominal / INV_EFF_REF * (
+            INV_CURVE[0] * load + INV_CURVE[1] / load + INV_CURVE[2])
+        ac = numpy.minimum(efficiency * dc, pac0)
+    return numpy.where(load > 0, numpy.maximum(ac, 0), 0)
+
+
+def simulate(weather, system_capacity, module_type=0, losses=14,
+             array_type=1, tilt=20, azimuth=180, dc_ac_ratio=DC_AC_RATIO,
+             gcr=GCR, inv_eff=INV_EFF, albedo=ALBEDO, sun=None):
+    """
+    Run the model over the hours of weather
+
+    System inputs are scalars, or arrays with one value per system, in
+    which case weather values may also be arrays shaped (systems, hours)
+    and outputs are shaped (systems, hours). array_type is a scalar.
+
+    :param weather: Weather
+    :param albedo: Ground reflectance when the weather has none
+    :param sun: solar_position of the weather, computed when not given
+    :return: Dictionary of hourly outputs: poa, tcell, dc and ac in W
+    """
+    numpy = import_numpy()
+
+    def column(value):
+        value = numpy.asarray(value, dtype=float)
+        return value[..., None] if value.ndim else value
+
+    module = numpy.asarray(MODULES)[numpy.asarray(module_type, dtype=int)]
+    gamma, refraction = column(module[..., 0]), column(module[..., 1])
+    pdc0 = column(system_capacity) * 1000
+    tilt, azimuth = column(tilt), column(azimuth)
+
+    if sun is None:
+        sun = solar_position(weather.day, weather.hour, column(weather.lat),
+                             column(weather.lon), column(weather.tz))
+    zenith, sun_azimuth, extraterrestrial = sun
+    # the model only runs over daylight hours, nights produce nothing
+    hours = numpy.flatnonzero((zenith < 90).reshape(-1, zenith.shape[-1])
+                              .any(axis=0))
+
+    def daylight(values):
+        return values[..., hours] if numpy.ndim(values) else values
+
+    zenith, sun_azimuth = daylight(zenith), daylight(sun_azimuth)
+    cos_aoi, surface_tilt, _ = surface_orientation(
+        zenith, sun_azimuth, array_type, tilt, azimuth, column(gcr))
+    if weather.albedo is not None:
+        albedo = numpy.where((weather.albedo > 0) & (weather.albedo < 1),
+                             weather.albedo, albedo)
+    beam, sky, ground = perez(
+        daylight(weather.dni), daylight(weather.dhi), daylight(weather.ghi),
+        zenith, daylight(extraterrestrial), cos_aoi, surface_tilt,
+        daylight(albedo))
+    poa = beam + sky + ground
+    transmitted = beam * _transmittance(cos_aoi, refraction) + sky + ground
+    tamb = weather.tamb
+    shape = numpy.broadcast(pdc0, tamb, poa[..., :1]).shape[:-1] + \
+        numpy.shape(tamb)[-1:]
+    outputs = {'poa': numpy.zeros(shape)}
+    outputs['poa'][..., hours] = poa
+    # the cell temperature carries over from hour to hour, nights included
+    outputs['tcell'] = cell_temperature(outputs['poa'], tamb, weather.wspd,
+                                        array_type)
+    tcell = daylight(outputs['tcell'])
+    dc = pdc0 * transmitted / 1000.0 * (1 + gamma * (tcell - 25)) * \
+        (1 - column(losses) / 100.0)
+    dc = numpy.maximum(dc, 0)
+    ac = inverter(dc, pdc0, column(dc_ac_ratio), column(inv_eff))
+
+    for name, values in (('dc', dc), ('ac', ac)):
+        outputs[name] = numpy.zeros(shape)
+        outputs[name][..., hours] = values
+    return outputs
+
+
+def distance(lat, lon, lats, lons):
+    """
+    Return the great circle distances (m) between a point and arrays of
+    points
+    """
+    numpy = import_numpy()
+    phi, phis = numpy.radians(lat), numpy.radians(lats)
+    half = numpy.sin((phis - phi) / 2) ** 2 + numpy.cos(phi) * \
+        numpy.cos(phis) * numpy.sin(numpy.radians(lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(half, 1)))
+
+
+class LocalPVWatts(object):
+    '''
+    Offline counterpart of PVWatts, computing PVWattsResult from local
+    weather files instead of requesting them from the API
+    '''
+    def __init__(self, weather, albedo=ALBEDO, columnar=False,
+                 dtype='float64', chunk_size=64, window=4096):
+        """
+        :param weather: Weather or weather file path, or a list of them.
+                        Requests use the station nearest to lat and lon
+                        within radius miles, or the one whose file name is
+                        file_id.
+        :param albedo: Ground reflectance when weather files have none
+        :param columnar: See PVWattsResult
+        :param dtype: dtype of the hourly output arrays
+        :param chunk_size: Systems computed at once by request_many
+        :param window: Requests request_many groups by station and
+                       array_type before computing them. Hourly results of
+                       a whole window are held in memory.
+        """
+        numpy = import_numpy()
+        if not isinstance(weather, (list, tuple)):
+            weather = [weather]
+        self.stations = [station if isinstance(station, Weather)
+                         else read_weather(station) for station in weather]
+        for station in self.stations:
+            if len(station) != 8760:
+                raise PVWattsError('Weather must have 8760 hourly values')
+        self.albedo = albedo
+        self.columnar = columnar
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.window = window
+        self._sun = {}
+        self._lats = numpy.array([station.lat for station in self.stations])
+        self._lons = numpy.array([station.lon for station in self.stations])
+
+    def find_station(self, lat=None, lon=None, file_id=None, radius=0):
+        """
+        Return the index of the station for a request and its distance in
+        meters
+        """
+        if file_id is not None:
+            for index, station in enumerate(self.stations):
+                if file_id in (station.file_id, station.location):
+                    return index, 0.0
+            raise PVWattsError('Unknown file_id %s' % file_id)
+        if lat is None or lon is None:
+            raise PVWattsValidationError('lat and lon or file_id are required')
+        distances = distance(lat, lon, self._lats, self._lons)
+        index = int(distances.argmin())
+        if radius and distances[index] > radius * MILE:
+            raise PVWattsError('No weather station within %s miles' % radius)
+        return index, float(distances[index])
+
+    def build_params(self, **kwargs):
+        """
+        Validate request arguments with PVWatts.build_params, and check the
+        ones the local engine needs
+        """
+        if kwargs.get('address') is not None:
+            raise PVWattsError('address lookup needs the PVWatts API, use '
+                               'lat and lon')
+        params = PVWatts.build_params(**kwargs)
+        del params['api_key']
+        for name in ('system_capacity', 'tilt', 'azimuth'):
+            if params[name] is None:
+                raise PVWattsValidationError('%s is required' % name)
+        return params
+
+    def request(self, use_cache=True, **kwargs):
+        """
+        Compute a result, takes the same arguments as PVWatts.request.
+        use_cache is accepted for compatibility, results are not cached.
+
+        :rtype: PVWattsResult
+        """
+        index, result = next(self.request_many([kwargs]))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def request_many(self, batch):
+        """
+        Compute many results. Requests are grouped by weather station and
+        array_type, window requests at a time, and each group is computed
+        chunk_size systems at a time. Failures are reported per item, like
+        PVWatts.request_many.
+
+        :param batch: Iterable of dictionaries with request() arguments
+        :return: Generator of (index, result) tuples in input order, result
+                 being a PVWattsResult or the exception raised for that item
+        """
+        items = []
+        for index, kwargs in enumerate(batch):
+            items.append(self._prepare(kwargs))
+            if len(items) == self.window:
+                for item in self._compute(index + 1 - len(items), items):
+                    yield item
+                items = []
+        if items:
+            for item in self._compute(index + 1 - len(items), items):
+                yield item
+
+    def _prepare(self, kwargs):
+        kwargs = dict(kwargs)
+        kwargs.pop('use_cache', None)
+        try:
+            params = self.build_params(**kwargs)
+            station, meters = self.find_station(
+                params['lat'], params['lon'], params['file_id'],
+                params['radius'])
+        except (PVWattsError, TypeError) as e:
+            return e
+        return params, station, meters
+
+    def _compute(self, start, items):
+        results = [item if isinstance(item, Exception) else None
+                   for item in items]
+        groups = {}
+        for position, item in enumerate(items):
+            if results[position] is None:
+                key = (item[0]['array_type'], item[1])
+                groups.setdefault(key, []).append(position)
+        for (array_type, station), positions in sorted(groups.items()):
+            for offset in range(0, len(positions), self.chunk_size):
+                chunk = positions[offset:offset + self.chunk_size]
+                outputs = self._simulate(array_type, station,
+                                         [items[position][0]
+                                          for position in chunk])
+                for row, position in enumerate(chunk):
+                    results[position] = self._result(items[position],
+                                                     outputs, row)
+        for position, result in enumerate(results):
+            yield start + position, result
+
+    def _simulate(self, array_type, station, systems):
+        weather = self.stations[station]
+        if station not in self._sun:
+            self._sun[station] = solar_position(
+                weather.day, weather.hour, weather.lat, weather.lon,
+                weather.tz)
+
+        def column(name, default):
+            return [default if params[name] is None else params[name]
+                    for params in systems]
+
+        return simulate(
+            weather, column('system_capacity', None),
+            module_type=column('module_type', 0),
+            losses=column('losses', 14), array_type=array_type,
+            tilt=column('tilt', None), azimuth=column('azimuth', None),
+            dc_ac_ratio=column('dc_ac_ratio', DC_AC_RATIO),
+            gcr=column('gcr', GCR), inv_eff=column('inv_eff', INV_EFF),
+            albedo=self.albedo, sun=self._sun[station])
+
+    def _result(self, item, outputs, row):
+        numpy = import_numpy()
+        params, station, meters = item
+        station = self.stations[station]
+        starts = (0,) + MONTH_BOUNDS
+        ac, dc, poa = (outputs[name][row] for name in ('ac', 'dc', 'poa'))
+        ac_monthly = numpy.add.reduceat(ac, starts) / 1000
+        poa_monthly = numpy.add.reduceat(poa, starts) / 1000
+        ac_annual = float(ac_monthly.sum())
+        result = {
+            'inputs': dict((name, str(value))
+                           for name, value in params.items()
+                           if value is not None),
+            'errors': [],
+            'warnings': [],
+            'version': VERSION,
+            'ssc_info': {'engine': 'pypvwatts.local'},
+            'station_info': dict(station.station_info,
+                                 distance=int(round(meters))),
+            'outputs': {
+                'ac_monthly': ac_monthly.tolist(),
+                'dc_monthly': (numpy.add.reduceat(dc, starts) /
+                               1000).tolist(),
+                'poa_monthly': poa_monthly.tolist(),
+                'solrad_monthly': (poa_monthly /
+                                   (numpy.asarray(MONTH_HOURS) / 24)
+                                   ).tolist(),
+                'ac_annual': ac_annual,
+                'solrad_annual': float(poa_monthly.sum() / 365),
+                'capacity_factor': ac_annual / (
+                    params['system_capacity'] * 8760) * 100,
+            },
+        }
+        if params['timeframe'] == 'hourly':
+            hourly = {'ac': ac, 'dc': dc, 'poa': poa,
+                      'tcell': outputs['tcell'][row], 'dn': station.dni,
+                      'df': station.dhi, 'tamb': station.tamb,
+                      'wspd': station.wspd}
+            for name in PVWattsResult.hourly_fields:
+                result['outputs'][name] = numpy.array(hourly[name],
+                                                      dtype=self.dtype)
+        return PVWattsResult(result, columnar=self.columnar, dtype=self.dtype)
@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+Decoding and post-processing responses in a pool of processes.
+
+Decoding hourly JSON and computing metrics from results is CPU bound, and
+in one interpreter it caps batches long before the network does. A
+ProcessDecoder hands response bodies to worker processes, which decode
+them, convert hourly fields to numpy arrays and run an optional
+postprocess function on the PVWattsResult. Hourly arrays come back through
+shared memory slots reused from one response to the next, so only the
+small rest of the response and the metrics are pickled.
+
+Shared memory requires Python 3.8. postprocess must be picklable, that is
+a function defined at the top level of a module.
+"""
+from .pvwattsresult import PVWattsResult, import_numpy
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import threading
+
+HOURS = 8760
+
+# Shared memory slots attached in a worker process, by name
+_attached = {}
+
+
+def _shared_memory():
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise ImportError('ProcessDecoder requires Python 3.8 or later')
+    return shared_memory
+
+
+def _attach(name):
+    slot = _attached.get(name)
+    if slot is None:
+        shared_memory = _shared_memory()
+        try:
+            # the parent owns the slot, do not let this process unlink it
+            slot = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            slot = _attach_untracked(shared_memory, name)
+        _attached[name] = slot
+    return slot
+
+
+def _attach_untracked(shared_memory, name):
+    """
+    Attach a slot without registering it with the resource tracker, as
+    track=False does from Python 3.13. Registered, a worker with its own
+    tracker, as under the spawn start method, would unlink the slot when
+    exiting. Unregistering it afterwards would not do either: with the
+    tracker of the parent, as under fork, it drops the parent's own
+    registration. Workers run one task at a time.
+    """
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def decode_body(body, slot=None, dtype='float64', postprocess=None):
+    """
+    Decode a response body, converting hourly fields to arrays of dtype,
+    and run postprocess on its PVWattsResult. Run in worker processes.
+
+    :param slot: Name of the shared memory slot the hourly arrays are
+                 copied to, the ones that do not fit stay in the response
+    :return: (response, layout, metrics) tuple, layout listing the (name,
+             offset, length) of each array in the slot
+    """
+    numpy = import_numpy()
+    data = json.loads(body.decode('utf8') if isinstance(body, bytes)
+                      else body)
+    outputs = data.get('outputs') or {}
+    for name in PVWattsResult.hourly_fields:
+        if isinstance(outputs.get(name), list):
+            outputs[name] = numpy.asarray(outputs[name], dtype=dtype)
+    metrics = None
+    if postprocess is not None:
+        metrics = postprocess(PVWattsResult(data, columnar=True,
+                                            dtype=dtype))
+    layout = []
+    if slot is not None:
+        buffer = _attach(slot).buf
+        offset = 0
+        for name in PVWattsResult.hourly_fields:
+            values = outputs.get(name)
+            if not isinstance(values, numpy.ndarray) or \
+                    offset + values.nbytes > len(buffer):
+                continue
+            view = numpy.frombuffer(buffer, dtype=values.dtype,
+                                    count=len(values), offset=offset)
+            view[:] = values
+            del view
+            layout.append((name, offset, len(values)))
+            offset += values.nbytes
+            del outputs[name]
+    return data, layout, metrics
+
+
+class ProcessDecoder(object):
+    """
+    Pool of processes decoding and post-processing responses, with a
+    shared memory slot per response in flight
+
+    :param processes: Number of worker processes, defaults to the number
+                      of CPUs
+    :param postprocess: Function of a PVWattsResult run in the workers,
+                        its return value is pickled back as the metrics
+    :param dtype: dtype of the hourly arrays
+    :param slots: Responses decoded at a time, defaults to twice the
+                  number of processes. Threads decoding more wait for a
+                  free slot.
+    :param context: multiprocessing context the workers are started with,
+                    such as multiprocessing.get_context('spawn')
+    """
+    def __init__(self, processes=None, postprocess=None, dtype='float64',
+                 slots=None, context=None):
+        shared_memory = _shared_memory()
+        numpy = import_numpy()
+        self.processes = processes or os.cpu_count() or 1
+        self.postprocess = postprocess
+        self.dtype = dtype
+        size = len(PVWattsResult.hourly_fields) * HOURS * \
+            numpy.dtype(dtype).itemsize
+        self._slots = [shared_memory.SharedMemory(create=True, size=size)
+                       for _ in range(slots or 2 * self.processes)]
+        self._free = list(self._slots)
+        self._available = threading.Condition()
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=context)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def decode(self, body):
+        """
+        Decode a response body in the pool, blocking until it is done
+
+        :return: (response, metrics) tuple, hourly fields being arrays
+        """
+        numpy = import_numpy()
+        with self._available:
+            while not self._free:
+                self._available.wait()
+            slot = self._free.pop()
+        try:
+            data, layout, metrics = self.executor.submit(
+                decode_body, body, slot.name, self.dtype,
+                self.postprocess).result()
+            outputs = data['outputs'] if layout else None
+            for name, offset, length in layout:
+                outputs[name] = numpy.frombuffer(
+                    slot.buf, dtype=self.dtype, count=length,
+                    offset=offset).copy()
+        finally:
+            with self._available:
+                self._free.append(slot)
+                self._available.notify()
+        return data, metrics
+
+    def postprocess_data(self, data):
+        """
+        Run postprocess on an already decoded response, in this process
+        """
+        if self.postprocess is None:
+            return None
+        return self.postprocess(PVWattsResult(data, columnar=True,
+                                              dtype=self.dtype))
+
+    def close(self):
+        """
+        Shut the worker processes down and release the shared memory
+        """
+        self.executor.shutdown()
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = self._free = []
@@ -0,0 +1,324 @@
+# coding: utf-8
+"""
+Response caches for PVWatts requests.
+"""
+import collections
+import hashlib
+import json
+import numbers
+import os
+import tempfile
+import threading
+import time
+
+
+def _json_default(value):
+    # numpy arrays, as decoded by pypvwatts.streaming
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def cache_key(params):
+    """
+    Return the cache key for a parameters dictionary. api_key and None
+    values are left out and numbers are normalized, so 40 and 40.0 map to
+    the same key.
+    """
+    items = []
+    for name, value in params.items():
+        if value is None or name == 'api_key':
+            continue
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            value = repr(float(value))
+        items.append((name, value))
+    canonical = json.dumps(sorted(items), separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf8')).hexdigest()
+
+
+class PVWattsCache(object):
+    """
+    Base class for response caches, keeps hit and miss counters
+
+    :param ttl: Seconds an entry stays valid, None to never expire
+    :param max_size: Maximum number of entries, least recently used ones
+                     are evicted first. None for no limit.
+    """
+    def __init__(self, ttl=None, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached response for key, None when missing or expired
+        """
+        with self._lock:
+            value = self._get(key, time.time())
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Store a response under key
+        """
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._set(key, value, expires)
+
+    def clear(self):
+        """
+        Remove every entry and reset the counters
+        """
+        with self._lock:
+            self._clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self)}
+
+    def _get(self, key, now):
+        raise NotImplementedError
+
+    def _set(self, key, value, expires):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(PVWattsCache):
+    """
+    In memory LRU cache
+    """
+    def __init__(self, ttl=None, max_size=1024):
+        PVWattsCache.__init__(self, ttl=ttl, max_size=max_size)
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, now):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= now:
+            return None
+        self._entries[key] = entry
+        return value
+
+    def _set(self, key, value, expires):
+        self._entries.pop(key, None)
+        self._entries[key] = (expires, value)
+        if self.max_size is not None:
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _clear(self):
+        self._entries.clear()
+
+
+class SQLiteCache(PVWattsCache):
+    """
+    On disk cache stored in a sqlite database, entries survive restarts
+
+    :param wal: Use write ahead logging, so processes of one host can read
+                while another writes. Not for network filesystems.
+    :param timeout: Seconds to wait for a lock held by another process
+    """
+    def __init__(self, path, ttl=None, max_size=None, wal=False,
+                 timeout=30.0):
+        import sqlite3
+        PVWattsCache.__init__(self, ttl=ttl, max_size=max_size)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   check_same_thread=False)
+        if wal:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires REAL, accessed REAL NOT NULL)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed '
+                'ON responses (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _get(self, key, now):
+        row = self._db.execute(
+            'SELECT value, expires FROM responses WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        with self._db:
+            if expires is not None and expires <= now:
+                self._db.execute('DELETE FROM responses WHERE key = ?',
+                                 (key,))
+                return None
+            self._db.execute('UPDATE responses SET accessed = ? '
+                             'WHERE key = ?', (now, key))
+        return json.loads(value)
+
+    def _set(self, key, value, expires):
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, default=_json_default), expires,
+                 time.time()))
+            if self.max_size is not None:
+                self._db.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    'SELECT key FROM responses '
+                    'ORDER BY accessed DESC, rowid DESC '
+                    'LIMIT -1 OFFSET ?)', (self.max_size,))
+
+    def _clear(self):
+        with self._db:
+            self._db.execute('DELETE FROM responses')
+
+
+class DirectoryCache(PVWattsCache):
+    """
+    Cache of one JSON file per entry, named after its key, shared by the
+    processes and hosts using the same directory, for instance on a network
+    filesystem. An entry file holds its expiry time on the first line and
+    the response on the second. Entries are written to a temporary file
+    renamed over the entry, so readers never see a partial entry and
+    concurrent writers of a key leave one whole entry. Use it with a
+    FileSingleFlight so processes making the same request wait for each
+    other instead of all sending it.
+
+    :param prune_every: With a max_size, writes of this process between
+                        two prune() runs, which evict the least recently
+                        read entries
+    """
+    def __init__(self, path, ttl=None, max_size=None, prune_every=256):
+        PVWattsCache.__init__(self, ttl=ttl, max_size=max_size)
+        self.path = path
+        self.prune_every = prune_every
+        self._writes = 0
+        _makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def _files(self):
+        for name in os.listdir(self.path):
+            directory = os.path.join(self.path, name)
+            if len(name) != 2 or not os.path.isdir(directory):
+                continue
+            for entry in os.listdir(directory):
+                if entry.endswith('.json'):
+                    yield os.path.join(directory, entry)
+
+    def __len__(self):
+        return sum(1 for _ in self._files())
+
+    def _get(self, key, now):
+        path = self._file(key)
+        try:
+            with open(path) as file:
+                expires = json.loads(file.readline())
+                if expires is not None and expires <= now:
+                    value = None
+                else:
+                    value = json.loads(file.readline())
+        except (IOError, OSError, ValueError):
+            return None
+        if value is None:
+            _remove(path)
+        elif self.max_size is not None:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return value
+
+    def _set(self, key, value, expires):
+        path = self._file(key)
+        directory = os.path.dirname(path)
+        _makedirs(directory)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.',
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(json.dumps(expires) + '\n')
+                file.write(json.dumps(value, default=_json_default) + '\n')
+            _replace(temporary, path)
+        except BaseException:
+            _remove(temporary)
+            raise
+        self._writes += 1
+        if self.max_size is not None and \
+                self._writes % self.prune_every == 0:
+            self._prune(time.time())
+
+    def prune(self):
+        """
+        Remove expired entries, then the least recently read ones above
+        max_size
+        """
+        with self._lock:
+            self._prune(time.time())
+
+    def _prune(self, now):
+        entries = []
+        for path in self._files():
+            try:
+                with open(path) as file:
+                    expires = json.loads(file.readline())
+                accessed = os.path.getmtime(path)
+            except (IOError, OSError, ValueError):
+                continue
+            if expires is not None and expires <= now:
+                _remove(path)
+            else:
+                entries.append((accessed, path))
+        if self.max_size is not None and len(entries) > self.max_size:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_size]:
+                _remove(path)
+
+    def _clear(self):
+        for path in list(self._files()):
+            _remove(path)
+
+
+def _makedirs(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created meanwhile by another process
+            if not os.path.isdir(path):
+                raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# atomic rename over an existing file, os.rename only is on POSIX
+_replace = getattr(os, 'replace', os.rename)
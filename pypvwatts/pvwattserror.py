@@ -13,3 +13,11 @@ class PVWattsValidationError(PVWattsError):
     """
     def __init__(self, message):
         PVWattsError.__init__(self, message)
+
+
+class PVWattsRateLimitError(PVWattsError):
+    """
+    Rate limit exceeded, retries included
+    """
+    def __init__(self, message):
+        PVWattsError.__init__(self, message)
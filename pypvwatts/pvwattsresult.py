@@ -1,6 +1,69 @@
 # coding: utf-8
+from .rescale import response_capacity
 
-class PVWattsResult(object):
+# Hours in each month of the non leap year PVWatts simulates
+MONTH_HOURS = (744, 672, 744, 720, 744, 720, 744, 744, 720, 744, 720, 744)
+# Hour at which each month after January starts
+MONTH_BOUNDS = tuple(sum(MONTH_HOURS[:month]) for month in range(1, 12))
+
+
+def import_numpy():
+    """
+    Import numpy, which is only needed for the array based features
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('numpy is required, install it with '
+                          'pip install pypvwatts[numpy]')
+    return numpy
+
+
+class _ResultViews(object):
+    """
+    Array views of hourly fields shared by the result classes, which
+    provide column()
+    """
+    __slots__ = ()
+
+    def daily(self, name):
+        """
+        Return an hourly output field as a (365, 24) view
+        """
+        return self.column(name).reshape(-1, 24)
+
+    def monthly(self, name):
+        """
+        Return an hourly output field as a list of 12 views, one per month
+        """
+        return import_numpy().split(self.column(name), MONTH_BOUNDS)
+
+    def time_index(self, utc=False):
+        """
+        Return the timestamps of the hours of hourly fields, in the local
+        standard time of the station or in UTC, see pypvwatts.timeindex
+        """
+        from .timeindex import station_tz, time_index
+        return time_index(station_tz(self), utc=utc)
+
+    def resample(self, name, freq='M', how='sum'):
+        """
+        Return an hourly output field rolled up to days (D), months (M) or
+        the year (A) with sum, mean, min or max
+        """
+        from .timeindex import resample
+        return resample(self.column(name), freq=freq, how=how)
+
+    def save(self, path):
+        """
+        Save the result to a binary archive, see pypvwatts.archive
+        """
+        from .archive import ArchiveWriter
+        with ArchiveWriter(path) as writer:
+            writer.write(self)
+
+
+class PVWattsResult(_ResultViews):
     """
     Result class for PVWatts request
     """
@@ -8,16 +71,73 @@ class PVWattsResult(object):
     shortcut_fields = ('poa_monthly', 'dc_monthly', 'ac_annual',
                        'solrad_annual', 'solrad_monthly', 'ac_monthly',
                        'ac', 'poa', 'dn', 'dc', 'df', 'tamb', 'tcell', 'wspd')
+    # Hourly output fields, converted to arrays in columnar mode
+    hourly_fields = ('ac', 'poa', 'dn', 'dc', 'df', 'tamb', 'tcell', 'wspd')
+    # Return value of the postprocess function of a ProcessDecoder, see
+    # pypvwatts.processing
+    metrics = None
 
-    def __init__(self, result):
+    def __init__(self, result, columnar=False, dtype='float64'):
         """
         Creates instance of PVWattsResult from the JSON API response
+
+        :param columnar: Convert hourly fields to numpy arrays of dtype on
+                         first access, releasing the original lists
         """
+        self.columnar = columnar
+        self.dtype = dtype
+        if columnar and 'outputs' in result:
+            # columns replace the lists in a copy, callers such as caches
+            # may still hold the response
+            result = dict(result, outputs=dict(result['outputs']))
         self.result = result
+        self._raw = None
 
     @property
     def raw(self):
-        return self.result
+        """
+        The response as decoded from JSON. In columnar mode the arrays are
+        converted back to lists on first access, and kept until another
+        field is converted.
+        """
+        if self._raw is None:
+            outputs = self.result.get('outputs')
+            if not outputs or not any(hasattr(value, 'tolist')
+                                      for value in outputs.values()):
+                return self.result
+            self._raw = dict(self.result, outputs=_lists(outputs))
+        return self._raw
+
+    def column(self, name):
+        """
+        Return an hourly output field as a numpy array. In columnar mode the
+        array replaces the decoded list, so it is only converted once.
+        """
+        numpy = import_numpy()
+        outputs = self.result['outputs']
+        column = outputs[name]
+        if not isinstance(column, numpy.ndarray):
+            column = numpy.asarray(column, dtype=self.dtype)
+            if self.columnar:
+                outputs[name] = column
+                self._raw = None
+        return column
+
+    def compact(self):
+        """
+        Return the result as a CompactPVWattsResult
+        """
+        return CompactPVWattsResult(self.result, columnar=self.columnar,
+                                    dtype=self.dtype)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Load a result saved with save(). With mmap the file is memory mapped
+        and output columns are only read when accessed.
+        """
+        from .archive import PVWattsArchive
+        return PVWattsArchive(path, mmap=mmap)[0]
 
     def __getattr__(self, name):
         """
@@ -25,6 +145,8 @@ class PVWattsResult(object):
         """
         result = None
         if name in PVWattsResult.shortcut_fields and 'outputs' in self.result:
+            if self.columnar and name in PVWattsResult.hourly_fields:
+                return self.column(name)
             return self.result['outputs'][name]
         if name is not None:
             return self.result[name]
@@ -35,3 +157,159 @@ class PVWattsResult(object):
 
     def __str__(self):
         return self.__unicode__().encode('utf8')
+
+
+def _lists(outputs):
+    return dict((name, value.tolist() if hasattr(value, 'tolist') else value)
+                for name, value in outputs.items())
+
+
+# Derived metrics not computed yet
+_PENDING = object()
+
+
+class CompactPVWattsResult(_ResultViews):
+    """
+    PVWattsResult for code handling many results: output fields are bound
+    to slots once, so reading them is a plain attribute access, no
+    per instance dictionary is kept, and derived metrics are computed on
+    first access only. In columnar mode hourly fields are converted to
+    numpy arrays right away and the decoded lists are released.
+
+    The attributes, raw and result are the same as PVWattsResult's.
+    """
+    __slots__ = PVWattsResult.shortcut_fields + (
+        'columnar', 'dtype', 'metrics', '_result', '_outputs', '_raw',
+        '_capacity_factor', '_specific_yield', '_peak_ac')
+
+    def __init__(self, result, columnar=False, dtype='float64'):
+        self.columnar = columnar
+        self.dtype = dtype
+        self.metrics = None
+        self._raw = None
+        self._capacity_factor = self._specific_yield = self._peak_ac = \
+            _PENDING
+        outputs = result.get('outputs')
+        if outputs is None:
+            self._result = result
+            self._outputs = None
+            return
+        # the other fields, without the outputs bound to slots
+        self._result = dict((name, value) for name, value in result.items()
+                            if name != 'outputs')
+        self._outputs = dict(outputs)
+        numpy = import_numpy() if columnar else None
+        for name in PVWattsResult.shortcut_fields:
+            if name not in outputs:
+                continue
+            value = self._outputs.pop(name)
+            if columnar and name in PVWattsResult.hourly_fields and \
+                    isinstance(value, list):
+                value = numpy.asarray(value, dtype=dtype)
+            setattr(self, name, value)
+
+    def _output(self, name):
+        """
+        Return a bound output field, None when the response has none
+        """
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            return None
+
+    def _bound(self):
+        outputs = dict(self._outputs)
+        for name in PVWattsResult.shortcut_fields:
+            value = self._output(name)
+            if value is not None:
+                outputs[name] = value
+        return outputs
+
+    @property
+    def result(self):
+        if self._outputs is None:
+            return self._result
+        return dict(self._result, outputs=self._bound())
+
+    @property
+    def raw(self):
+        """
+        The response as decoded from JSON, arrays converted back to lists on
+        first access
+        """
+        if self._outputs is None:
+            return self._result
+        if self._raw is None:
+            self._raw = dict(self._result, outputs=_lists(self._bound()))
+        return self._raw
+
+    def column(self, name):
+        """
+        Return an hourly output field as a numpy array
+        """
+        numpy = import_numpy()
+        column = getattr(self, name)
+        if not isinstance(column, numpy.ndarray):
+            column = numpy.asarray(column, dtype=self.dtype)
+        return column
+
+    @property
+    def capacity(self):
+        """
+        system_capacity of the request in kW, None when not echoed
+        """
+        return response_capacity(self._result)
+
+    @property
+    def capacity_factor(self):
+        """
+        AC capacity factor in percent, as reported by PVWatts or from
+        ac_annual
+        """
+        if self._capacity_factor is _PENDING:
+            value = (self._outputs or {}).get('capacity_factor')
+            if value is None:
+                yield_ = self.specific_yield
+                value = None if yield_ is None else yield_ / 87.6
+            self._capacity_factor = value
+        return self._capacity_factor
+
+    @property
+    def specific_yield(self):
+        """
+        Annual AC energy per kW of capacity, in kWh/kWp
+        """
+        if self._specific_yield is _PENDING:
+            capacity = self.capacity
+            ac_annual = self._output('ac_annual')
+            self._specific_yield = ac_annual / capacity \
+                if capacity and ac_annual is not None else None
+        return self._specific_yield
+
+    @property
+    def peak_ac(self):
+        """
+        Highest hourly AC output in W, None without hourly outputs
+        """
+        if self._peak_ac is _PENDING:
+            ac = self._output('ac')
+            if ac is not None:
+                ac = float(ac.max() if hasattr(ac, 'max') else max(ac))
+            self._peak_ac = ac
+        return self._peak_ac
+
+    def __getattr__(self, name):
+        """
+        Access the other response fields as properties
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._result[name]
+
+    def __getstate__(self):
+        return self.result, self.columnar, self.dtype, self.metrics
+
+    def __setstate__(self, state):
+        result, columnar, dtype, metrics = state
+        self.__init__(result, columnar=columnar, dtype=dtype)
+        self.metrics = metrics
@@ -2,17 +2,25 @@
 """
 Python wrapper for NREL PVWatt version 6.
 """
-from .pvwattsresult import PVWattsResult
-from .pvwattserror import PVWattsError, PVWattsValidationError
-import requests
+from .pvwattsresult import CompactPVWattsResult, PVWattsResult
+from .pvwattserror import (PVWattsError, PVWattsRateLimitError,
+                           PVWattsValidationError)
+from .pvwattscache import cache_key
+from .ratelimit import RetryPolicy
+from .rescale import (capacity_key, check_rescale, rescale_response,
+                      response_capacity)
+from .streaming import decode_stream
+from .validation import FIELDS, validate_batch
+from .sweep import run_sweep
+from .transport import HTTPClientTransport, create_session
 from .__version__ import VERSION
 
+from concurrent.futures import (FIRST_COMPLETED, Future,
+                                ThreadPoolExecutor, wait)
+import collections
 import functools
-import sys
-
-if sys.version_info > (3,):
-    long = int
-    unicode = str
+import threading
+import time
 
 
 # this decorator lets me use methods as both static and instance methods
@@ -24,6 +32,147 @@ class omnimethod(object):
         return functools.partial(self.func, instance)
 
 
+def _outcome(future):
+    """
+    Return the future's result, or the exception it raised
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def dispatch(func, items, max_workers, ordered=True):
+    """
+    Apply func to items over a thread pool, keeping at most twice
+    max_workers items in flight. Items that are already exceptions are
+    passed through without calling func.
+
+    :return: Generator of (index, result or exception) tuples
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    window = 2 * max_workers
+    pending = collections.OrderedDict()
+    items = enumerate(items)
+
+    def submit():
+        for index, item in items:
+            if isinstance(item, Exception):
+                future = Future()
+                future.set_exception(item)
+            else:
+                future = executor.submit(func, item)
+            pending[future] = index
+            if len(pending) >= window:
+                return
+
+    try:
+        submit()
+        while pending:
+            if ordered:
+                done = [next(iter(pending))]
+                wait(done)
+            else:
+                done = wait(pending, return_when=FIRST_COMPLETED).done
+            for future in done:
+                index = pending.pop(future)
+                yield index, _outcome(future)
+            submit()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+class _CountedChunks(object):
+    """
+    Iterator over response chunks counting their bytes
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self.chunks)
+        self.bytes += len(chunk)
+        return chunk
+
+    next = __next__
+
+
+class CacheLookup(object):
+    """
+    Cache lookup and store of one request, shared by PVWatts and
+    AsyncPVWatts. The key depends on the client options: with rescale it
+    leaves the capacity out, with a station_index it is the station instead
+    of the coordinates when the station is known.
+    """
+    def __init__(self, client, params, use_cache):
+        self.client = client
+        self.params = params
+        self.cache = client.cache if use_cache else None
+        self.scale = self.cache is not None and client.rescale and \
+            params.get('system_capacity') is not None
+        self.stations = client.station_index if self.cache is not None \
+            else None
+        self.station = None
+        self.scaled = None
+        if self.stations is not None:
+            self.station = self.stations.resolve(params)
+        if self.cache is not None:
+            self.key = self._key(self.station)
+
+    def _key(self, station):
+        params = self.params
+        if station is not None:
+            params = self.stations.key_params(params, station)
+        return capacity_key(params) if self.scale else cache_key(params)
+
+    def get(self):
+        """
+        Return the cached response, or None when it must be requested
+        """
+        if self.cache is None:
+            return None
+        data = self.cache.get(self.key)
+        if data is None:
+            return None
+        if self.station is not None:
+            data = self.stations.adapt(data, self.params, self.station)
+        if self.scale:
+            self.scaled = rescale_response(data,
+                                           self.params['system_capacity'])
+            if self.client.rescale_strict:
+                return None
+            data = self.scaled
+        if self.client.hooks is not None:
+            self.client.hooks.emit('cache_hit', {'params': self.params})
+        return data
+
+    def set(self, data):
+        """
+        Check a strictly rescaled response against the actual one, and cache
+        the actual one
+        """
+        if self.scaled is not None:
+            check_rescale(self.scaled, data)
+        # responses reporting errors, such as rate limiting, are not cached,
+        # nor can responses without their capacity be rescaled
+        if self.cache is None or data.get('errors') or \
+                self.scale and response_capacity(data) is None:
+            return
+        key = self.key
+        if self.stations is not None and data.get('station_info'):
+            station = self.stations.observe(self.params,
+                                            data['station_info'])
+            if station is not None:
+                key = self._key(station)
+        self.cache.set(key, data)
+
+
 class PVWatts():
     '''
     A Python wrapper for NREL PVWatts V6.0.0 API
@@ -31,271 +180,517 @@ class PVWatts():
 
     PVWATTS_QUERY_URL = 'https://developer.nrel.gov/api/pvwatts/v6.json'
     api_key = 'DEMO_KEY'
-
-    def __init__(self, api_key='DEMO_KEY', proxies=None):
-        PVWatts.api_key = api_key
+    proxies = None
+    # Response cache, see pypvwatts.pvwattscache
+    cache = None
+    # Coalescing of identical concurrent requests, see
+    # pypvwatts.singleflight
+    single_flight = None
+    # Rescale cached responses to other system capacities, see
+    # pypvwatts.rescale. Strict rescaling still sends the request and checks
+    # the rescaled response against it.
+    rescale = False
+    rescale_strict = False
+    # Share cache entries between sites of the same weather station, see
+    # pypvwatts.stations
+    station_index = None
+    # Request pacing and retries on 429 and 5xx, see pypvwatts.ratelimit
+    rate_limiter = None
+    # Spread requests over several API keys, see pypvwatts.keypool
+    key_pool = None
+    retry = RetryPolicy()
+    # Request lifecycle events, see pypvwatts.hooks
+    hooks = None
+    # Hourly fields as numpy arrays, see PVWattsResult
+    columnar = False
+    dtype = 'float64'
+    # Results as CompactPVWattsResult
+    compact = False
+    # Decode responses incrementally, see pypvwatts.streaming
+    streaming = False
+    chunk_size = 65536
+
+    # Transport requests are sent with, see pypvwatts.transport. Without one
+    # each instance, and the class for class level requests, creates its
+    # own HTTPClientTransport.
+    transport = None
+    # HTTP connection pool settings, used by the class level session when
+    # methods are called on the class and overridable per instance
+    pool_connections = 10
+    pool_maxsize = 10
+    max_retries = 0
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    def __init__(self, api_key='DEMO_KEY', proxies=None, pool_connections=10,
+                 pool_maxsize=10, max_retries=0, cache=None,
+                 rate_limiter=None, retry=None, columnar=False,
+                 dtype='float64', streaming=False, chunk_size=65536,
+                 single_flight=None, rescale=False, rescale_strict=False,
+                 station_index=None, key_pool=None, hooks=None,
+                 compact=False, transport=None):
+        self.api_key = api_key
         self.proxies = proxies
+        self.cache = cache
+        self.single_flight = single_flight
+        self.rescale = rescale
+        self.rescale_strict = rescale_strict
+        self.station_index = station_index
+        self.rate_limiter = rate_limiter
+        self.key_pool = key_pool
+        self.hooks = hooks
+        if retry is not None:
+            self.retry = retry
+        self.columnar = columnar
+        self.dtype = dtype
+        self.compact = compact
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.transport = transport
+        self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    create_session = staticmethod(create_session)
 
     @omnimethod
-    def validate_system_capacity(self, system_capacity):
-        if system_capacity is None:
-            return
-
-        if not isinstance(system_capacity, (int, long, float)):
-            raise PVWattsValidationError(
-                'system_capacity must be int, long or float')
+    def get_session(self):
+        """
+        Return the transport requests are sent with: the one given, or the
+        pooled HTTPClientTransport created on first use. Called on the class
+        it returns the transport shared by all class level requests.
+        """
+        owner = self if self is not None else PVWatts
+        if owner.transport is not None:
+            return owner.transport
+        if owner._session is None:
+            with PVWatts._session_lock:
+                if owner._session is None:
+                    owner._session = HTTPClientTransport(
+                        pool_connections=owner.pool_connections,
+                        pool_maxsize=owner.pool_maxsize,
+                        max_retries=owner.max_retries)
+        return owner._session
 
-        if not (0.05 <= system_capacity and system_capacity <= 500000):
-            raise PVWattsValidationError(
-                'system_capacity must be >= 0.05 and <= 500000')
+    @omnimethod
+    def close(self):
+        """
+        Close the transport's pooled connections. A new transport is
+        created if further requests are made, a given one is reused.
+        """
+        owner = self if self is not None else PVWatts
+        with PVWatts._session_lock:
+            session = owner._session
+            owner._session = None
+        if session is not None:
+            session.close()
+        if owner.transport is not None:
+            owner.transport.close()
 
-        return system_capacity
+    @omnimethod
+    def validate_system_capacity(self, system_capacity):
+        return FIELDS['system_capacity'].validate(system_capacity)
 
     @omnimethod
     def validate_module_type(self, module_type):
-        if module_type is None:
-            return
-
-        if not isinstance(module_type, (int, float, long)):
-            raise PVWattsValidationError(
-                'module_type must be int, long or float')
-
-        if module_type not in (0, 1, 2):
-            raise PVWattsValidationError(
-                'module_type must be 0, 1 or 2')
-
-        return module_type
+        return FIELDS['module_type'].validate(module_type)
 
     @omnimethod
     def validate_losses(self, losses):
-        if losses is None:
-            return
-
-        if not isinstance(losses, (int, long, float)):
-            raise PVWattsValidationError('losses must be int, long or float')
-
-        if not (-5 <= losses and losses <= 99):
-            raise PVWattsValidationError('losses must be >= -5\% and <= 99%')
-
-        return losses
+        return FIELDS['losses'].validate(losses)
 
     @omnimethod
     def validate_array_type(self, array_type):
-        if array_type is None:
-            return
-
-        if not isinstance(array_type, (int, long, float)):
-            raise PVWattsValidationError(
-                'array_type must be int, long or float')
-
-        if array_type not in (0, 1, 2, 3, 4):
-            raise PVWattsValidationError(
-                'array_type must be 0, 1, 2, 3 or 4')
-
-        return array_type
+        return FIELDS['array_type'].validate(array_type)
 
     @omnimethod
     def validate_tilt(self, tilt):
-        if tilt is None:
-            return
-
-        if not isinstance(tilt, (int, long, float)):
-            raise PVWattsValidationError('tilt must be int, long or float')
-
-        if not (0 <= tilt and tilt <= 90):
-            raise PVWattsValidationError('tilt must be >= 0 and <= 90')
-
-        return tilt
+        return FIELDS['tilt'].validate(tilt)
 
     @omnimethod
     def validate_azimuth(self, azimuth):
-        if azimuth is None:
-            return
-
-        if not isinstance(azimuth, (int, long, float)):
-            raise PVWattsValidationError('azimuth must be int, long or float')
-
-        if not (0 <= azimuth and azimuth <= 360):
-            raise PVWattsValidationError('azimuth must be >= 0 and <= 360')
-
-        return azimuth
+        return FIELDS['azimuth'].validate(azimuth)
 
     @omnimethod
     def validate_lat(self, lat):
-        if lat is None:
-            return
-
-        if not isinstance(lat, (int, long, float)):
-            raise PVWattsValidationError('lat must be int, long or float')
-
-        if not (-90 <= lat and lat <= 90):
-            raise PVWattsValidationError('lat must be >= -90 and <= 90')
-
-        return lat
+        return FIELDS['lat'].validate(lat)
 
     @omnimethod
     def validate_lon(self, lon):
-        if lon is None:
-            return
-
-        if not isinstance(lon, (int, long, float)):
-            raise PVWattsValidationError('lon must be int, long or float')
-
-        if not (-180 <= lon and lon <= 180):
-            raise PVWattsValidationError('lon must be >= -180 and <= 180')
-
-        return lon
+        return FIELDS['lon'].validate(lon)
 
     @omnimethod
     def validate_dataset(self, dataset):
-        if dataset is None:
-            return
-
-        if not isinstance(dataset, (str, unicode)):
-            raise PVWattsValidationError('dataset must be str or unicode')
-
-        if dataset not in ('tmy2', 'tmy3', 'intl', 'nsrdb'):
-            raise PVWattsValidationError(
-                'dataset must be \'nsrdb\', \'tmy2\', \'tmy3\' or \'intl\'')
-
-        return dataset
+        return FIELDS['dataset'].validate(dataset)
 
     @omnimethod
     def validate_radius(self, radius):
-        if radius is None:
-            return
-
-        if not isinstance(radius, (int, long, float)):
-            raise PVWattsValidationError('radius must be int, long or float')
-
-        if not (0 <= radius):
-            raise PVWattsValidationError('radius must be >= 0')
-
-        return radius
+        return FIELDS['radius'].validate(radius)
 
     @omnimethod
     def validate_timeframe(self, timeframe):
-        if timeframe is None:
-            return
-
-        if not isinstance(timeframe, (str, unicode)):
-            raise PVWattsValidationError(
-                'timeframe must be str or unicode')
-
-        if timeframe not in ('hourly', 'monthly'):
-            raise PVWattsValidationError(
-                'dataset must be \'hourly\' or \'monthly\'')
-
-        return timeframe
+        return FIELDS['timeframe'].validate(timeframe)
 
     @omnimethod
     def validate_dc_ac_ratio(self, dc_ac_ratio):
-        if dc_ac_ratio is None:
-            return
-
-        if not isinstance(dc_ac_ratio, (int, long, float)):
-            raise PVWattsValidationError(
-                'dc_ac_ratio must be int, long or float')
-
-        if not (0 < dc_ac_ratio):
-            raise PVWattsValidationError(
-                'dc_ac_ratio must be positive')
-
-        return dc_ac_ratio
+        return FIELDS['dc_ac_ratio'].validate(dc_ac_ratio)
 
     @omnimethod
     def validate_gcr(self, gcr):
-        if gcr is None:
-            return
-
-        if not isinstance(gcr, (int, long, float)):
-            raise PVWattsValidationError('gcr must be int, long or float')
-
-        if not (0 <= gcr and gcr <= 3):
-            raise PVWattsValidationError('gcr must be >= 0 and <= 3')
-
-        return gcr
+        return FIELDS['gcr'].validate(gcr)
 
     @omnimethod
     def validate_inv_eff(self, inv_eff):
-        if inv_eff is None:
-            return
-
-        if not isinstance(inv_eff, (int, long, float)):
-            raise PVWattsValidationError('inv_eff must be int, long or float')
+        return FIELDS['inv_eff'].validate(inv_eff)
 
-        if not (90 <= inv_eff and inv_eff <= 99.5):
-            raise PVWattsValidationError('inv_eff must be >= 90 and <= 99.5')
+    @omnimethod
+    def validate_batch(self, batch):
+        """
+        Validate a whole batch of requests at once, see
+        pypvwatts.validation.validate_batch
 
-        return inv_eff
+        :param batch: Dictionary mapping parameter names to columns, or a
+                      list of dictionaries of request arguments
+        :return: List of (row, parameter, message) tuples, empty when the
+                 whole batch is valid
+        """
+        return validate_batch(batch)
 
     @property
     def version(self):
         return VERSION
 
     @omnimethod
-    def get_data(self, params={}):
+    def get_data(self, params={}, use_cache=True):
         """
         Make the request and return the deserialided JSON from the response
 
         :param params: Dictionary mapping (string) query parameters to values
         :type params: dict
+        :param use_cache: Set to False to bypass the response cache
+        :type use_cache: bool
         :return: JSON object with the data fetched from that URL as a
                  JSON-format object.
         :rtype: (dict or array)
 
         """
-        if self and hasattr(self, 'proxies') and self.proxies is not None:
-            response = requests.request('GET',
-                                        url=PVWatts.PVWATTS_QUERY_URL,
-                                        params=params,
-                                        headers={'User-Agent': ''.join(
-                                                 ['pypvwatts/', VERSION,
-                                                  ' (Python)'])},
-                                        proxies=self.proxies)
-        else:
-            response = requests.request('GET',
-                                        url=PVWatts.PVWATTS_QUERY_URL,
-                                        params=params,
-                                        headers={'User-Agent': ''.join(
-                                                 ['pypvwatts/', VERSION,
-                                                  ' (Python)'])})
-
-        if response.status_code == 403:
+        owner = self if self is not None else PVWatts
+        return owner.load_data(params, use_cache, owner.decode_response)[0]
+
+    @omnimethod
+    def decode_response(self, response):
+        """
+        Decode a response's JSON body, incrementally when streaming
+
+        :return: (data, bytes received, None) tuple, see load_data
+        """
+        owner = self if self is not None else PVWatts
+        if not owner.streaming:
+            return response.json(), len(response.content), None
+        chunks = _CountedChunks(response.iter_content(owner.chunk_size))
+        return decode_stream(chunks, dtype=owner.dtype), chunks.bytes, None
+
+    @omnimethod
+    def load_data(self, params, use_cache, decode):
+        """
+        Return the cached response for params, or send the request, decode
+        it and cache it, emitting the hooks events of both steps
+
+        :param decode: Function of the response returning a (data, bytes
+                       received, extra) tuple
+        :return: (data, extra, cached) tuple, extra being None for cached
+                 responses
+        """
+        owner = self if self is not None else PVWatts
+        hooks = owner.hooks
+        if hooks is not None:
+            start = time.time()
+        lookup = CacheLookup(owner, params, use_cache)
+        data = lookup.get()
+        if data is not None:
+            return data, None, True
+
+        stage = 'send'
+        try:
+            response = owner.send(params)
+            stage = 'decode'
+            if hooks is not None:
+                received = time.time()
+            data, size, extra = decode(response)
+        except Exception as e:
+            if hooks is not None:
+                hooks.emit('error', {'params': params, 'error': e,
+                                     'stage': stage})
+            raise
+        if hooks is not None:
+            now = time.time()
+            hooks.emit('decoded', {
+                'params': params, 'seconds': now - received,
+                'total': now - start, 'bytes': size})
+        lookup.set(data)
+        return data, extra, False
+
+    @omnimethod
+    def send(self, params):
+        """
+        Send the request, with pacing and retries, and return the
+        successful response before its body is decoded
+        """
+        owner = self if self is not None else PVWatts
+        session = owner.get_session()
+        limiter = owner.rate_limiter
+        pool = owner.key_pool
+        hooks = owner.hooks
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            if pool is not None:
+                key = pool.acquire()
+                params = dict(params, api_key=key)
+            if hooks is None:
+                response = session.get(owner.PVWATTS_QUERY_URL,
+                                       params=params, proxies=owner.proxies,
+                                       stream=owner.streaming)
+            else:
+                hooks.emit('send', {'params': params, 'attempt': attempt})
+                sent = time.time()
+                # streamed, get returns once the headers are received
+                response = session.get(owner.PVWATTS_QUERY_URL,
+                                       params=params, proxies=owner.proxies,
+                                       stream=True)
+                hooks.emit('first_byte', {
+                    'params': params, 'attempt': attempt,
+                    'status': response.status_code,
+                    'seconds': time.time() - sent})
+            status = response.status_code
+            if limiter is not None:
+                limiter.update(response.headers, status)
+            if pool is not None:
+                pool.update(key, response.headers, status)
+                if status == 403 and len(pool):
+                    # the refused key is out of the pool, try another one
+                    response.close()
+                    if hooks is not None:
+                        hooks.emit('retry', {'params': params,
+                                             'attempt': attempt,
+                                             'status': status, 'delay': 0.0})
+                    continue
+            if not owner.retry.should_retry(status, attempt):
+                break
+            response.close()
+            delay = 0.0
+            if pool is None or status != 429:
+                # the pool waits for the rate limited key, or takes another
+                delay = owner.retry.backoff(attempt, response.headers)
+            if hooks is not None:
+                hooks.emit('retry', {'params': params, 'attempt': attempt,
+                                     'status': status, 'delay': delay})
+            if delay:
+                time.sleep(delay)
+            attempt += 1
+
+        if status == 403 or status == 429 or status >= 500:
+            # a streamed response holds its connection until closed
+            response.close()
+        if status == 403:
             raise PVWattsError("Forbidden, 403")
-        return response.json()
+        if status == 429:
+            raise PVWattsRateLimitError("Too many requests, 429")
+        if status >= 500:
+            raise PVWattsError("Server error, %d" % status)
+        return response
 
     @omnimethod
-    def request(self, format=None, system_capacity=None, module_type=0,
-                losses=12, array_type=1, tilt=None, azimuth=None,
-                address=None, lat=None, lon=None, file_id=None, dataset='tmy3',
-                radius=0, timeframe='monthly', dc_ac_ratio=None, gcr=None,
-                inv_eff=None, callback=None):
+    def fetch(self, params, use_cache=True, decoder=None):
+        """
+        Return the PVWattsResult for validated params. With a single_flight,
+        concurrent callers asking for the same params share one request and
+        get the same PVWattsResult. With a ProcessDecoder the response is
+        decoded and post-processed in its process pool, see
+        pypvwatts.processing.
+        """
+        owner = self if self is not None else PVWatts
+
+        def decode(response):
+            body = response.content
+            data, metrics = decoder.decode(body)
+            return data, len(body), metrics
+
+        def fetch():
+            if decoder is None:
+                return owner.make_result(owner.get_data(params=params,
+                                                        use_cache=use_cache))
+            data, metrics, cached = owner.load_data(params, use_cache, decode)
+            if cached:
+                metrics = decoder.postprocess_data(data)
+            result = owner.make_result(data)
+            result.metrics = metrics
+            return result
+
+        if owner.single_flight is None:
+            return fetch()
+        return owner.single_flight.do((cache_key(params), use_cache), fetch)
 
+    @omnimethod
+    def make_result(self, data):
+        """
+        Wrap a decoded response in a PVWattsResult
+        """
+        owner = self if self is not None else PVWatts
+        cls = CompactPVWattsResult if owner.compact else PVWattsResult
+        return cls(data, columnar=owner.columnar, dtype=owner.dtype)
+
+    @omnimethod
+    def build_params(self, format=None, system_capacity=None, module_type=0,
+                     losses=12, array_type=1, tilt=None, azimuth=None,
+                     address=None, lat=None, lon=None, file_id=None,
+                     dataset='tmy3', radius=0, timeframe='monthly',
+                     dc_ac_ratio=None, gcr=None, inv_eff=None, callback=None):
+        """
+        Validate the request arguments and return the query parameters
+        dictionary sent to PVWatts, api_key included
+        """
+        owner = self if self is not None else PVWatts
         params = {
             'format': format,
-            'system_capacity':
-            PVWatts.validate_system_capacity(system_capacity),
-            'module_type': PVWatts.validate_module_type(module_type),
-            'losses': PVWatts.validate_losses(losses),
-            'array_type': PVWatts.validate_array_type(array_type),
-            'tilt': PVWatts.validate_tilt(tilt),
-            'azimuth': PVWatts.validate_azimuth(azimuth),
+            'system_capacity': system_capacity,
+            'module_type': module_type,
+            'losses': losses,
+            'array_type': array_type,
+            'tilt': tilt,
+            'azimuth': azimuth,
             'address': address,
-            'lat': PVWatts.validate_lat(lat),
-            'lon': PVWatts.validate_lon(lon),
+            'lat': lat,
+            'lon': lon,
             'file_id': file_id,
-            'dataset': PVWatts.validate_dataset(dataset),
-            'radius': PVWatts.validate_radius(radius),
-            'timeframe': PVWatts.validate_timeframe(timeframe),
-            'dc_ac_ratio': PVWatts.validate_dc_ac_ratio(dc_ac_ratio),
-            'gcr': PVWatts.validate_gcr(gcr),
-            'inv_eff': PVWatts.validate_inv_eff(inv_eff),
+            'dataset': dataset,
+            'radius': radius,
+            'timeframe': timeframe,
+            'dc_ac_ratio': dc_ac_ratio,
+            'gcr': gcr,
+            'inv_eff': inv_eff,
             'callback': callback
         }
+        if owner.hooks is None:
+            for name, field in FIELDS.items():
+                params[name] = field.validate(params[name])
+        else:
+            start = time.time()
+            try:
+                for name, field in FIELDS.items():
+                    params[name] = field.validate(params[name])
+            except PVWattsValidationError as e:
+                owner.hooks.emit('error', {'params': None, 'error': e,
+                                           'stage': 'validate'})
+                raise
+            owner.hooks.emit('validate', {'seconds': time.time() - start})
+
+        params['api_key'] = owner.api_key
+        return params
 
-        params['api_key'] = PVWatts.api_key
+    @omnimethod
+    def request(self, format=None, system_capacity=None, module_type=0,
+                losses=12, array_type=1, tilt=None, azimuth=None,
+                address=None, lat=None, lon=None, file_id=None, dataset='tmy3',
+                radius=0, timeframe='monthly', dc_ac_ratio=None, gcr=None,
+                inv_eff=None, callback=None, use_cache=True):
+
+        owner = self if self is not None else PVWatts
+        params = owner.build_params(
+            format=format, system_capacity=system_capacity,
+            module_type=module_type, losses=losses, array_type=array_type,
+            tilt=tilt, azimuth=azimuth, address=address, lat=lat, lon=lon,
+            file_id=file_id, dataset=dataset, radius=radius,
+            timeframe=timeframe, dc_ac_ratio=dc_ac_ratio, gcr=gcr,
+            inv_eff=inv_eff, callback=callback)
+        return owner.fetch(params, use_cache=use_cache)
+
+    @omnimethod
+    def request_many(self, batch, max_workers=None, ordered=True,
+                     use_cache=True, processes=None, postprocess=None):
+        """
+        Make many requests concurrently over a bounded thread pool
+
+        Every item is validated before anything is sent. Failures are
+        reported per item, so an invalid row or a failed request does not
+        abort the batch.
+
+        :param batch: Iterable of dictionaries with request() arguments
+        :param max_workers: Number of concurrent requests, defaults to the
+                            connection pool size
+        :param ordered: Yield results in input order, otherwise as soon as
+                        each one finishes
+        :param use_cache: Set to False to bypass the response cache
+        :param processes: Decode responses in a pool of that many processes,
+                          or in the pool of a ProcessDecoder, see
+                          pypvwatts.processing
+        :param postprocess: Function run on each PVWattsResult in the
+                            process pool, its return value is set as the
+                            result's metrics
+        :return: Generator of (index, result) tuples, result being a
+                 PVWattsResult or the exception raised for that item
+        """
+        owner = self if self is not None else PVWatts
+        queries = []
+        for kwargs in batch:
+            try:
+                queries.append(owner.build_params(**kwargs))
+            except (PVWattsValidationError, TypeError) as e:
+                queries.append(e)
+
+        if processes is None:
+            fetch = functools.partial(owner.fetch, use_cache=use_cache)
+            return dispatch(fetch, queries, max_workers or owner.pool_maxsize,
+                            ordered)
+        from .processing import ProcessDecoder
+        if isinstance(processes, ProcessDecoder):
+            return dispatch(functools.partial(
+                owner.fetch, use_cache=use_cache, decoder=processes),
+                queries, max_workers or owner.pool_maxsize, ordered)
+        return owner._request_processed(
+            queries, max_workers or owner.pool_maxsize, ordered, use_cache,
+            processes, postprocess)
 
-        if self is not None:
-            return PVWattsResult(self.get_data(params=params))
-        return PVWattsResult(PVWatts.get_data(params=params))
+    @omnimethod
+    def _request_processed(self, queries, max_workers, ordered, use_cache,
+                           processes, postprocess):
+        """
+        Dispatch queries with a ProcessDecoder created once the batch is
+        iterated and closed once it is done or abandoned
+        """
+        from .processing import ProcessDecoder
+        owner = self if self is not None else PVWatts
+        with ProcessDecoder(processes, postprocess,
+                            dtype=owner.dtype) as decoder:
+            fetch = functools.partial(owner.fetch, use_cache=use_cache,
+                                      decoder=decoder)
+            for item in dispatch(fetch, queries, max_workers, ordered):
+                yield item
+
+    @omnimethod
+    def sweep(self, base, axes, max_workers=None, refine=0, points=5):
+        """
+        Sweep request arguments over a grid, for instance tilt, azimuth and
+        dc_ac_ratio ranges. Equivalent points are only requested once and
+        requests are sent concurrently. See pypvwatts.sweep.run_sweep.
+
+        :param base: Dictionary of request arguments shared by every point
+        :param axes: Ordered mapping, or list of pairs, of argument names to
+                     the values to sweep
+        :param max_workers: Concurrent requests
+        :param refine: Number of coarse to fine refinement rounds
+        :param points: Values per axis in refinement rounds
+        :return: SweepResult with ac_annual and ac_monthly grids
+        """
+        owner = self if self is not None else PVWatts
+        return run_sweep(owner, base, axes, max_workers=max_workers,
+                         refine=refine, points=points)
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""
+Request pacing and retries for the NREL API rate limits.
+"""
+import random
+import threading
+import time
+
+
+def _int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter(object):
+    """
+    Token bucket pacing requests to the API key quota. The bucket is
+    refilled at limit / window tokens per second and never holds more
+    tokens than the quota the server reports as remaining.
+
+    :param limit: Requests allowed per window, learned from the
+                  X-RateLimit-Limit header when not given. Without a known
+                  limit requests are not paced.
+    :param window: Quota window in seconds, NREL limits are hourly
+    """
+    def __init__(self, limit=None, window=3600.0):
+        self.window = float(window)
+        self.limit = None
+        self.rate = None
+        self.remaining = None
+        self.tokens = float('inf')
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        if limit is not None:
+            self._set_limit(limit)
+            self.tokens = float(limit)
+
+    def _set_limit(self, limit):
+        self.limit = limit
+        self.rate = limit / self.window
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.limit, self.tokens +
+                              (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token and return the seconds to wait before sending
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            if self.tokens >= 0 or self.rate is None:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Take a token, blocking until the request may be sent
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, headers, status=None):
+        """
+        Adapt to the X-RateLimit-Limit and X-RateLimit-Remaining response
+        headers. A 429 status empties the bucket.
+        """
+        limit = _int_header(headers, 'X-RateLimit-Limit')
+        remaining = _int_header(headers, 'X-RateLimit-Remaining')
+        with self._lock:
+            self._refill(time.time())
+            if limit:
+                self._set_limit(limit)
+                self.tokens = min(self.tokens, limit)
+            if remaining is not None:
+                self.remaining = remaining
+                self.tokens = min(self.tokens, remaining)
+            if status == 429:
+                self.tokens = min(self.tokens, 0)
+
+    @property
+    def budget(self):
+        """
+        Current quota as reported by the server and tokens left
+        """
+        with self._lock:
+            self._refill(time.time())
+            return {'limit': self.limit, 'remaining': self.remaining,
+                    'tokens': self.tokens, 'rate': self.rate}
+
+
+class RetryPolicy(object):
+    """
+    Retries on rate limiting and server errors with jittered exponential
+    backoff, honouring Retry-After when present
+
+    :param max_retries: Maximum retries per request
+    :param backoff_factor: Base delay in seconds, doubled on every retry
+    :param max_backoff: Upper bound for a single delay in seconds
+    :param statuses: HTTP status codes to retry
+    """
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=60.0,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def should_retry(self, status, attempt):
+        return status in self.statuses and attempt < self.max_retries
+
+    def backoff(self, attempt, headers=None):
+        """
+        Return the seconds to wait before the given retry attempt, the
+        first retry being attempt 0
+        """
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff_factor * 2 ** attempt))
+        retry_after = _int_header(headers or {}, 'Retry-After')
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
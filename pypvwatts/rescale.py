@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+Local rescaling of responses to another system_capacity.
+
+With every other input fixed, PVWatts energy outputs are proportional to
+system_capacity: the inverter is sized from the capacity and dc_ac_ratio,
+so clipping happens at the same hours whatever the size. A cached response
+can then be scaled to a new capacity instead of requesting it again.
+Irradiance, temperature and wind fields and capacity_factor do not depend
+on the capacity and are kept as they are.
+"""
+from .pvwattscache import cache_key
+from .pvwattserror import PVWattsError
+
+# Output fields proportional to system_capacity
+SCALED_FIELDS = ('ac_annual', 'ac_monthly', 'dc_monthly', 'ac', 'dc')
+
+
+def capacity_key(params):
+    """
+    Return the cache key shared by params at any system_capacity
+    """
+    return cache_key(dict(params, system_capacity=None, rescale=1))
+
+
+def response_capacity(data):
+    """
+    Return the system_capacity echoed in a response's inputs, None when
+    missing
+    """
+    try:
+        return float((data.get('inputs') or {})['system_capacity'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _scale(value, factor):
+    if hasattr(value, 'tolist'):
+        return value * factor
+    if isinstance(value, list):
+        return [item * factor for item in value]
+    return value * factor
+
+
+def rescale_response(data, system_capacity):
+    """
+    Return a copy of the response data scaled to system_capacity, or data
+    itself when its capacity is the same
+
+    :raises PVWattsError: when the response does not echo its capacity
+    """
+    capacity = response_capacity(data)
+    if capacity is None or capacity <= 0:
+        raise PVWattsError('Response has no system_capacity to rescale')
+    if capacity == system_capacity:
+        return data
+    factor = float(system_capacity) / capacity
+    outputs = dict(data.get('outputs') or {})
+    for name in SCALED_FIELDS:
+        if outputs.get(name) is not None:
+            outputs[name] = _scale(outputs[name], factor)
+    inputs = dict(data['inputs'])
+    if not isinstance(inputs['system_capacity'], (int, float)):
+        system_capacity = str(system_capacity)
+    inputs['system_capacity'] = system_capacity
+    return dict(data, inputs=inputs, outputs=outputs)
+
+
+def check_rescale(scaled, data, rtol=1e-4, atol=1e-3):
+    """
+    Compare a rescaled response with the actual response for the same
+    request, raising PVWattsError on the first field that differs
+    """
+    expected = data.get('outputs') or {}
+    outputs = scaled.get('outputs') or {}
+    for name in SCALED_FIELDS:
+        if name not in expected:
+            continue
+        actual = expected[name]
+        value = outputs.get(name)
+        if not isinstance(actual, (list, tuple)) and \
+                not hasattr(actual, 'tolist'):
+            actual, value = [actual], [value]
+        if value is None or len(value) != len(actual):
+            raise PVWattsError('Rescaled %s does not match the response'
+                               % name)
+        for a, b in zip(actual, value):
+            if abs(a - b) > atol + rtol * abs(a):
+                raise PVWattsError('Rescaled %s does not match the response:'
+                                   ' %r != %r' % (name, b, a))
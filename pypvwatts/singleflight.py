@@ -0,0 +1,156 @@
+# coding: utf-8
+"""
+Coalescing of identical concurrent requests.
+
+While a request is in flight, callers making the same request (same
+cache_key of its parameters) wait for it instead of sending their own, and
+all of them get the same PVWattsResult. FileSingleFlight extends this to
+processes and hosts sharing a directory.
+"""
+from .pvwattscache import _makedirs
+
+from concurrent.futures import Future
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# Thread locks of the lock files by path, file locks being held by the
+# process
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def lock_file(file, blocking=True):
+    """
+    Take an exclusive lock on an open file, return False when it is held
+    elsewhere and not blocking. fcntl locks also hold over NFS.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.lockf(file, fcntl.LOCK_EX | (0 if blocking
+                                               else fcntl.LOCK_NB))
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking
+                           else msvcrt.LK_NBLCK, 1)
+    except (IOError, OSError):
+        if blocking:
+            raise
+        return False
+    return True
+
+
+def unlock_file(file):
+    if fcntl is not None:
+        fcntl.lockf(file, fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time for concurrent threads
+
+    :ivar calls: Number of calls actually made
+    :ivar coalesced: Number of calls served by a call already in flight
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of calls in flight
+        """
+        return len(self._flights)
+
+    @property
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced,
+                'in_flight': len(self)}
+
+    def do(self, key, func):
+        """
+        Return func(), or wait for the call in flight for key and return its
+        result. Exceptions raised by func are raised to every caller.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._land(key)
+            future.set_exception(e)
+            raise
+        self._land(key)
+        future.set_result(result)
+        return result
+
+    def _land(self, key):
+        # later callers start a new call, waiters still hold the future
+        with self._lock:
+            del self._flights[key]
+
+
+class FileSingleFlight(SingleFlight):
+    """
+    SingleFlight across the processes, and hosts, sharing a directory of
+    lock files: a call is made holding the lock of its key, so callers
+    elsewhere wait for it and, with a shared cache such as DirectoryCache,
+    then find its response cached. Keys are spread over a fixed number of
+    lock files, so unrelated keys seldom wait for each other.
+
+    :param path: Directory of the lock files
+    :param stripes: Number of lock files
+    :ivar waited: Number of calls that waited for another process
+    """
+    def __init__(self, path, stripes=1024):
+        SingleFlight.__init__(self)
+        self.path = path
+        self.stripes = stripes
+        self.waited = 0
+        _makedirs(path)
+
+    @property
+    def stats(self):
+        return dict(SingleFlight.stats.fget(self), waited=self.waited)
+
+    def do(self, key, func):
+        return SingleFlight.do(self, key, lambda: self._locked(key, func))
+
+    def _locked(self, key, func):
+        stripe = int(hashlib.sha1(repr(key).encode('utf8')).hexdigest(),
+                     16) % self.stripes
+        path = os.path.abspath(os.path.join(self.path, '%04d.lock' % stripe))
+        with _file_locks_lock:
+            thread_lock = _file_locks.setdefault(path, threading.Lock())
+        # file locks are held by the process, its threads take turns first
+        with thread_lock:
+            with open(path, 'a+') as file:
+                if not lock_file(file, blocking=False):
+                    with self._lock:
+                        self.waited += 1
+                    lock_file(file)
+                try:
+                    return func()
+                finally:
+                    unlock_file(file)
@@ -0,0 +1,195 @@
+# coding: utf-8
+"""
+Spatial index of the weather stations PVWatts resolved sites to.
+
+PVWatts simulates a site with the weather of the station, or grid cell,
+nearest to it, so nearby sites of the same system get the same outputs.
+StationIndex learns stations from the station_info of responses, and
+resolves new coordinates to the station of an observed site within reach
+of them, unless another known station is closer. Sites resolved to a known
+station are then served from the cache entry of any site of that station
+with the same system, see PVWatts.station_index.
+
+This is an approximation: a site a few meters across a boundary of the
+station grid can still be resolved to the station of its neighbours, so
+reach should stay well below the station spacing of the dataset.
+"""
+import math
+import threading
+
+EARTH_RADIUS = 6371008.8
+# Meters per degree of latitude
+DEGREE = math.pi * EARTH_RADIUS / 180
+MILE = 1609.344
+
+
+def great_circle(lat1, lon1, lat2, lon2):
+    """
+    Return the distance in meters between two points
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    half = (math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) *
+            math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(half, 1)))
+
+
+def station_id(station_info):
+    return station_info.get('solar_resource_file') or \
+        station_info.get('location')
+
+
+class StationIndex(object):
+    """
+    Maps coordinates to the weather station PVWatts would use, learned from
+    the station_info of responses and kept in a grid of cells per dataset
+
+    :param reach: Meters from an observed site within which coordinates
+                  are resolved to its station
+    :param cell: Grid cell size in degrees
+    :ivar lookups: Number of coordinates looked up
+    :ivar resolved: Number of lookups resolved to a known station
+    :ivar calls_avoided: Number of responses served from the cache entry
+                         of another site of the same station
+    """
+    def __init__(self, reach=2000.0, cell=0.25):
+        self.reach = reach
+        self.cell = cell
+        self.lookups = 0
+        self.resolved = 0
+        self.calls_avoided = 0
+        self._sites = {}
+        self._site_count = 0
+        self._stations = {}
+        self._station_cells = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Number of known stations
+        """
+        return len(self._stations)
+
+    @property
+    def stats(self):
+        return {'stations': len(self), 'sites': self._site_count,
+                'lookups': self.lookups, 'resolved': self.resolved,
+                'calls_avoided': self.calls_avoided}
+
+    def _cell(self, dataset, lat, lon):
+        return (dataset, int(math.floor(lat / self.cell)),
+                int(math.floor(lon / self.cell)))
+
+    def _near(self, cells, dataset, lat, lon, meters):
+        """
+        Return the entries of the cells within meters of lat, lon
+        """
+        rise = meters / DEGREE
+        run = min(rise / max(math.cos(math.radians(lat)), 0.01), 180)
+        _, bottom, left = self._cell(dataset, lat - rise, lon - run)
+        _, top, right = self._cell(dataset, lat + rise, lon + run)
+        columns = int(round(360 / self.cell))
+        entries = []
+        for row in range(bottom, top + 1):
+            for column in range(left, right + 1)[:columns]:
+                # longitudes wrap around the antimeridian
+                column = (column + columns // 2) % columns - columns // 2
+                entries.extend(cells.get((dataset, row, column), ()))
+        return entries
+
+    def _find(self, dataset, lat, lon):
+        """
+        Return the station of the nearest observed site within reach, with
+        its distance and how far the site is, or None
+        """
+        nearest = None
+        for site_lat, site_lon, station in self._near(
+                self._sites, dataset, lat, lon, self.reach):
+            apart = great_circle(site_lat, site_lon, lat, lon)
+            if apart <= self.reach and (nearest is None or
+                                        apart < nearest[1]):
+                nearest = (station, apart)
+        if nearest is None:
+            return None
+        station, apart = nearest
+        info = self._stations[dataset, station]
+        meters = great_circle(lat, lon, info['lat'], info['lon'])
+        for other in self._near(self._station_cells, dataset, lat, lon,
+                                meters):
+            known = self._stations[dataset, other]
+            if other != station and great_circle(
+                    lat, lon, known['lat'], known['lon']) < meters:
+                return None
+        return station, meters, apart
+
+    def resolve(self, params):
+        """
+        Return the station_info of the known station PVWatts would use for
+        the request params, with its distance in meters, or None
+        """
+        lat, lon = params.get('lat'), params.get('lon')
+        if lat is None or lon is None or params.get('file_id') or \
+                params.get('address'):
+            return None
+        dataset = params.get('dataset')
+        with self._lock:
+            self.lookups += 1
+            found = self._find(dataset, lat, lon)
+            radius = params.get('radius')
+            if found is None or radius and found[1] > radius * MILE:
+                return None
+            self.resolved += 1
+            station, meters, apart = found
+            return dict(self._stations[dataset, station], distance=meters,
+                        reused=apart > 0)
+
+    def observe(self, params, station_info):
+        """
+        Record the station PVWatts resolved the request params to, and
+        return it like resolve does
+        """
+        lat, lon = params.get('lat'), params.get('lon')
+        station = station_id(station_info)
+        if lat is None or lon is None or params.get('file_id') or \
+                params.get('address') or station is None:
+            return None
+        dataset = params.get('dataset')
+        with self._lock:
+            info = self._stations.get((dataset, station))
+            if info is None:
+                info = self._stations[dataset, station] = dict(
+                    (name, station_info.get(name)) for name in
+                    ('lat', 'lon', 'elev', 'tz', 'location', 'city',
+                     'state', 'solar_resource_file'))
+                self._station_cells.setdefault(
+                    self._cell(dataset, info['lat'], info['lon']),
+                    []).append(station)
+            site = (lat, lon, station)
+            cell = self._sites.setdefault(self._cell(dataset, lat, lon), [])
+            if site not in cell:
+                cell.append(site)
+                self._site_count += 1
+        return dict(info, distance=great_circle(lat, lon, info['lat'],
+                                                info['lon']), reused=False)
+
+    @staticmethod
+    def key_params(params, station):
+        """
+        Return params with the coordinates replaced by the station, so
+        sites of the same station share cache entries
+        """
+        return dict(params, lat=None, lon=None, radius=None,
+                    station=station_id(station))
+
+    def adapt(self, data, params, station):
+        """
+        Return a cached response of the station for the request params,
+        with its inputs and station distance
+        """
+        if station['reused']:
+            with self._lock:
+                self.calls_avoided += 1
+        inputs = dict(data.get('inputs') or {})
+        inputs.update(lat=str(params['lat']), lon=str(params['lon']))
+        station_info = dict(data.get('station_info') or {},
+                            distance=int(round(station['distance'])))
+        return dict(data, inputs=inputs, station_info=station_info)
@@ -0,0 +1,246 @@
+# coding: utf-8
+"""
+Incremental decoding of PVWatts responses.
+
+Output arrays are parsed chunk by chunk straight into preallocated numpy
+buffers, so the response body and a list of boxed floats per hourly field
+are never held in memory. Everything else (inputs, station_info, errors,
+warnings...) is small and decoded with the json module.
+"""
+from .pvwattsresult import PVWattsResult, import_numpy
+from .pvwattserror import PVWattsError
+
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'\s*')
+_STRING_END = re.compile(r'["\\]')
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_SCALAR_END = re.compile(r'[\s,}\]]')
+_NUMBER = re.compile(r'[^,]+')
+_NUMBER_START = '-0123456789'
+
+# Initial buffer length for output arrays, grown as needed
+HOURLY_LENGTH = 8760
+MONTHLY_LENGTH = 12
+
+
+def _string_end(buf, pos):
+    """
+    Return the index after the string starting at buf[pos], None if it is
+    not complete yet
+    """
+    pos += 1
+    while True:
+        match = _STRING_END.search(buf, pos)
+        if match is None:
+            return None
+        if match.group() == '"':
+            return match.end()
+        pos = match.end() + 1
+        if pos > len(buf):
+            return None
+
+
+def _value_end(buf, pos):
+    """
+    Return the index after the JSON value starting at buf[pos], None if it
+    is not complete yet
+    """
+    if buf[pos] == '"':
+        return _string_end(buf, pos)
+    if buf[pos] not in '{[':
+        match = _SCALAR_END.search(buf, pos)
+        return match.start() if match is not None else None
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(buf, pos)
+        if match is None:
+            return None
+        char = match.group()
+        if char == '"':
+            pos = _string_end(buf, match.start())
+            if pos is None:
+                return None
+            continue
+        depth += 1 if char in '{[' else -1
+        pos = match.end()
+        if depth == 0:
+            return pos
+
+
+class _ArrayBuffer(object):
+    """
+    Growable numpy buffer numbers are parsed into
+    """
+    def __init__(self, numpy, length, dtype):
+        self.numpy = numpy
+        self.data = numpy.empty(length, dtype=dtype)
+        self.size = 0
+
+    def extend(self, text):
+        if not text.strip():
+            return
+        count = text.count(',') + 1
+        end = self.size + count
+        if end > len(self.data):
+            grown = self.numpy.empty(max(end, 2 * len(self.data)),
+                                     dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        # numbers are converted one at a time as they are matched, no list
+        # of strings is built
+        try:
+            self.data[self.size:end] = self.numpy.fromiter(
+                (float(match.group()) for match in _NUMBER.finditer(text)),
+                dtype=self.data.dtype, count=count)
+        except ValueError:
+            raise PVWattsError('Invalid number in response array')
+        self.size = end
+
+    def finish(self):
+        if self.size == len(self.data):
+            return self.data
+        return self.data[:self.size].copy()
+
+
+class StreamingDecoder(object):
+    """
+    Incremental decoder for a PVWatts JSON response. Feed it the body in
+    chunks and call close() to get the decoded response, where hourly
+    output fields are numpy arrays of dtype.
+    """
+    def __init__(self, dtype='float64'):
+        self.numpy = import_numpy()
+        self.dtype = dtype
+        self.result = {}
+        self._utf8 = codecs.getincrementaldecoder('utf8')()
+        self._buf = ''
+        self._pos = 0
+        self._state = 'start'
+        self._outputs = None
+        self._key = None
+        self._array = None
+
+    def feed(self, chunk):
+        """
+        Decode a chunk of the response body
+        """
+        self._buf = self._buf[self._pos:] + self._utf8.decode(chunk)
+        self._pos = 0
+        self._parse()
+
+    def close(self):
+        """
+        Return the decoded response, raising PVWattsError when the body was
+        not a complete JSON object
+        """
+        self._buf = self._buf[self._pos:] + self._utf8.decode(b'', True)
+        self._pos = 0
+        self._parse()
+        if self._state != 'done':
+            raise PVWattsError('Incomplete response')
+        return self.result
+
+    def _store(self, value):
+        target = self.result if self._outputs is None else self._outputs
+        target[self._key] = value
+
+    def _parse(self):
+        buf = self._buf
+        while True:
+            pos = _WHITESPACE.match(buf, self._pos).end()
+            self._pos = pos
+            if pos == len(buf) or self._state == 'done':
+                return
+            char = buf[pos]
+
+            if self._state == 'start':
+                if char != '{':
+                    raise PVWattsError('Response is not a JSON object')
+                self._pos += 1
+                self._state = 'key'
+
+            elif self._state == 'key':
+                if char == ',':
+                    self._pos += 1
+                elif char == '}':
+                    self._pos += 1
+                    if self._outputs is None:
+                        self._state = 'done'
+                    else:
+                        self.result['outputs'] = self._outputs
+                        self._outputs = None
+                elif char == '"':
+                    end = _string_end(buf, pos)
+                    if end is None:
+                        return
+                    colon = _WHITESPACE.match(buf, end).end()
+                    if colon == len(buf):
+                        return
+                    if buf[colon] != ':':
+                        raise PVWattsError('Invalid JSON object in response')
+                    self._key = json.loads(buf[pos:end])
+                    self._pos = colon + 1
+                    self._state = 'value'
+                else:
+                    raise PVWattsError('Invalid JSON object in response')
+
+            elif self._state == 'value':
+                if (char == '{' and self._outputs is None and
+                        self._key == 'outputs'):
+                    self._outputs = {}
+                    self._pos += 1
+                    self._state = 'key'
+                    continue
+                if char == '[' and self._outputs is not None:
+                    start = _WHITESPACE.match(buf, pos + 1).end()
+                    if start == len(buf):
+                        return
+                    if buf[start] in _NUMBER_START:
+                        hourly = self._key in PVWattsResult.hourly_fields
+                        self._array = _ArrayBuffer(
+                            self.numpy,
+                            HOURLY_LENGTH if hourly else MONTHLY_LENGTH,
+                            self.dtype if hourly else 'float64')
+                        self._pos = start
+                        self._state = 'array'
+                        continue
+                end = _value_end(buf, pos)
+                if end is None:
+                    return
+                self._store(json.loads(buf[pos:end]))
+                self._pos = end
+                self._state = 'key'
+
+            elif self._state == 'array':
+                end = buf.find(']', pos)
+                if end == -1:
+                    cut = buf.rfind(',', pos)
+                    if cut == -1:
+                        return
+                    self._array.extend(buf[pos:cut])
+                    self._pos = cut + 1
+                    return
+                self._array.extend(buf[pos:end])
+                values = self._array.finish()
+                self._array = None
+                if self._key not in PVWattsResult.hourly_fields:
+                    values = values.tolist()
+                self._store(values)
+                self._pos = end + 1
+                self._state = 'key'
+
+
+def decode_stream(chunks, dtype='float64'):
+    """
+    Decode a response body given as an iterable of byte chunks
+
+    :param dtype: dtype of the hourly output arrays
+    :rtype: dict
+    """
+    decoder = StreamingDecoder(dtype=dtype)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.close()
@@ -0,0 +1,273 @@
+# coding: utf-8
+"""
+Local HTTP server imitating the PVWatts v6 endpoint, used by the tests and
+the benchmarks.
+
+It replies SAMPLE_RESPONSE to monthly requests and an hourly payload to
+timeframe=hourly ones, or whatever its respond() returns, optionally
+after some latency, with a share of 429 and 5xx replies and with
+X-RateLimit-* headers counting down a quota.
+
+    >>> with StubServer(latency=0.05, rate_limited=0.01, limit=1000) as server:
+    ...     p = PVWatts()
+    ...     p.PVWATTS_QUERY_URL = server.url
+"""
+from .pvwattsresult import PVWattsResult
+
+import collections
+import json
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl, urlsplit
+
+SAMPLE_RESPONSE = """
+{
+   "inputs":{
+      "lat":"40",
+      "lon":"-105",
+      "system_capacity":"4",
+      "azimuth":"180",
+      "tilt":"40",
+      "array_type":"1",
+      "module_type":"1",
+      "losses":"10"
+   },
+   "errors":[
+
+   ],
+   "warnings":[
+
+   ],
+   "version":"1.0.1",
+   "ssc_info":{
+      "version":34,
+      "build":"Unix 64 bit GNU/C++ Aug 18 2014 13:38:36"
+   },
+   "station_info":{
+      "lat":40.016666412353516,
+      "lon":-105.25,
+      "elev":1634.0,
+      "tz":-7.0,
+      "location":"94018",
+      "city":"BOULDER",
+      "state":"CO",
+      "solar_resource_file":"94018.tm2",
+      "distance":21235
+   },
+   "outputs":{
+      "ac_monthly":[
+         474.3351745605469,
+         465.9206237792969,
+         628.4765625,
+         602.564208984375,
+         611.0515747070312,
+         591.2024536132812,
+         596.1395874023438,
+         610.1753540039062,
+         598.2145385742188,
+         574.7982177734375,
+         471.78070068359375,
+         458.9857177734375
+      ],
+      "poa_monthly":[
+         136.04103088378906,
+         136.04443359375,
+         185.7895965576172,
+         181.16891479492188,
+         185.77963256835938,
+         182.52105712890625,
+         187.89971923828125,
+         193.35572814941406,
+         187.40081787109375,
+         175.5979461669922,
+         137.59872436523438,
+         131.25526428222656
+      ],
+      "solrad_monthly":[
+         4.388420581817627,
+         4.858729839324951,
+         5.993212699890137,
+         6.038963794708252,
+         5.992891311645508,
+         6.084035396575928,
+         6.061281204223633,
+         6.237281322479248,
+         6.246694087982178,
+         5.664449691772461,
+         4.5866241455078125,
+         4.2340407371521
+      ],
+      "dc_monthly":[
+         495.09564208984375,
+         487.5823669433594,
+         657.702880859375,
+         629.8565063476562,
+         638.9706420898438,
+         618.6126708984375,
+         623.68994140625,
+         637.5205688476562,
+         624.635009765625,
+         599.9056396484375,
+         492.5662841796875,
+         479.1076354980469
+      ],
+      "ac_annual":6683.64501953125,
+      "solrad_annual":5.5322184562683105
+   }
+}
+"""
+
+
+def hourly_response():
+    """
+    Return SAMPLE_RESPONSE with hourly output fields added
+    """
+    response = json.loads(SAMPLE_RESPONSE)
+    response['inputs']['timeframe'] = 'hourly'
+    for offset, name in enumerate(PVWattsResult.hourly_fields):
+        response['outputs'][name] = [((hour * 7 + offset) % 1000) / 3.0
+                                     for hour in range(8760)]
+    return response
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal keep-alive handler replying GETs with the server's respond()
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, without this small replies
+    # wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        BaseHTTPRequestHandler.handle(self)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+        query = dict(parse_qsl(urlsplit(self.path).query))
+        delay = server.delay()
+        if delay:
+            time.sleep(delay)
+        reply = server.fault() or server.respond(query)
+        status, body = reply[:2]
+        headers = dict(server.quota(), **(reply[2] if len(reply) > 2
+                                          else {}))
+        with server.lock:
+            server.replies[status] += 1
+        if not isinstance(body, bytes):
+            body = body.encode('utf8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server imitating the PVWatts endpoint
+
+    :param latency: Seconds every reply is delayed
+    :param jitter: Extra random delay, up to jitter seconds
+    :param rate_limited: Share of requests replied with a 429
+    :param server_errors: Share of requests replied with a 503
+    :param limit: Quota reported in X-RateLimit-* headers, once it is used
+                  up requests are replied with a 429
+    :param seed: Seed of the latency and faults random draws
+    :ivar requests: (path, headers) of every request received
+    :ivar replies: Number of replies by status
+    """
+    daemon_threads = True
+    # keep connections from concurrent benchmark clients queued
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limited=0.0,
+                 server_errors=0.0, limit=None, seed=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited = rate_limited
+        self.server_errors = server_errors
+        self.limit = limit
+        self.remaining = limit
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.replies = collections.Counter()
+        self._random = random.Random(seed)
+        self._hourly = None
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self.lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def fault(self):
+        """
+        Return a 429 or 503 reply for the share of requests that fail, or
+        None
+        """
+        with self.lock:
+            if self.remaining is not None:
+                if self.remaining == 0:
+                    return 429, '{"errors":["OVER_RATE_LIMIT"]}'
+                self.remaining -= 1
+            draw = self._random.random()
+        if draw < self.rate_limited:
+            return 429, '{"errors":["OVER_RATE_LIMIT"]}'
+        if draw < self.rate_limited + self.server_errors:
+            return 503, 'Service Unavailable'
+        return None
+
+    def quota(self):
+        """
+        Return the X-RateLimit-* headers, if there is a limit
+        """
+        if self.limit is None:
+            return {}
+        return {'X-RateLimit-Limit': str(self.limit),
+                'X-RateLimit-Remaining': str(self.remaining)}
+
+    def respond(self, query):
+        """
+        Return the (status, body) or (status, body, headers) reply for the
+        parsed query parameters
+        """
+        if query.get('timeframe') != 'hourly':
+            return 200, SAMPLE_RESPONSE
+        if self._hourly is None:
+            self._hourly = json.dumps(hourly_response()).encode('utf8')
+        return 200, self._hourly
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/api/pvwatts/v6.json' % self.server_port
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,174 @@
+# coding: utf-8
+"""
+Parameter sweeps over PVWatts requests, such as tilt, azimuth or
+dc_ac_ratio ranges to find the best system layout for a site.
+"""
+from .pvwattsresult import import_numpy
+from .pvwattserror import PVWattsError, PVWattsValidationError
+from .pvwattscache import cache_key
+
+import collections
+import itertools
+
+# Axes holding continuous values, which can be refined between grid points
+REFINABLE_AXES = ('system_capacity', 'losses', 'tilt', 'azimuth',
+                  'dc_ac_ratio', 'gcr', 'inv_eff')
+
+
+def normalize_point(kwargs):
+    """
+    Return request arguments with equivalent layouts mapped to the same
+    values: azimuth wraps at 360, azimuth is irrelevant for horizontal fixed
+    arrays and orientation is irrelevant for 2-axis trackers
+    """
+    kwargs = dict(kwargs)
+    azimuth = kwargs.get('azimuth')
+    array_type = kwargs.get('array_type', 1)
+    if azimuth is not None and azimuth >= 360:
+        kwargs['azimuth'] = azimuth % 360
+    if array_type in (0, 1) and kwargs.get('tilt') == 0 and \
+            azimuth is not None:
+        kwargs['azimuth'] = 180
+    if array_type == 4:
+        for name in ('tilt', 'azimuth'):
+            if kwargs.get(name) is not None:
+                kwargs[name] = 0
+    return kwargs
+
+
+class SweepResult(object):
+    """
+    Dense grid of sweep results, indexed like the axes
+
+    :ivar axes: Ordered mapping of axis names to their values
+    :ivar ac_annual: Array of annual AC output, NaN for failed points
+    :ivar ac_monthly: Array of monthly AC output, shaped axes + (12,)
+    :ivar errors: Mapping of grid indexes to the exception of failed points
+    :ivar requests: Number of distinct requests dispatched for the sweep
+    :ivar rounds: SweepResult of each refinement round, coarsest first
+    """
+    def __init__(self, axes, ac_annual, ac_monthly, errors):
+        self.axes = axes
+        self.ac_annual = ac_annual
+        self.ac_monthly = ac_monthly
+        self.errors = errors
+        self.requests = 0
+        self.rounds = [self]
+
+    @property
+    def shape(self):
+        return self.ac_annual.shape
+
+    def point(self, index):
+        """
+        Return the axis values at a grid index
+        """
+        return dict((name, values[i]) for (name, values), i in
+                    zip(self.axes.items(), index))
+
+    def best_index(self):
+        numpy = import_numpy()
+        if numpy.isnan(self.ac_annual).all():
+            raise PVWattsError('Every point of the sweep failed')
+        return numpy.unravel_index(numpy.nanargmax(self.ac_annual),
+                                   self.shape)
+
+    def best(self):
+        """
+        Return the axis values with the highest ac_annual over all rounds
+        """
+        best = max(self.rounds,
+                   key=lambda grid: grid.ac_annual[grid.best_index()])
+        return best.point(best.best_index())
+
+
+def _refine(grid, points):
+    """
+    Return axes zoomed in around the best point of grid
+    """
+    numpy = import_numpy()
+    index = grid.best_index()
+    axes = collections.OrderedDict()
+    for (name, values), i in zip(grid.axes.items(), index):
+        if name not in REFINABLE_AXES or len(values) < 2:
+            axes[name] = [values[i]]
+            continue
+        low = values[max(i - 1, 0)]
+        high = values[min(i + 1, len(values) - 1)]
+        refined = numpy.round(numpy.linspace(low, high, points), 6)
+        axes[name] = sorted(set(refined.tolist()))
+    return axes
+
+
+def _evaluate(client, base, axes, fetched, max_workers):
+    numpy = import_numpy()
+    names = list(axes)
+    shape = tuple(len(values) for values in axes.values())
+    keys = {}
+    pending = collections.OrderedDict()
+    for index in itertools.product(*[range(size) for size in shape]):
+        kwargs = dict(base)
+        kwargs.update((name, axes[name][i]) for name, i in zip(names, index))
+        kwargs = normalize_point(kwargs)
+        try:
+            key = cache_key(client.build_params(**kwargs))
+        except (PVWattsValidationError, TypeError) as e:
+            keys[index] = e
+            continue
+        keys[index] = key
+        if key not in fetched and key not in pending:
+            pending[key] = kwargs
+
+    for (key, _), (_, result) in zip(
+            pending.items(),
+            client.request_many(list(pending.values()),
+                                max_workers=max_workers)):
+        fetched[key] = result
+
+    ac_annual = numpy.full(shape, numpy.nan)
+    ac_monthly = numpy.full(shape + (12,), numpy.nan)
+    errors = {}
+    for index, key in keys.items():
+        result = key if isinstance(key, Exception) else fetched[key]
+        if isinstance(result, Exception):
+            errors[index] = result
+            continue
+        try:
+            ac_annual[index] = result.ac_annual
+            ac_monthly[index] = result.ac_monthly
+        except (KeyError, TypeError, ValueError) as e:
+            # responses reporting errors have no outputs
+            errors[index] = e
+    grid = SweepResult(collections.OrderedDict(axes), ac_annual,
+                       ac_monthly, errors)
+    grid.requests = len(pending)
+    return grid
+
+
+def run_sweep(client, base, axes, max_workers=None, refine=0, points=5):
+    """
+    Request every combination of axis values, sending each distinct
+    request once and concurrently
+
+    :param client: PVWatts instance, or the PVWatts class
+    :param base: Dictionary of request arguments shared by every point
+    :param axes: Ordered mapping, or list of pairs, of request argument
+                 names to the values to sweep
+    :param max_workers: Concurrent requests, see PVWatts.request_many
+    :param refine: Number of coarse to fine rounds. Each round sweeps a
+                   finer grid spanning the neighbours of the best point so
+                   far, discrete axes are fixed to their best value.
+    :param points: Values per refinable axis in refinement rounds
+    :rtype: SweepResult of the last round
+    """
+    axes = collections.OrderedDict(axes)
+    fetched = {}
+    rounds = []
+    for round_number in range(refine + 1):
+        if round_number:
+            axes = _refine(rounds[-1], points)
+        rounds.append(_evaluate(client, base, axes, fetched, max_workers))
+    result = rounds[-1]
+    result.rounds = rounds
+    result.requests = sum(grid.requests for grid in rounds)
+    return result
@@ -4,107 +4,183 @@ Unit tests for pypvwatts.
 
 """
 from .pypvwatts import PVWatts, PVWattsResult
-from .pvwattserror import PVWattsValidationError
+from .pvwattsresult import CompactPVWattsResult
+from .pvwattserror import PVWattsError, PVWattsValidationError
+from .pvwattscache import (DirectoryCache, MemoryCache, SQLiteCache,
+                           cache_key)
+from .pvwattserror import PVWattsRateLimitError
+from .keypool import KeyPool
+from .ratelimit import RateLimiter, RetryPolicy
+from .singleflight import FileSingleFlight, SingleFlight
+from .stations import StationIndex, great_circle
+from .stubserver import SAMPLE_RESPONSE, StubServer, hourly_response
+from .transport import HTTPClientTransport, ReplayTransport, RequestsTransport
+from .streaming import _ArrayBuffer, decode_stream
+from .archive import ArchiveWriter, PVWattsArchive
+from .fleet import FleetAggregator
+from .hooks import Hooks, MetricsCollector
+from .timeindex import Tariff, resample, stack, time_index
+from .weather import MONTH_START, read_weather
+from . import cli
 
 import unittest
+import gc
+import gzip
+import io
 import json
+import multiprocessing
+import os
+import shutil
+import sys
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import asyncio
+    import aiohttp
+    from .asyncpvwatts import AsyncPVWatts, AsyncSingleFlight
+except (ImportError, SyntaxError):
+    aiohttp = None
+
+try:
+    from urllib.parse import parse_qsl, urlsplit
+except ImportError:
+    from urlparse import parse_qsl, urlsplit
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+
+def capacity_response(query, clip=None):
+    """
+    Reply with hourly_response outputs scaled to the requested capacity,
+    optionally clipping hourly ac at clip
+    """
+    response = hourly_response()
+    factor = float(query['system_capacity']) / 4
+    response['inputs']['system_capacity'] = query['system_capacity']
+    outputs = response['outputs']
+    for name in ('ac_monthly', 'dc_monthly', 'ac', 'dc'):
+        outputs[name] = [value * factor for value in outputs[name]]
+    if clip is not None:
+        outputs['ac'] = [min(value, clip) for value in outputs['ac']]
+    outputs['ac_annual'] *= factor
+    return 200, json.dumps(response)
+
+
+def weather_csv(layout='tmy3', lat=40.0, lon=-105.25, tz=-7.0):
+    """
+    Return a weather file of clear days, every third one cloudy, in the
+    tmy3 or sam layout
+    """
+    from .local import solar_position
+    day = numpy.arange(8760) // 24
+    zenith = solar_position(day, numpy.arange(8760) % 24 + 0.5, lat, lon,
+                            tz)[0]
+    cos_z = numpy.maximum(numpy.cos(numpy.radians(zenith)), 0)
+    clear = numpy.where(day % 3 == 2, 0.2, 1.0)
+    dni = numpy.where(cos_z > 0, 1000 * 0.7 ** (
+        1 / numpy.maximum(cos_z, 0.05)) ** 0.678, 0) * clear
+    dhi = numpy.where(cos_z > 0, 60 + 100 * (1 - clear), 0) * cos_z ** 0.5
+    ghi = dni * cos_z + dhi
+    tamb = 10 + 10 * numpy.sin(numpy.pi * (day - 100) / 365) + 5 * cos_z
+    month = numpy.searchsorted(MONTH_START, day, 'right')
+    dates = zip(month, day - numpy.asarray(MONTH_START)[month - 1] + 1)
+    values = zip(ghi, dni, dhi, tamb)
+    if layout == 'tmy3':
+        lines = ['94018,"BOULDER",CO,%s,%s,%s,1634' % (tz, lat, lon),
+                 'Date (MM/DD/YYYY),Time (HH:MM),GHI (W/m^2),DNI (W/m^2),'
+                 'DHI (W/m^2),Dry-bulb (C),Wspd (m/s),Alb (unitless)']
+        row = '%02d/%02d/1990,%02d:00,%.3f,%.3f,%.3f,%.3f,3.0,0.2'
+        for hour, (date, value) in enumerate(zip(dates, values)):
+            lines.append(row % (date + (hour % 24 + 1,) + value))
+    else:
+        lines = ['Source,Location ID,City,State,Latitude,Longitude,'
+                 'Time Zone,Elevation',
+                 'NSRDB,94018,Boulder,CO,%s,%s,%s,1634' % (lat, lon, tz),
+                 'Year,Month,Day,Hour,Minute,GHI,DNI,DHI,Temperature,'
+                 'Wind Speed,Surface Albedo']
+        row = '1990,%d,%d,%d,30,%.3f,%.3f,%.3f,%.3f,3.0,0.2'
+        for hour, (date, value) in enumerate(zip(dates, values)):
+            lines.append(row % (date + (hour % 24,) + value))
+    return '\n'.join(lines) + '\n'
+
+
+def station_response(query):
+    """
+    Reply with the station nearest to the query of two, 94018 at 40, -105
+    and 94019 at 40, -104
+    """
+    lat, lon = float(query['lat']), float(query['lon'])
+    station = min((great_circle(lat, lon, 40.0, station_lon), location,
+                   station_lon) for location, station_lon in
+                  (('94018', -105.0), ('94019', -104.0)))
+    response = json.loads(SAMPLE_RESPONSE)
+    response['inputs'].update(lat=query['lat'], lon=query['lon'])
+    response['station_info'].update(
+        lat=40.0, lon=station[2], location=station[1],
+        solar_resource_file=station[1] + '.tm2',
+        distance=int(round(station[0])))
+    response['outputs']['ac_annual'] = float(station[1])
+    return 200, json.dumps(response)
+
+
+def peak_metrics(result):
+    """
+    Postprocess function of the process pool tests, run in the workers
+    """
+    return {'peak': float(result.ac.max()), 'pid': os.getpid()}
+
+
+def validation_errors(rows):
+    """
+    Return the (row, parameter, message) errors found validating each row
+    with the validate_* methods
+    """
+    errors = []
+    for index, row in enumerate(rows):
+        for name, value in sorted(row.items()):
+            try:
+                getattr(PVWatts, 'validate_' + name)(value)
+            except PVWattsValidationError as e:
+                errors.append((index, name, str(e)))
+    return errors
 
-SAMPLE_RESPONSE = """
-{
-   "inputs":{
-      "lat":"40",
-      "lon":"-105",
-      "system_capacity":"4",
-      "azimuth":"180",
-      "tilt":"40",
-      "array_type":"1",
-      "module_type":"1",
-      "losses":"10"
-   },
-   "errors":[
-
-   ],
-   "warnings":[
-
-   ],
-   "version":"1.0.1",
-   "ssc_info":{
-      "version":34,
-      "build":"Unix 64 bit GNU/C++ Aug 18 2014 13:38:36"
-   },
-   "station_info":{
-      "lat":40.016666412353516,
-      "lon":-105.25,
-      "elev":1634.0,
-      "tz":-7.0,
-      "location":"94018",
-      "city":"BOULDER",
-      "state":"CO",
-      "solar_resource_file":"94018.tm2",
-      "distance":21235
-   },
-   "outputs":{
-      "ac_monthly":[
-         474.3351745605469,
-         465.9206237792969,
-         628.4765625,
-         602.564208984375,
-         611.0515747070312,
-         591.2024536132812,
-         596.1395874023438,
-         610.1753540039062,
-         598.2145385742188,
-         574.7982177734375,
-         471.78070068359375,
-         458.9857177734375
-      ],
-      "poa_monthly":[
-         136.04103088378906,
-         136.04443359375,
-         185.7895965576172,
-         181.16891479492188,
-         185.77963256835938,
-         182.52105712890625,
-         187.89971923828125,
-         193.35572814941406,
-         187.40081787109375,
-         175.5979461669922,
-         137.59872436523438,
-         131.25526428222656
-      ],
-      "solrad_monthly":[
-         4.388420581817627,
-         4.858729839324951,
-         5.993212699890137,
-         6.038963794708252,
-         5.992891311645508,
-         6.084035396575928,
-         6.061281204223633,
-         6.237281322479248,
-         6.246694087982178,
-         5.664449691772461,
-         4.5866241455078125,
-         4.2340407371521
-      ],
-      "dc_monthly":[
-         495.09564208984375,
-         487.5823669433594,
-         657.702880859375,
-         629.8565063476562,
-         638.9706420898438,
-         618.6126708984375,
-         623.68994140625,
-         637.5205688476562,
-         624.635009765625,
-         599.9056396484375,
-         492.5662841796875,
-         479.1076354980469
-      ],
-      "ac_annual":6683.64501953125,
-      "solrad_annual":5.5322184562683105
-   }
-}
-"""
+
+def shared_cache_request(path, url, results):
+    """
+    Request a site through a directory cache shared with other processes
+    """
+    p = PVWatts(cache=DirectoryCache(path),
+                single_flight=FileSingleFlight(os.path.join(path, 'locks')))
+    p.PVWATTS_QUERY_URL = url
+    results.put(p.request(system_capacity=4, lat=40, lon=-105).ac_annual)
+
+
+def layout_response(query):
+    """
+    Reply with an ac_annual peaking at tilt 35 and azimuth 180
+    """
+    ac_annual = (6000 - (float(query['tilt']) - 35) ** 2 -
+                 ((float(query.get('azimuth', 180)) - 180) / 4) ** 2)
+    response = json.loads(SAMPLE_RESPONSE)
+    response['outputs']['ac_annual'] = ac_annual
+    response['outputs']['ac_monthly'] = [ac_annual / 12] * 12
+    return 200, json.dumps(response)
 
 
 class Test(unittest.TestCase):
@@ -118,6 +194,42 @@ class Test(unittest.TestCase):
         self.assertEqual(result.solrad_annual, 5.5322184562683105)
         self.assertEqual(result.station_info['city'], 'BOULDER')
 
+    def test_compact_result(self):
+        """Test CompactPVWattsResult matches PVWattsResult"""
+        response = hourly_response()
+        result = PVWattsResult(response)
+        compact = CompactPVWattsResult(response)
+        self.assertFalse(hasattr(compact, '__dict__'))
+        for name in PVWattsResult.shortcut_fields:
+            self.assertEqual(getattr(compact, name), getattr(result, name))
+        self.assertEqual(compact.station_info, result.station_info)
+        self.assertEqual(compact.raw, response)
+        self.assertEqual(result.compact().result, response)
+        self.assertRaises(KeyError, getattr, compact, 'missing')
+        self.assertRaises(KeyError, getattr,
+                          CompactPVWattsResult(json.loads(SAMPLE_RESPONSE)),
+                          'ac')
+
+        self.assertEqual(compact.capacity, 4.0)
+        self.assertEqual(compact.specific_yield, result.ac_annual / 4)
+        self.assertAlmostEqual(compact.capacity_factor,
+                               result.ac_annual / (4 * 8760) * 100)
+        self.assertEqual(compact.peak_ac, max(result.ac))
+        compact.ac_annual = 0
+        self.assertEqual(compact.specific_yield, result.ac_annual / 4)
+        response['outputs']['capacity_factor'] = 19.5
+        self.assertEqual(CompactPVWattsResult(response).capacity_factor, 19.5)
+        del response['inputs']['system_capacity']
+        self.assertIsNone(CompactPVWattsResult(response).specific_yield)
+
+        with StubServer() as server:
+            with PVWatts(compact=True) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                result = p.request(system_capacity=4, lat=40, lon=-105)
+        self.assertIsInstance(result, CompactPVWattsResult)
+        self.assertEqual(result.ac_annual, 6683.64501953125)
+        self.assertIsNone(result.peak_ac)
+
     def test_pypvwatts_validation(self):
         """Test pypvwatts validations"""
         self.assertRaises(PVWattsValidationError, PVWatts.request,
@@ -218,6 +330,343 @@ class Test(unittest.TestCase):
             losses=0.13, lat=40, lon=-105)
         self.assert_results(results)
 
+    def test_pypvwatts_session(self):
+        """Test requests reuse one pooled keep-alive connection"""
+        with StubServer() as server:
+            with PVWatts(api_key='DEMO_KEY', pool_maxsize=2) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                for _ in range(5):
+                    result = p.request(system_capacity=4, lat=40, lon=-105)
+                    self.assertEqual(result.ac_annual, 6683.64501953125)
+                session = p.get_session()
+                self.assertIs(session, p.get_session())
+            self.assertIsNone(p._session)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.requests), 5)
+        self.assertTrue(server.requests[0][1]['User-Agent'].startswith(
+            'pypvwatts/'))
+
+    def test_pypvwatts_class_session(self):
+        """Test class level requests share the class session"""
+        default_url = PVWatts.PVWATTS_QUERY_URL
+        with StubServer() as server:
+            PVWatts.PVWATTS_QUERY_URL = server.url
+            try:
+                PVWatts.request(system_capacity=4, lat=40, lon=-105)
+                PVWatts.request(system_capacity=4, lat=40, lon=-105)
+                self.assertIsNotNone(PVWatts._session)
+            finally:
+                PVWatts.PVWATTS_QUERY_URL = default_url
+                PVWatts.close()
+        self.assertIsNone(PVWatts._session)
+        self.assertEqual(server.connections, 1)
+
+    def test_pypvwatts_request_many(self):
+        """Test concurrent batches report failures per item"""
+        batch = [dict(system_capacity=4, lat=40, lon=lon)
+                 for lon in range(-110, -100)]
+        batch[3]['tilt'] = 100
+        batch[5]['lat'] = 13
+        with StubServer() as server:
+            server.respond = lambda query: (
+                (403, '{}') if query['lat'] == '13' else (200, SAMPLE_RESPONSE))
+            with PVWatts(pool_maxsize=4) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                results = list(p.request_many(batch))
+                self.assertEqual([i for i, _ in results], list(range(10)))
+                unordered = sorted(p.request_many(batch, max_workers=3,
+                                                  ordered=False),
+                                   key=lambda item: item[0])
+        for outcomes in (results, unordered):
+            self.assertIsInstance(outcomes[3][1], PVWattsValidationError)
+            self.assertIsInstance(outcomes[5][1], PVWattsError)
+            for index, result in outcomes:
+                if index not in (3, 5):
+                    self.assertEqual(result.ac_annual, 6683.64501953125)
+        # the invalid row is never sent
+        self.assertEqual(len(server.requests), 18)
+
+    def test_pypvwatts_cache(self):
+        """Test responses are served from the cache"""
+        cache = MemoryCache()
+        with StubServer() as server:
+            with PVWatts(cache=cache) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                first = p.request(system_capacity=4, lat=40, lon=-105)
+                second = p.request(system_capacity=4.0, lat=40.0, lon=-105)
+                p.request(system_capacity=4, lat=40, lon=-105,
+                          use_cache=False)
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(first.raw, second.raw)
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_pypvwatts_single_flight(self):
+        """Test identical concurrent requests share one request"""
+        batch = [dict(system_capacity=4, lat=40, lon=-105)] * 8
+        batch.append(dict(system_capacity=4, lat=40, lon=-100))
+        flight = SingleFlight()
+        with StubServer() as server:
+            server.respond = lambda query: (
+                time.sleep(0.3) or
+                ((403, '{}') if query['lon'] == '-100'
+                 else (200, SAMPLE_RESPONSE)))
+            with PVWatts(single_flight=flight) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                results = [result for _, result in
+                           p.request_many(batch + batch[-2:], max_workers=11)]
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(flight.stats,
+                         {'calls': 2, 'coalesced': 9, 'in_flight': 0})
+        self.assertEqual(results[0].ac_annual, 6683.64501953125)
+        for result in results[1:8] + results[9:10]:
+            self.assertIs(result, results[0])
+        self.assertIsInstance(results[8], PVWattsError)
+        self.assertIs(results[10], results[8])
+
+    def test_file_single_flight(self):
+        """Test processes sharing a cache directory send one request"""
+        path = os.path.join(tempfile.mkdtemp(), 'cache')
+        results = multiprocessing.Queue()
+        try:
+            with StubServer(latency=0.3) as server:
+                processes = [multiprocessing.Process(
+                    target=shared_cache_request,
+                    args=(path, server.url, results)) for _ in range(3)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+            self.assertEqual([results.get(timeout=5) for _ in processes],
+                             [6683.64501953125] * 3)
+            self.assertEqual(len(server.requests), 1)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+        # threads of one process with their own instances wait too
+        flights = [FileSingleFlight(self.id()) for _ in range(2)]
+        calls = []
+
+        def call():
+            calls.append('start')
+            time.sleep(0.1)
+            calls.append('end')
+        try:
+            threads = [threading.Thread(target=flight.do, args=('key', call))
+                       for flight in flights]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            shutil.rmtree(self.id())
+        self.assertEqual(calls, ['start', 'end'] * 2)
+
+    def test_pypvwatts_rescale(self):
+        """Test cached responses are rescaled to other capacities"""
+        with StubServer() as server:
+            server.respond = capacity_response
+            with PVWatts(cache=MemoryCache(), rescale=True) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                small = p.request(system_capacity=4, lat=40, lon=-105,
+                                  timeframe='hourly')
+                large = p.request(system_capacity=10, lat=40, lon=-105,
+                                  timeframe='hourly')
+                self.assertEqual(len(server.requests), 1)
+                expected = json.loads(capacity_response(
+                    {'system_capacity': '10'})[1])
+                self.assertEqual(large.inputs['system_capacity'], '10')
+                self.assertIs(large.poa, small.poa)
+                self.assertAlmostEqual(large.ac_annual,
+                                       expected['outputs']['ac_annual'])
+                for name in ('ac_monthly', 'dc_monthly', 'ac', 'dc'):
+                    for value, wanted in zip(getattr(large, name),
+                                             expected['outputs'][name]):
+                        self.assertAlmostEqual(value, wanted)
+
+                # strict rescaling checks against the actual response
+                p.rescale_strict = True
+                p.request(system_capacity=6, lat=40, lon=-105,
+                          timeframe='hourly')
+                self.assertEqual(len(server.requests), 2)
+                server.respond = lambda query: capacity_response(query, 200)
+                self.assertRaises(PVWattsError, p.request, system_capacity=8,
+                                  lat=40, lon=-105, timeframe='hourly')
+
+    def test_pypvwatts_station_index(self):
+        """Test nearby sites of the same station share cache entries"""
+        index = StationIndex()
+        with StubServer() as server:
+            server.respond = station_response
+            with PVWatts(cache=MemoryCache(), station_index=index) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                first = p.request(system_capacity=4, lat=40.1, lon=-105.0)
+                near = p.request(system_capacity=4, lat=40.11, lon=-105.005)
+                self.assertEqual(len(server.requests), 1)
+                self.assertEqual(near.ac_annual, first.ac_annual)
+                self.assertEqual(near.inputs['lat'], '40.11')
+                self.assertEqual(near.station_info['distance'], int(round(
+                    great_circle(40.11, -105.005, 40.0, -105.0))))
+                # another system is another cache entry
+                p.request(system_capacity=5, lat=40.11, lon=-105.005)
+                self.assertEqual(len(server.requests), 2)
+
+                # sites out of reach, or closer to another known station
+                p.request(system_capacity=4, lat=40.0, lon=-104.49)
+                self.assertEqual(len(server.requests), 3)
+                between = p.request(system_capacity=4, lat=40.0,
+                                    lon=-104.505)
+                self.assertEqual(len(server.requests), 4)
+                self.assertEqual(between.station_info['location'], '94018')
+                self.assertEqual(index.stats, {
+                    'stations': 2, 'sites': 4, 'lookups': 5, 'resolved': 2,
+                    'calls_avoided': 1})
+
+    def test_pypvwatts_key_pool(self):
+        """Test requests are spread over keys by quota left"""
+        one, two = PVWatts(api_key='ONE'), PVWatts(api_key='TWO')
+        self.assertEqual(one.build_params(system_capacity=4, lat=40,
+                                          lon=-105)['api_key'], 'ONE')
+        self.assertEqual(two.build_params(system_capacity=4, lat=40,
+                                          lon=-105)['api_key'], 'TWO')
+        self.assertEqual(PVWatts.api_key, 'DEMO_KEY')
+
+        remaining = {'A': 100, 'B': 500}
+
+        def respond(query):
+            key = query['api_key']
+            if key == 'C':
+                return 403, '{}'
+            remaining[key] -= 1
+            if key == 'B' and remaining[key] < 499:
+                return 429, '{}', {'Retry-After': '3600'}
+            return 200, SAMPLE_RESPONSE, {
+                'X-RateLimit-Limit': '1000',
+                'X-RateLimit-Remaining': str(remaining[key])}
+
+        pool = KeyPool(['A', 'B', 'C'])
+        with StubServer() as server:
+            server.respond = respond
+            with PVWatts(key_pool=pool) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                for _ in range(6):
+                    p.request(system_capacity=4, lat=40, lon=-105)
+                self.assertEqual(len(server.requests), 8)
+                stats = pool.stats
+                self.assertEqual(dict((key, (value['requests'],
+                                             value['state']))
+                                      for key, value in stats.items()),
+                                 {'A': (5, 'active'), 'B': (2, 'cooling'),
+                                  'C': (1, 'disabled')})
+                self.assertEqual(stats['A']['remaining'], 95)
+                self.assertEqual(len(pool), 2)
+
+                p.key_pool = KeyPool(['C'])
+                self.assertRaises(PVWattsError, p.request, system_capacity=4,
+                                  lat=40, lon=-105)
+
+    def test_pypvwatts_retry(self):
+        """Test 429 and 5xx responses are retried"""
+        replies = [(429, '{}', {'Retry-After': '0'}), (503, 'unavailable'),
+                   (200, SAMPLE_RESPONSE, {'X-RateLimit-Limit': '1000',
+                                           'X-RateLimit-Remaining': '997'})]
+        limiter = RateLimiter()
+        with StubServer() as server:
+            server.respond = lambda query: replies.pop(0)
+            with PVWatts(rate_limiter=limiter,
+                         retry=RetryPolicy(backoff_factor=0.01)) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                result = p.request(system_capacity=4, lat=40, lon=-105)
+                self.assertEqual(result.ac_annual, 6683.64501953125)
+                self.assertEqual(len(server.requests), 3)
+                self.assertEqual(limiter.budget['limit'], 1000)
+                self.assertEqual(limiter.budget['remaining'], 997)
+
+                server.respond = lambda query: (429, '{}')
+                p.rate_limiter = None
+                p.retry = RetryPolicy(max_retries=1, backoff_factor=0.01)
+                self.assertRaises(PVWattsRateLimitError, p.request,
+                                  system_capacity=4, lat=40, lon=-105)
+                self.assertEqual(len(server.requests), 5)
+
+    def test_pypvwatts_hooks(self):
+        """Test lifecycle events and the metrics collector"""
+        replies = [(503, 'unavailable'), (200, SAMPLE_RESPONSE)]
+        metrics = MetricsCollector()
+        hooks = Hooks(metrics)
+        events = []
+        hooks.on('retry', lambda event, info: events.append(
+            (event, info['status'], info['attempt'])))
+        hooks.on('error', lambda event, info: events.append(
+            (event, info['stage'], type(info['error']))))
+        self.assertRaises(ValueError, hooks.on, 'sent',
+                          lambda event, info: None)
+        transport = HTTPClientTransport()
+        responses = []
+        get = transport.get
+        transport.get = lambda *args, **kwargs: \
+            responses.append(get(*args, **kwargs)) or responses[-1]
+        with StubServer() as server:
+            server.respond = lambda query: replies.pop(0) if replies \
+                else (200, SAMPLE_RESPONSE)
+            with PVWatts(hooks=hooks, cache=MemoryCache(), transport=transport,
+                         retry=RetryPolicy(backoff_factor=0.01)) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                for _ in range(2):
+                    result = p.request(system_capacity=4, lat=40, lon=-105)
+                    self.assertEqual(result.ac_annual, 6683.64501953125)
+                self.assertRaises(PVWattsValidationError, p.request,
+                                  system_capacity=4, tilt=100)
+                server.respond = lambda query: (200, '{"outputs": ')
+                self.assertRaises(ValueError, p.request, system_capacity=4,
+                                  lat=41, lon=-105)
+                server.respond = lambda query: (403, '{}')
+                self.assertRaises(PVWattsError, p.request, system_capacity=4,
+                                  lat=42, lon=-105)
+                # the refused streamed response released its connection
+                self.assertIsNone(responses[-1]._raw)
+        self.assertEqual(events[:2], [
+            ('retry', 503, 0),
+            ('error', 'validate', PVWattsValidationError)])
+        self.assertEqual(events[2][:2], ('error', 'decode'))
+        self.assertTrue(issubclass(events[2][2], ValueError))
+        self.assertEqual(events[3], ('error', 'send', PVWattsError))
+        stats = metrics.stats
+        self.assertEqual(stats['counters'], {
+            'validate': 4, 'send': 4, 'first_byte': 4, 'retry': 1,
+            'decoded': 1, 'cache_hit': 1, 'error': 3})
+        self.assertEqual(stats['statuses'], {200: 2, 403: 1, 503: 1})
+        self.assertEqual(stats['bytes'], len(SAMPLE_RESPONSE))
+        latencies = stats['latencies']
+        self.assertEqual(latencies['first_byte']['count'], 4)
+        self.assertEqual(latencies['request']['count'], 1)
+        self.assertGreaterEqual(latencies['request']['p99'],
+                                latencies['decode']['p50'])
+
+    def test_hooks_without_key(self):
+        """Test hook payloads never carry the API key"""
+        replies = [(503, 'unavailable'), (200, SAMPLE_RESPONSE),
+                   (200, '{"outputs": ')]
+        payloads = []
+        hooks = Hooks(lambda event, info: payloads.append((event, info)))
+        with StubServer() as server:
+            server.respond = lambda query: replies.pop(0)
+            with PVWatts(api_key='secret', key_pool=KeyPool(['pooled']),
+                         hooks=hooks, cache=MemoryCache(),
+                         retry=RetryPolicy(backoff_factor=0.01)) as p:
+                p.PVWATTS_QUERY_URL = server.url
+                for _ in range(2):
+                    p.request(system_capacity=4, lat=40, lon=-105)
+                self.assertRaises(ValueError, p.request, system_capacity=4,
+                                  lat=41, lon=-105)
+            self.assertIn('api_key=pooled', server.requests[0][0])
+        self.assertEqual(set(event for event, _ in payloads), set(
+            ('validate', 'send', 'first_byte', 'retry', 'decoded',
+             'cache_hit', 'error')))
+        for event, info in payloads:
+            self.assertNotIn('api_key', info.get('params') or {}, event)
+            self.assertNotIn('secret', repr(info))
+            self.assertNotIn('pooled', repr(info))
+
     def assert_results(self, results):
         self.assertEqual(results.ac_annual, 7201.1396484375)
         self.assertEqual(results.solrad_annual, 5.446694850921631)
@@ -227,5 +676,1275 @@ class Test(unittest.TestCase):
         self.assertIn(6.103845596313477, results.solrad_monthly)
 
 
+@unittest.skipIf(numpy is None, 'requires numpy')
+class ColumnarTest(unittest.TestCase):
+    """
+    Unit tests for columnar hourly results.
+
+    """
+    def test_columnar_result(self):
+        """Test hourly fields become arrays on first access"""
+        response = hourly_response()
+        ac = response['outputs']['ac']
+        result = PVWattsResult(response, columnar=True, dtype='float32')
+        self.assertIs(result.result['outputs']['ac'], ac)
+        column = result.ac
+        self.assertIsInstance(column, numpy.ndarray)
+        self.assertEqual(column.dtype, numpy.float32)
+        self.assertIs(result.ac, column)
+        self.assertIs(result.result['outputs']['ac'], column)
+        # the response passed in is left untouched
+        self.assertIs(response['outputs']['ac'], ac)
+        self.assertIsInstance(result.dc, numpy.ndarray)
+        self.assertEqual(result.ac_annual, 6683.64501953125)
+        self.assertIsInstance(result.raw['outputs']['ac'], list)
+        self.assertTrue(numpy.allclose(result.raw['outputs']['ac'], ac))
+        # the list form is converted once, until another field is
+        raw = result.raw
+        self.assertIs(result.raw, raw)
+        self.assertIsInstance(result.tcell, numpy.ndarray)
+        self.assertIsNot(result.raw, raw)
+        self.assertIsInstance(result.raw['outputs']['tcell'], list)
+
+    def test_columnar_views(self):
+        """Test daily and monthly reshapes are views"""
+        result = PVWattsResult(hourly_response(), columnar=True)
+        daily = result.daily('ac')
+        self.assertEqual(daily.shape, (365, 24))
+        self.assertTrue(numpy.shares_memory(daily, result.ac))
+        monthly = result.monthly('ac')
+        self.assertEqual([len(month) for month in monthly],
+                         [744, 672, 744, 720, 744, 720, 744, 744, 720, 744,
+                          720, 744])
+        self.assertTrue(all(numpy.shares_memory(month, result.ac)
+                            for month in monthly))
+        self.assertEqual(monthly[1][0], result.ac[744])
+        self.assertIsInstance(PVWattsResult(hourly_response()).ac, list)
+
+    def test_compact_columnar(self):
+        """Test compact columnar results convert hourly fields eagerly"""
+        response = hourly_response()
+        compact = CompactPVWattsResult(response, columnar=True,
+                                       dtype='float32')
+        self.assertIsInstance(compact.ac, numpy.ndarray)
+        self.assertIs(compact.column('ac'), compact.ac)
+        self.assertTrue(numpy.shares_memory(compact.daily('ac'), compact.ac))
+        self.assertIsInstance(response['outputs']['ac'], list)
+        self.assertIsInstance(compact.raw['outputs']['ac'], list)
+        self.assertIs(compact.raw, compact.raw)
+        self.assertEqual(compact.peak_ac, numpy.float32(max(
+            response['outputs']['ac'])))
+
+        fleet = FleetAggregator()
+        fleet.add(compact)
+        self.assertEqual(fleet.capacity, 4.0)
+        path = os.path.join(tempfile.mkdtemp(), 'compact.pvw')
+        try:
+            compact.save(path)
+            self.assertTrue(numpy.array_equal(PVWattsResult.load(path).ac,
+                                              compact.ac))
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'requires Python 3.8')
+    def test_process_pool(self):
+        """Test responses are decoded and post-processed in processes"""
+        response = hourly_response()
+        body = json.dumps(response)
+        batch = [dict(system_capacity=4, lat=40, lon=-105 + index % 3)
+                 for index in range(9)] + [dict(system_capacity=-1)]
+        with StubServer() as server:
+            server.respond = lambda query: (200, body)
+            with PVWatts(cache=MemoryCache(), dtype='float32') as p:
+                p.PVWATTS_QUERY_URL = server.url
+                results = list(p.request_many(batch, max_workers=1,
+                                              processes=2,
+                                              postprocess=peak_metrics))
+        self.assertIsInstance(results[9][1], PVWattsValidationError)
+        self.assertEqual(len(server.requests), 3)
+        for index, result in results[:9]:
+            self.assertEqual(result.ac.dtype, numpy.float32)
+            self.assertTrue(numpy.allclose(result.ac,
+                                           response['outputs']['ac']))
+            self.assertEqual(result.ac_monthly,
+                             response['outputs']['ac_monthly'])
+            self.assertEqual(result.metrics['peak'], 333.0)
+        # decoded in the workers, cache hits post-processed here
+        self.assertNotEqual(results[0][1].metrics['pid'], os.getpid())
+        self.assertEqual(results[3][1].metrics['pid'], os.getpid())
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'requires Python 3.8')
+    def test_process_pool_spawn(self):
+        """Test spawned workers leave the shared memory to the parent"""
+        from multiprocessing import get_context, resource_tracker
+        from multiprocessing import shared_memory
+        from . import processing
+        response = hourly_response()
+        body = json.dumps(response).encode('utf8')
+        decoder = processing.ProcessDecoder(processes=1, slots=1,
+                                            context=get_context('spawn'))
+        try:
+            for _ in range(2):
+                data, _ = decoder.decode(body)
+                self.assertTrue(numpy.allclose(data['outputs']['ac'],
+                                               response['outputs']['ac']))
+            name = decoder._slots[0].name
+            # the exited worker neither unlinked the slot nor registered it
+            decoder.executor.shutdown()
+            registered = []
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: registered.append(args)
+            try:
+                slot = processing._attach_untracked(shared_memory, name)
+            finally:
+                resource_tracker.register = register
+            slot.close()
+            self.assertEqual(registered, [])
+        finally:
+            decoder.close()
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory,
+                          name=name)
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'requires Python 3.8')
+    def test_process_pool_lifetime(self):
+        """Test the process pool only lives while the batch is iterated"""
+        from . import processing
+        ProcessDecoder = processing.ProcessDecoder
+        decoders = []
+        errors = []
+
+        class Decoder(ProcessDecoder):
+            def __init__(self, *args, **kwargs):
+                ProcessDecoder.__init__(self, *args, **kwargs)
+                decoders.append(self)
+        hooks = Hooks()
+        hooks.on('error', lambda event, info: errors.append(info['stage']))
+        processing.ProcessDecoder = Decoder
+        try:
+            with StubServer() as server:
+                with PVWatts(hooks=hooks) as p:
+                    p.PVWATTS_QUERY_URL = server.url
+                    batch = [dict(system_capacity=4, lat=40, lon=-105)] * 4
+                    results = p.request_many(batch, max_workers=1,
+                                             processes=1)
+                    self.assertEqual(decoders, [])
+                    next(results)
+                    results.close()
+                    self.assertEqual(decoders[0]._slots, [])
+                    # requests in flight then fail to decode
+                    del errors[:]
+                    server.respond = lambda query: (403, '{}')
+                    results = list(p.request_many(batch[:1], processes=1))
+        finally:
+            processing.ProcessDecoder = ProcessDecoder
+        self.assertIsInstance(results[0][1], PVWattsError)
+        self.assertEqual(errors, ['send'])
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class StreamingTest(unittest.TestCase):
+    """
+    Unit tests for incremental response decoding.
+
+    """
+    def assert_decoded(self, body, chunk_size):
+        data = body.encode('utf8')
+        decoded = decode_stream(data[i:i + chunk_size]
+                                for i in range(0, len(data), chunk_size))
+        expected = json.loads(body)
+        outputs = decoded.pop('outputs')
+        expected_outputs = expected.pop('outputs')
+        self.assertEqual(decoded, expected)
+        self.assertEqual(sorted(outputs), sorted(expected_outputs))
+        for name, values in expected_outputs.items():
+            if name in PVWattsResult.hourly_fields:
+                self.assertIsInstance(outputs[name], numpy.ndarray)
+                self.assertEqual(outputs[name].tolist(), values)
+            else:
+                self.assertEqual(outputs[name], values)
+
+    def test_decode_stream(self):
+        """Test decoding across every chunk boundary"""
+        tricky = json.dumps({'errors': ['a \\" ]} [{'], 'outputs': {
+            'empty': [], 'nulls': [None, 1], 'ac': [1, 2.5e-3, -4]},
+            'ssc_info': {'nested': [1, {'x': '}'}]}})
+        for chunk_size in (1, 2, 3, 5, 64):
+            self.assert_decoded(tricky, chunk_size)
+            self.assert_decoded(SAMPLE_RESPONSE, chunk_size)
+        hourly = json.dumps(hourly_response(), indent=1)
+        for chunk_size in (17, 4096, 65536):
+            self.assert_decoded(hourly, chunk_size)
+        self.assertRaises(PVWattsError, decode_stream, [b'{"a": [1'])
+        self.assertRaises(PVWattsError, decode_stream,
+                          [b'{"outputs": {"ac": [1, , 2]}}'])
+
+    @unittest.skipIf(tracemalloc is None, 'requires tracemalloc')
+    def test_array_parsing_memory(self):
+        """Test numbers are parsed without a list of strings"""
+        values = [hour / 7.0 for hour in range(8760)]
+        text = ',\n '.join(repr(value) for value in values)
+        array = _ArrayBuffer(numpy, 8760, 'float64')
+        tracemalloc.start()
+        try:
+            array.extend(text)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(array.finish().tolist(), values)
+        # the parsed values only, a list of strings would take 700KB
+        self.assertLess(peak, 2 * 8 * 8760)
+        self.assertRaises(PVWattsError, array.extend, '1, ,2')
+
+    def measure(self, server, streaming):
+        with PVWatts(streaming=streaming) as p:
+            p.PVWATTS_QUERY_URL = server.url
+            p.get_data(params={'lat': 40})
+            gc.collect()
+            tracemalloc.start()
+            try:
+                data = p.get_data(params={'lat': 40})
+                return data, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    @unittest.skipIf(tracemalloc is None, 'requires tracemalloc')
+    def test_streaming_memory(self):
+        """Test peak memory of a streamed hourly response is capped"""
+        body = json.dumps(hourly_response()).encode('utf8')
+        with StubServer() as server:
+            server.respond = lambda query: (200, body)
+            expected, buffered_peak = self.measure(server, False)
+            data, streamed_peak = self.measure(server, True)
+        # 8 hourly float64 arrays take 560KB
+        self.assertLess(streamed_peak, 1250 * 1024)
+        self.assertLess(streamed_peak, buffered_peak / 3)
+        self.assertEqual(data['outputs']['ac'].tolist(),
+                         expected['outputs']['ac'])
+        self.assertEqual(data['station_info'], expected['station_info'])
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class ArchiveTest(unittest.TestCase):
+    """
+    Unit tests for binary result archives.
+
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'results.pvw')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assert_same(self, loaded, result):
+        self.assertEqual(loaded.raw, result.raw)
+        self.assertEqual(loaded.ac_annual, result.ac_annual)
+        self.assertEqual(loaded.station_info, result.station_info)
+
+    def test_save_load(self):
+        """Test single results round trip"""
+        for response in (json.loads(SAMPLE_RESPONSE), hourly_response()):
+            result = PVWattsResult(response)
+            result.save(self.path)
+            for mmap in (True, False):
+                loaded = PVWattsResult.load(self.path, mmap=mmap)
+                self.assert_same(loaded, result)
+        self.assertIsInstance(loaded.ac, numpy.ndarray)
+        # monthly fields are lists, as in responses
+        self.assertEqual(loaded.ac_monthly, result.ac_monthly)
+        self.assertIsInstance(loaded.ac_monthly, list)
+        json.dumps(loaded.raw)
+        # memory mapped columns are read only views of the file
+        self.assertFalse(PVWattsResult.load(self.path).ac.flags.writeable)
+        self.assertEqual(loaded.daily('dc').shape, (365, 24))
+
+    def test_archive(self):
+        """Test multi result archives, dtypes and appending"""
+        results = [PVWattsResult(hourly_response()),
+                   PVWattsResult(json.loads(SAMPLE_RESPONSE)),
+                   PVWattsResult(hourly_response(), columnar=True,
+                                 dtype='float32')]
+        for name in PVWattsResult.hourly_fields:
+            getattr(results[2], name)
+        with ArchiveWriter(self.path) as writer:
+            for result in results[:2]:
+                writer.write(result)
+        with ArchiveWriter(self.path, append=True) as writer:
+            writer.write(results[2])
+        archive = PVWattsArchive(self.path)
+        self.assertEqual(len(archive), 3)
+        for loaded, result in zip(archive, results):
+            self.assert_same(loaded, result)
+        self.assertEqual(archive[2].ac.dtype, numpy.float32)
+        self.assertEqual(archive[0].ac.dtype, numpy.float64)
+
+    def test_archive_recovery(self):
+        """Test archives left without index can be appended to"""
+        writer = ArchiveWriter(self.path)
+        writer.write(PVWattsResult(hourly_response()))
+        writer.write(PVWattsResult(hourly_response()))
+        writer.flush()
+        size = writer.tell()
+        writer.file.close()
+        self.assertRaises(PVWattsError, PVWattsArchive, self.path)
+        # simulate a write interrupted halfway through the second entry
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 1000)
+        with ArchiveWriter(self.path, append=True) as writer:
+            self.assertEqual(len(writer), 1)
+            writer.write(PVWattsResult(json.loads(SAMPLE_RESPONSE)))
+        archive = PVWattsArchive(self.path, mmap=False)
+        self.assertEqual(len(archive), 2)
+        self.assertEqual(archive[1].ac_monthly,
+                         json.loads(SAMPLE_RESPONSE)['outputs']['ac_monthly'])
+
+    def test_archive_version(self):
+        """Test archives of another format version are rejected"""
+        PVWattsResult(json.loads(SAMPLE_RESPONSE)).save(self.path)
+        with open(self.path, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('<I', 2))
+        self.assertRaises(PVWattsError, PVWattsArchive, self.path)
+        self.assertRaises(PVWattsError, ArchiveWriter, self.path,
+                          append=True)
+
+
+class ValidationTest(unittest.TestCase):
+    """
+    Unit tests for batch validation.
+
+    """
+    rows = [
+        dict(system_capacity=4, tilt=30, azimuth=180, lat=40, lon=-105),
+        dict(system_capacity='4', tilt=100, azimuth=180, lat=40, lon=-105),
+        dict(system_capacity=4, tilt=30, azimuth=None, lat=40.5, lon=-105,
+             dataset='tmy9'),
+        dict(system_capacity=0.01, tilt=float('nan'), azimuth=360, lat=-91,
+             lon=-105, dataset=3, dc_ac_ratio=0),
+    ]
+
+    def test_validate_batch_rows(self):
+        """Test batch validation matches per value validation"""
+        errors = PVWatts.validate_batch(self.rows)
+        self.assertEqual(sorted(errors), sorted(validation_errors(self.rows)))
+        self.assertEqual(errors[0], (1, 'system_capacity',
+                                     'system_capacity must be int, long or '
+                                     'float'))
+        self.assertEqual([row for row, _, _ in errors],
+                         [1, 1, 2, 3, 3, 3, 3, 3])
+        self.assertEqual(PVWatts.validate_batch(self.rows[:1]), [])
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_validate_batch_columns(self):
+        """Test validating numpy columns"""
+        size = 100000
+        tilt = numpy.linspace(-10, 100, size)
+        columns = {'tilt': tilt,
+                   'lat': numpy.full(size, 40.0),
+                   'module_type': numpy.arange(size) % 4,
+                   'dataset': numpy.array(['tmy3', 'nsrdb', 'tmy'] * 33333 +
+                                          ['intl'])}
+        errors = PVWatts.validate_batch(columns)
+        invalid_tilt = numpy.flatnonzero((tilt < 0) | (tilt > 90))
+        self.assertEqual(len(errors), len(invalid_tilt) + size // 4 + 33333)
+        self.assertEqual(set(row for row, name, _ in errors
+                             if name == 'tilt'), set(invalid_tilt.tolist()))
+        self.assertIn((2, 'dataset', "dataset must be 'nsrdb', 'tmy2', "
+                                     "'tmy3' or 'intl'"), errors)
+
+        # numpy scalars pass one at a time as they do in columns
+        params = PVWatts.build_params(system_capacity=numpy.int64(4),
+                                      lat=numpy.float32(40),
+                                      lon=numpy.int32(-105))
+        self.assertEqual(params['system_capacity'], 4)
+        self.assertEqual(PVWatts.validate_batch(
+            [dict(system_capacity=numpy.int64(4), tilt=numpy.int64(100))]),
+            [(0, 'tilt', 'tilt must be >= 0 and <= 90')])
+        self.assertRaises(PVWattsValidationError, PVWatts.validate_batch,
+                          {'tilt': tilt, 'lat': [40.0]})
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class FleetTest(unittest.TestCase):
+    """
+    Unit tests for fleet aggregates.
+
+    """
+    def fleet(self, count):
+        """
+        Return responses of count sites with random hourly ac
+        """
+        random = numpy.random.RandomState(count)
+        responses = []
+        for _ in range(count):
+            response = hourly_response()
+            capacity = random.uniform(1, 100)
+            response['inputs']['system_capacity'] = str(capacity)
+            response['outputs']['ac'] = random.rand(8760) * 1000 * capacity
+            responses.append(response)
+        return responses
+
+    def test_fleet_aggregates(self):
+        """Test hourly totals, extremes and quantiles of a fleet"""
+        responses = self.fleet(50)
+        ac = numpy.array([response['outputs']['ac']
+                          for response in responses])
+        specific = ac / numpy.array([[float(
+            response['inputs']['system_capacity'])]
+            for response in responses])
+        fleet = FleetAggregator(bins=100, block=16)
+        fleet.update(enumerate(responses + [PVWattsError('failed')]))
+        self.assertEqual((fleet.sites, fleet.errors), (50, 1))
+        numpy.testing.assert_allclose(fleet.total(), ac.sum(axis=0))
+        numpy.testing.assert_allclose(fleet.mean(), ac.mean(axis=0))
+        numpy.testing.assert_allclose(fleet.min['ac'], ac.min(axis=0))
+        numpy.testing.assert_allclose(fleet.max['ac'], ac.max(axis=0))
+        self.assertAlmostEqual(fleet.monthly()[1],
+                               ac[:, 744:1416].sum(), delta=1e-3)
+        self.assertEqual(fleet.histogram['ac'].nbytes, 8760 * 100 * 8)
+        for q in (0.1, 0.5, 0.9):
+            # between the order statistics around q, give or take a bin
+            # width of 12 W/kW
+            quantile = fleet.quantile(q)
+            self.assertTrue((quantile >= numpy.quantile(
+                specific, q, axis=0, method='lower') - 12).all())
+            self.assertTrue((quantile <= numpy.quantile(
+                specific, q, axis=0, method='higher') + 12).all())
+        total = ac.sum(axis=0)
+        peak = fleet.peak()
+        self.assertEqual(peak['hour'], total.argmax())
+        self.assertAlmostEqual(peak['coincidence'],
+                               total.max() / ac.max(axis=1).sum())
+
+    def test_fleet_merge(self):
+        """Test partial aggregates merge into the aggregate of all sites"""
+        responses = self.fleet(30)
+        whole = FleetAggregator(fields=('ac', 'tamb')).update(responses)
+        first = FleetAggregator(fields=('ac', 'tamb')).update(responses[:12])
+        second = FleetAggregator(fields=('ac', 'tamb')).update(responses[12:])
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'second.npz')
+            second.save(path)
+            first.merge(FleetAggregator.load(path))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(first.sites, 30)
+        self.assertAlmostEqual(first.capacity, whole.capacity)
+        for name in ('ac', 'tamb'):
+            numpy.testing.assert_allclose(first.total(name),
+                                          whole.total(name))
+            numpy.testing.assert_array_equal(first.histogram[name],
+                                             whole.histogram[name])
+        self.assertEqual(first.peak(), whole.peak())
+        self.assertRaises(PVWattsError, first.merge, FleetAggregator())
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class TimeIndexTest(unittest.TestCase):
+    """
+    Unit tests for time indexes, resampling and time of use buckets.
+
+    """
+    def results(self, zones):
+        """
+        Return hourly results of stations in the time zones
+        """
+        random = numpy.random.RandomState(len(zones))
+        results = []
+        for tz in zones:
+            response = hourly_response()
+            response['station_info']['tz'] = tz
+            response['outputs']['ac'] = random.rand(8760) * 4000
+            results.append(PVWattsResult(response, columnar=True))
+        return results
+
+    def test_time_index(self):
+        """Test hours are stamped in local standard time or UTC"""
+        result = self.results([-7.0])[0]
+        index = result.time_index()
+        self.assertEqual(len(index), 8760)
+        self.assertEqual(str(index[0]), '2001-01-01T00:00')
+        self.assertEqual(str(index[-1]), '2001-12-31T23:00')
+        self.assertEqual(str(result.time_index(utc=True)[0]),
+                         '2001-01-01T07:00')
+        self.assertEqual(str(time_index(5.5, utc=True)[0]),
+                         '2000-12-31T18:30')
+        self.assertRaises(PVWattsError, time_index, utc=True)
+        self.assertRaises(PVWattsError, time_index, year=2004)
+
+    def test_resample(self):
+        """Test daily, monthly and annual rollups of one or many results"""
+        results = self.results([-7.0, -5.0, -8.0])
+        values, tz = stack(results)
+        self.assertEqual(tz.tolist(), [-7.0, -5.0, -8.0])
+        ac = results[0].ac
+        numpy.testing.assert_allclose(results[0].resample('ac', 'D'),
+                                      ac.reshape(365, 24).sum(axis=1))
+        numpy.testing.assert_allclose(
+            results[0].resample('ac', 'M', how='max'),
+            [month.max() for month in results[0].monthly('ac')])
+        monthly = resample(values, 'M', how='mean')
+        self.assertEqual(monthly.shape, (3, 12))
+        self.assertAlmostEqual(monthly[1, 1], values[1, 744:1416].mean())
+        numpy.testing.assert_allclose(resample(values, 'A'),
+                                      values.sum(axis=1))
+        self.assertRaises(PVWattsError, resample, values, 'W')
+        self.assertRaises(PVWattsError, resample, values[:, 1:])
+
+    def test_tariff(self):
+        """Test time of use buckets and costs match an hour by hour loop"""
+        # on peak 16:00-21:00 on weekdays of June to September
+        weekday = numpy.zeros((12, 24), dtype=int)
+        weekday[5:9, 16:21] = 1
+        tariff = Tariff(weekday, numpy.zeros((12, 24)), rates=[0.1, 0.4],
+                        holidays=[184], tz=-8.0)
+        results = self.results([-8.0, -5.0])
+        values, tz = stack(results)
+        local = numpy.roll(values[1], -3)
+        expected = numpy.zeros((2, 12, 2))
+        for hour, stamp in enumerate(time_index()):
+            moment = stamp.astype(object)
+            period = int(moment.weekday() < 5 and hour // 24 != 184 and
+                         5 <= moment.month - 1 < 9 and
+                         16 <= moment.hour < 21)
+            expected[0, moment.month - 1, period] += values[0, hour]
+            expected[1, moment.month - 1, period] += local[hour]
+        numpy.testing.assert_allclose(
+            tariff.buckets(values, tz=tz, monthly=True), expected)
+        numpy.testing.assert_allclose(tariff.buckets(values, tz=tz),
+                                      expected.sum(axis=1))
+        numpy.testing.assert_allclose(
+            tariff.cost(values, tz=tz),
+            expected.sum(axis=1).dot([0.1, 0.4]) / 1000)
+        self.assertEqual(tariff.cost(values[0]).shape, ())
+        self.assertRaises(PVWattsError, Tariff, weekday[:6])
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class SweepTest(unittest.TestCase):
+    """
+    Unit tests for parameter sweeps.
+
+    """
+    base = dict(system_capacity=4, lat=40, lon=-105)
+
+    def test_sweep_grid(self):
+        """Test sweeps fill a dense grid and skip equivalent points"""
+        with StubServer() as server:
+            server.respond = layout_response
+            with PVWatts() as p:
+                p.PVWATTS_QUERY_URL = server.url
+                grid = p.sweep(self.base, [('tilt', [0, 30, 95]),
+                                           ('azimuth', [0, 180, 360])])
+        self.assertEqual(grid.shape, (3, 3))
+        self.assertEqual(grid.ac_monthly.shape, (3, 3, 12))
+        # azimuth 0 and 360 are the same, and is irrelevant at tilt 0
+        self.assertEqual(grid.requests, 3)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(grid.ac_annual[1, 0], grid.ac_annual[1, 2])
+        self.assertEqual(sorted(grid.errors), [(2, 0), (2, 1), (2, 2)])
+        self.assertTrue(numpy.isnan(grid.ac_annual[2]).all())
+        self.assertEqual(grid.best(), {'tilt': 30, 'azimuth': 180})
+        self.assertAlmostEqual(grid.ac_monthly[1, 1].sum(),
+                               grid.ac_annual[1, 1])
+
+    def test_sweep_refine(self):
+        """Test refinement converges with fewer requests than a fine grid"""
+        with StubServer() as server:
+            server.respond = layout_response
+            with PVWatts() as p:
+                p.PVWATTS_QUERY_URL = server.url
+                grid = p.sweep(self.base,
+                               [('tilt', list(range(0, 91, 15))),
+                                ('azimuth', list(range(90, 271, 45)))],
+                               refine=3)
+        best = grid.best()
+        self.assertAlmostEqual(best['tilt'], 35, delta=1)
+        self.assertAlmostEqual(best['azimuth'], 180, delta=3)
+        self.assertEqual(len(grid.rounds), 4)
+        self.assertEqual(grid.requests, len(server.requests))
+        self.assertLess(grid.requests, 100)
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class LocalTest(unittest.TestCase):
+    """
+    Unit tests for the local simulation engine.
+
+    """
+    system = dict(system_capacity=4, lat=40, lon=-105, tilt=40,
+                  azimuth=180, timeframe='hourly')
+
+    def setUp(self):
+        from .local import LocalPVWatts
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for layout, lat in (('tmy3', 40.0), ('sam', 30.0)):
+            self.paths.append(os.path.join(self.directory, layout + '.csv'))
+            with open(self.paths[-1], 'w') as file:
+                file.write(weather_csv(layout, lat=lat))
+        self.local = LocalPVWatts(self.paths)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_weather(self):
+        """Test both weather file layouts are read alike"""
+        tmy3 = read_weather(self.paths[0])
+        with open(os.path.join(self.directory, 'boulder.csv'), 'w') as file:
+            file.write(weather_csv('sam'))
+        sam = read_weather(os.path.join(self.directory, 'boulder.csv'))
+        self.assertEqual(len(tmy3), 8760)
+        self.assertEqual((tmy3.lat, tmy3.lon, tmy3.tz, tmy3.elevation),
+                         (sam.lat, sam.lon, sam.tz, sam.elevation))
+        self.assertEqual(tmy3.file_id, 'tmy3.csv')
+        for name in ('ghi', 'dni', 'dhi', 'tamb', 'wspd', 'albedo', 'day',
+                     'hour'):
+            self.assertTrue(numpy.array_equal(getattr(tmy3, name),
+                                              getattr(sam, name)), name)
+        self.assertEqual(tmy3.hour[:2].tolist(), [0.5, 1.5])
+        self.assertEqual(tmy3.day[-1], 364)
+
+    def test_local_request(self):
+        """Test local results have the shape of API results"""
+        result = self.local.request(**self.system)
+        self.assertIsInstance(result, PVWattsResult)
+        self.assertEqual(result.station_info['solar_resource_file'],
+                         'tmy3.csv')
+        self.assertEqual(result.inputs['tilt'], '40')
+        for name in PVWattsResult.hourly_fields:
+            self.assertEqual(len(getattr(result, name)), 8760)
+        for name in ('ac_monthly', 'dc_monthly', 'poa_monthly',
+                     'solrad_monthly'):
+            self.assertEqual(len(getattr(result, name)), 12)
+        self.assertAlmostEqual(result.ac_annual, result.ac.sum() / 1000)
+        self.assertAlmostEqual(sum(result.ac_monthly), result.ac_annual)
+        self.assertTrue((result.ac <= result.dc).all())
+        self.assertEqual(result.ac[result.poa == 0].max(), 0)
+        self.assertGreater(result.tcell.max(), result.tamb.max())
+        self.assertNotIn('ac', self.local.request(
+            system_capacity=4, lat=40, lon=-105, tilt=40,
+            azimuth=180).outputs)
+
+        # a larger dc_ac_ratio clips the AC output at the inverter rating
+        clipped = self.local.request(dc_ac_ratio=2, **self.system)
+        self.assertAlmostEqual(clipped.ac.max(), 4000 / 2.)
+        self.assertLess(clipped.ac_annual, result.ac_annual)
+        # facing the equator, and tracking, yield more
+        north = dict(self.system, azimuth=0)
+        self.assertLess(self.local.request(**north).ac_annual,
+                        result.ac_annual)
+        tracked = [self.local.request(array_type=array_type,
+                                      **self.system).poa.sum()
+                   for array_type in (0, 2, 4)]
+        self.assertEqual(tracked, sorted(tracked))
+
+        self.assertRaises(PVWattsValidationError, self.local.request,
+                          system_capacity=4, lat=40, lon=-105, tilt=100,
+                          azimuth=180)
+        self.assertRaises(PVWattsError, self.local.request, radius=100,
+                          system_capacity=4, lat=0, lon=0, tilt=0,
+                          azimuth=180)
+
+    def test_local_request_many(self):
+        """Test batches match single requests across stations"""
+        batch = [dict(self.system, lat=lat, tilt=tilt, array_type=array_type)
+                 for lat in (40, 31) for tilt in (10, 30)
+                 for array_type in (1, 3)]
+        batch[2]['azimuth'] = 400
+        self.local.chunk_size = 3
+        results = list(self.local.request_many(batch))
+        self.assertEqual([index for index, _ in results], list(range(8)))
+        self.assertIsInstance(results[2][1], PVWattsValidationError)
+        for index, result in results:
+            if index == 2:
+                continue
+            single = self.local.request(**batch[index])
+            self.assertAlmostEqual(result.ac_annual, single.ac_annual)
+            self.assertTrue(numpy.allclose(result.ac, single.ac))
+        self.assertEqual(results[4][1].station_info['lat'], 30)
+
+    def test_cell_temperature(self):
+        """Test the thermal model against its rating and converged sweeps"""
+        from .local import MODULE_HEIGHT, WIND_HEIGHT, cell_temperature
+        # INOCT conditions: 800 W/m2, 20 C and 1 m/s at the modules
+        wind = (1 - 1e-4) / (MODULE_HEIGHT / WIND_HEIGHT) ** 0.2
+        for array_type, inoct in ((0, 45), (1, 49)):
+            tcell = cell_temperature(numpy.full(48, 800.0), 20, wind,
+                                     array_type)
+            self.assertAlmostEqual(tcell[-1], inoct, delta=0.01)
+
+        # sweeps over the whole year converge to the hour by hour solution
+        weather = read_weather(self.paths[0])
+        poa = numpy.maximum(weather.ghi, 0)
+        tcell = cell_temperature(poa, weather.tamb, weather.wspd, 0)
+        exact = cell_temperature(poa, weather.tamb, weather.wspd, 0,
+                                 sweeps=50, tolerance=0)
+        sunlit = poa > 0
+        self.assertLess(abs(tcell - exact)[sunlit].max(), 0.05)
+        self.assertTrue((tcell[sunlit] > weather.tamb[sunlit]).any())
+        stacked = cell_temperature(numpy.array([poa] * 10), weather.tamb,
+                                   weather.wspd, 0)
+        self.assertEqual(stacked.shape, (10, 8760))
+        self.assertTrue(numpy.allclose(stacked[9], tcell))
+
+
+class CLITest(unittest.TestCase):
+    """
+    Unit tests for the pypvwatts command line interface.
+
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, 'sites.jsonl')
+        rows = [dict(system_capacity=4, lat=40, lon=-110 + row)
+                for row in range(10)]
+        rows[3]['tilt'] = 100
+        with open(self.input, 'w') as file:
+            file.write('\n'.join(json.dumps(row) for row in rows))
+        self.server = StubServer().__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.directory)
+
+    def main(self, *args):
+        return cli.main(['run', '--quiet', '--url', self.server.url,
+                         '--workers', '2'] + list(args))
+
+    def read(self, path):
+        with open(path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_cli_jsonl(self):
+        """Test results and errors stream to a JSONL file in order"""
+        output = os.path.join(self.directory, 'results.jsonl')
+        csv_input = os.path.join(self.directory, 'sites.csv')
+        with open(csv_input, 'w') as file:
+            file.write('system_capacity,lat,lon,tilt\n4,40,-105,\n'
+                       '4,40,-105,100\n')
+        self.assertEqual(self.main(self.input, output), 0)
+        records = self.read(output)
+        self.assertEqual([record['row'] for record in records],
+                         list(range(10)))
+        self.assertEqual(records[3]['type'], 'PVWattsValidationError')
+        self.assertEqual(records[0]['result']['outputs']['ac_annual'],
+                         6683.64501953125)
+        self.assertEqual(len(self.server.requests), 9)
+        self.assertEqual(cli.load_checkpoint(output + '.checkpoint')
+                         ['rows_done'], 10)
+
+        # numbers are converted, string parameters keep their digits
+        zip_input = os.path.join(self.directory, 'zip.csv')
+        with open(zip_input, 'w') as file:
+            file.write('system_capacity,lat,lon,address\n4.5,40,-105,01230\n')
+        self.assertEqual(list(cli.read_rows(zip_input))[0],
+                         {'system_capacity': 4.5, 'lat': 40, 'lon': -105,
+                          'address': '01230'})
+
+        self.assertEqual(self.main(csv_input, output, '--strict'), 1)
+        self.assertEqual(['result' in record for record in self.read(output)],
+                         [True, False])
+
+    def test_cli_replay(self):
+        """Test a job recorded once is replayed offline"""
+        recording = os.path.join(self.directory, 'recording.jsonl')
+        recorded = os.path.join(self.directory, 'recorded.jsonl')
+        replayed = os.path.join(self.directory, 'replayed.jsonl')
+        self.assertEqual(self.main(self.input, recorded, '--record',
+                                   recording), 0)
+        self.server.respond = lambda query: (500, 'unexpected')
+        self.assertEqual(self.main(self.input, replayed, '--replay',
+                                   recording), 0)
+        self.assertEqual(self.read(replayed), self.read(recorded))
+        self.assertEqual(len(self.server.requests), 9)
+
+    def test_cli_warm(self):
+        """Test warming a cache only requests the rows missing from it"""
+        cache = os.path.join(self.directory, 'cache') + os.sep
+
+        def warm(*args):
+            stdout = sys.stdout
+            sys.stdout = io.StringIO() if sys.version_info[0] > 2 \
+                else io.BytesIO()
+            try:
+                status = cli.main(['warm', '--quiet', '--url',
+                                   self.server.url, '--cache', cache,
+                                   self.input] + list(args))
+                return status, json.loads(sys.stdout.getvalue())
+            finally:
+                sys.stdout = stdout
+        self.server.respond = lambda query: (
+            (500, '{}') if query['lon'] == '-101' else (200, SAMPLE_RESPONSE))
+        status, report = warm('--strict')
+        self.assertEqual(status, 1)
+        self.assertEqual(report, {'rows': 10, 'invalid': 1, 'cached': 0,
+                                  'fetched': 8, 'failed': 1, 'skipped': 0,
+                                  'coverage': 8 / 9.0})
+        self.server.requests = []
+        self.server.respond = lambda query: (200, SAMPLE_RESPONSE)
+        status, report = warm('--strict')
+        self.assertEqual(status, 0)
+        self.assertEqual((report['cached'], report['fetched'],
+                          report['coverage']), (8, 1, 1.0))
+        self.assertEqual(len(self.server.requests), 1)
+        # runs share the cache
+        self.assertEqual(self.main(self.input, os.path.join(
+            self.directory, 'results.jsonl'), '--cache', cache), 0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_cli_resume(self):
+        """Test a killed job resumes from its checkpoint"""
+        output = os.path.join(self.directory, 'results.jsonl')
+        write = cli.JSONLOutput.write
+
+        def killed(output, row, result):
+            if row == 7:
+                raise KeyboardInterrupt
+            write(output, row, result)
+        cli.JSONLOutput.write = killed
+        try:
+            self.assertRaises(KeyboardInterrupt, self.main, self.input,
+                              output, '--checkpoint-every', '3')
+        finally:
+            cli.JSONLOutput.write = write
+        self.assertEqual(len(self.read(output)), 7)
+        self.assertEqual(cli.load_checkpoint(output + '.checkpoint')
+                         ['rows_done'], 6)
+
+        self.server.requests = []
+        self.assertEqual(self.main(self.input, output, '--resume'), 0)
+        self.assertEqual([record['row'] for record in self.read(output)],
+                         list(range(10)))
+        # only rows after the checkpoint are sent again
+        self.assertEqual(set(int(dict(parse_qsl(urlsplit(path).query))
+                                 ['lon'])
+                             for path, _ in self.server.requests),
+                         set([-104, -103, -102, -101]))
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test_cli_archive(self):
+        """Test results stream to an archive and errors next to it"""
+        output = os.path.join(self.directory, 'results.pvw')
+        self.assertEqual(self.main(self.input, output), 0)
+        archive = PVWattsArchive(output)
+        self.assertEqual([result.row for result in archive],
+                         [0, 1, 2, 4, 5, 6, 7, 8, 9])
+        self.assertEqual([record['row'] for record in
+                          self.read(output + '.errors.jsonl')], [3])
+        archive.close()
+
+        # resuming a finished job changes nothing
+        self.assertEqual(self.main(self.input, output, '--resume'), 0)
+        self.assertEqual(len(PVWattsArchive(output)), 9)
+
+
+class CacheTest(unittest.TestCase):
+    """
+    Unit tests for response caches.
+
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache_key(self):
+        """Test cache keys are canonical"""
+        params = PVWatts.build_params(system_capacity=4, lat=40, lon=-105)
+        same = dict(params, system_capacity=4.0, api_key='OTHER', gcr=None)
+        self.assertEqual(cache_key(params), cache_key(same))
+        self.assertNotEqual(cache_key(params),
+                            cache_key(dict(params, system_capacity=5)))
+
+    def assert_eviction(self, cache):
+        for key in 'abc':
+            cache.set(key, {'key': key})
+        self.assertEqual(cache.get('a'), {'key': 'a'})
+        cache.set('d', {'key': 'd'})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_memory_cache(self):
+        """Test in memory LRU eviction and expiration"""
+        self.assert_eviction(MemoryCache(max_size=3))
+        cache = MemoryCache(ttl=0.05)
+        cache.set('a', {})
+        self.assertEqual(cache.get('a'), {})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_sqlite_cache(self):
+        """Test on disk eviction, expiration and persistence"""
+        path = os.path.join(self.tmpdir, 'cache.db')
+        cache = SQLiteCache(path, max_size=3)
+        self.assert_eviction(cache)
+        cache.close()
+        cache = SQLiteCache(path, ttl=0.05)
+        self.assertEqual(cache.get('d'), {'key': 'd'})
+        cache.set('e', {'key': 'e'})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('e'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+        cache = SQLiteCache(path, wal=True)
+        cache.set('a', {'key': 'a'})
+        other = SQLiteCache(path, wal=True)
+        self.assertEqual(other.get('a'), {'key': 'a'})
+        self.assertEqual(other._db.execute('PRAGMA journal_mode').fetchone(),
+                         ('wal',))
+        other.close()
+        cache.close()
+
+    def test_directory_cache(self):
+        """Test entries are shared, expire and are pruned least recent
+        first"""
+        path = os.path.join(self.tmpdir, 'cache')
+        a, b, c, d, e = (cache_key({'lat': lat}) for lat in range(5))
+        cache = DirectoryCache(path, max_size=3, prune_every=100)
+        for age, key in enumerate((a, b, c, d)):
+            cache.set(key, {'key': key})
+            os.utime(cache._file(key), (1000 + age, 1000 + age))
+        self.assertEqual(DirectoryCache(path).get(a), {'key': a})
+        self.assertEqual(cache.get(a), {'key': a})
+        cache.prune()
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(b))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # a writer never leaves a partial entry behind
+        cache.set(c, {'key': 'C'})
+        self.assertEqual(cache.get(c), {'key': 'C'})
+        self.assertEqual([name for name in os.listdir(os.path.dirname(
+            cache._file(c))) if name.endswith('.tmp')], [])
+
+        cache = DirectoryCache(path, ttl=0.05)
+        cache.set(e, {'key': e})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(e))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TransportTest(unittest.TestCase):
+    """
+    Unit tests for transports.
+
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = StubServer().__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_http_client_transport(self):
+        """Test pooled connections, gzip bodies and streamed responses"""
+        body = json.dumps(hourly_response()).encode('utf8')
+        self.server.respond = lambda query: (
+            200, gzip.compress(body), {'Content-Encoding': 'gzip',
+                                       'X-RateLimit-Remaining': '7'})
+        transport = HTTPClientTransport(pool_maxsize=1)
+        params = {'lat': 40, 'lon': None}
+        response = transport.get(self.server.url, params=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, body)
+        self.assertEqual(response.headers.get('x-ratelimit-remaining'), '7')
+        self.assertTrue(self.server.requests[0][0].endswith('.json?lat=40'))
+        self.assertEqual(self.server.requests[0][1]['Accept-Encoding'],
+                         'gzip')
+        response = transport.get(self.server.url, params=params, stream=True)
+        self.assertEqual(b''.join(response.iter_content(4096)), body)
+        self.assertEqual(self.server.connections, 1)
+
+        # a response closed before its body is read closes its connection
+        transport.get(self.server.url, params=params, stream=True).close()
+        transport.get(self.server.url, params=params)
+        self.assertEqual(self.server.connections, 2)
+        # a pooled connection gone stale is replaced
+        key = list(transport._pools)[0]
+        transport._pools[key][0].sock.close()
+        self.assertEqual(transport.get(self.server.url).content, body)
+        self.assertEqual(self.server.connections, 3)
+        transport.close()
+        self.assertEqual(transport._pools, {})
+
+    def test_redirects(self):
+        """Test redirects are followed, without the key to other hosts"""
+        with StubServer() as moved:
+            target = moved.url.replace('127.0.0.1', 'localhost')
+            replies = [(301, '', {'Location': '/api/pvwatts/v7.json?lat=40&'
+                                              'api_key=KEY'}),
+                       (307, '', {'Location': target + '?lat=40&'
+                                                       'api_key=KEY'})]
+            self.server.respond = lambda query: replies.pop(0)
+            with PVWatts(api_key='KEY') as p:
+                p.PVWATTS_QUERY_URL = self.server.url
+                result = p.request(system_capacity=4, lat=40, lon=-105)
+            self.assertEqual(result.ac_annual, 6683.64501953125)
+            self.assertEqual([path for path, _ in self.server.requests[1:]],
+                             ['/api/pvwatts/v7.json?lat=40&api_key=KEY'])
+            self.assertEqual([path for path, _ in moved.requests],
+                             ['/api/pvwatts/v6.json?lat=40'])
+            self.assertEqual(self.server.connections, 1)
+
+            self.server.respond = lambda query: (
+                302, '', {'Location': self.server.url})
+            self.assertRaises(PVWattsError, HTTPClientTransport().get,
+                              self.server.url)
+
+    def test_environment_proxies(self):
+        """Test requests go through the proxy of the environment"""
+        parts = urlsplit(self.server.url)
+        environ = dict(os.environ)
+        os.environ['http_proxy'] = '%s://%s' % (parts.scheme, parts.netloc)
+        os.environ['no_proxy'] = 'bypassed.example'
+        try:
+            transport = HTTPClientTransport()
+            response = transport.get('http://pvwatts.example/v6.json',
+                                     params={'lat': 40})
+            self.assertEqual(
+                HTTPClientTransport._environment_proxies('bypassed.example'),
+                {})
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests[0][0],
+                         'http://pvwatts.example/v6.json?lat=40')
+        transport.close()
+
+    def test_replay_transport(self):
+        """Test responses are recorded then replayed offline"""
+        path = os.path.join(self.tmpdir, 'replay.jsonl')
+        replies = [(429, '{}', {'Retry-After': '0'}),
+                   (200, SAMPLE_RESPONSE)]
+        self.server.respond = lambda query: replies.pop(0) \
+            if replies else (200, '{"outputs": {"ac_annual": 1.0}}')
+        retry = RetryPolicy(backoff_factor=0.01)
+        with PVWatts(api_key='SECRET', retry=retry,
+                     transport=ReplayTransport(path, HTTPClientTransport())) \
+                as p:
+            p.PVWATTS_QUERY_URL = self.server.url
+            recorded = [p.request(system_capacity=4, lat=lat, lon=-105).raw
+                        for lat in (40, 41)]
+        with open(path) as file:
+            self.assertNotIn('SECRET', file.read())
+
+        with PVWatts(retry=retry, transport=ReplayTransport(path)) as p:
+            p.PVWATTS_QUERY_URL = 'http://127.0.0.1:9/'
+            self.assertEqual([p.request(system_capacity=4, lat=lat,
+                                        lon=-105).raw for lat in (40, 41)],
+                             recorded)
+            self.assertEqual(p.request(system_capacity=4, lat=40,
+                                       lon=-105).ac_annual, 6683.64501953125)
+            self.assertRaises(PVWattsError, p.request, system_capacity=4,
+                              lat=42, lon=-105)
+        self.assertEqual(len(self.server.requests), 3)
+
+    @unittest.skipIf(requests is None, 'requires requests')
+    def test_requests_transport(self):
+        """Test requests are sent with a requests session"""
+        with PVWatts(transport=RequestsTransport()) as p:
+            p.PVWATTS_QUERY_URL = self.server.url
+            self.assertIsInstance(p.get_session().session, requests.Session)
+            result = p.request(system_capacity=4, lat=40, lon=-105)
+        self.assertEqual(result.ac_annual, 6683.64501953125)
+
+
+class RateLimitTest(unittest.TestCase):
+    """
+    Unit tests for request pacing and retries.
+
+    """
+    def test_rate_limiter(self):
+        """Test tokens follow the remaining quota"""
+        limiter = RateLimiter()
+        self.assertEqual(limiter.reserve(), 0)
+        limiter.update({'X-RateLimit-Limit': '3600',
+                        'X-RateLimit-Remaining': '2'})
+        self.assertEqual(limiter.rate, 1.0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertAlmostEqual(limiter.reserve(), 1.0, places=1)
+        self.assertAlmostEqual(limiter.reserve(), 2.0, places=1)
+
+        limiter = RateLimiter(limit=3600)
+        limiter.update({}, status=429)
+        self.assertAlmostEqual(limiter.reserve(), 1.0, places=1)
+
+    def test_retry_policy(self):
+        """Test backoff is bounded and honours Retry-After"""
+        retry = RetryPolicy(max_retries=2, backoff_factor=1, max_backoff=3)
+        self.assertTrue(retry.should_retry(503, 1))
+        self.assertFalse(retry.should_retry(503, 2))
+        self.assertFalse(retry.should_retry(403, 0))
+        for attempt in range(5):
+            self.assertLessEqual(retry.backoff(attempt), 3)
+        self.assertGreaterEqual(retry.backoff(0, {'Retry-After': '2'}), 2)
+
+
+@unittest.skipIf(aiohttp is None, 'requires aiohttp')
+class AsyncTest(unittest.TestCase):
+    """
+    Unit tests for AsyncPVWatts.
+
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = StubServer().__enter__()
+        self.client = AsyncPVWatts(max_concurrency=3)
+        self.client.PVWATTS_QUERY_URL = self.server.url
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+        self.server.__exit__(None, None, None)
+
+    def collect(self, agen):
+        items = []
+        while True:
+            try:
+                items.append(self.loop.run_until_complete(agen.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    def test_async_request(self):
+        """Test a single asynchronous request"""
+        result = self.loop.run_until_complete(
+            self.client.request(system_capacity=4, lat=40, lon=-105))
+        self.assertIsInstance(result, PVWattsResult)
+        self.assertEqual(result.ac_annual, 6683.64501953125)
+        self.assertRaises(PVWattsValidationError, self.loop.run_until_complete,
+                          self.client.request(system_capacity=4, tilt=100))
+
+    def test_async_request_many(self):
+        """Test concurrency limit and per item errors"""
+        state = {'active': 0, 'peak': 0}
+        lock = threading.Lock()
+
+        def respond(query):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.05)
+            with lock:
+                state['active'] -= 1
+            if query['lat'] == '13':
+                return 403, '{}'
+            return 200, SAMPLE_RESPONSE
+        self.server.respond = respond
+
+        batch = [dict(system_capacity=4, lat=40, lon=lon)
+                 for lon in range(-110, -100)]
+        batch[2]['tilt'] = 100
+        batch[4]['lat'] = 13
+        results = self.collect(self.client.request_many(batch))
+        self.assertEqual([i for i, _ in results], list(range(10)))
+        self.assertIsInstance(results[2][1], PVWattsValidationError)
+        self.assertIsInstance(results[4][1], PVWattsError)
+        self.assertEqual(results[0][1].ac_annual, 6683.64501953125)
+        self.assertLessEqual(state['peak'], 3)
+
+        unordered = self.collect(self.client.request_many(batch,
+                                                          ordered=False))
+        self.assertEqual(sorted(i for i, _ in unordered), list(range(10)))
+
+    def test_async_request_many_window(self):
+        """Test large batches only have a window of tasks at a time"""
+        state = {'started': 0, 'yielded': 0, 'peak': 0}
+        fetch = self.client._fetch
+
+        def counted(index, params, timeout):
+            state['started'] += 1
+            state['peak'] = max(state['peak'],
+                                state['started'] - state['yielded'])
+            return fetch(index, params, timeout)
+        self.client._fetch = counted
+        batch = [dict(system_capacity=4, lat=40, lon=-105)] * 40
+        for ordered in (True, False):
+            state.update(started=0, yielded=0, peak=0)
+            results = self.client.request_many(batch, ordered=ordered)
+            indexes = []
+            while True:
+                try:
+                    index, _ = self.loop.run_until_complete(
+                        results.__anext__())
+                except StopAsyncIteration:
+                    break
+                state['yielded'] += 1
+                indexes.append(index)
+            self.assertEqual(sorted(indexes), list(range(40)))
+            self.assertLessEqual(state['peak'],
+                                 2 * self.client.max_concurrency)
+
+    def test_async_hooks(self):
+        """Test lifecycle events of asynchronous requests"""
+        metrics = MetricsCollector()
+        payloads = []
+        self.client.hooks = Hooks(metrics, lambda event, info:
+                                  payloads.append(info.get('params') or {}))
+        result = self.loop.run_until_complete(
+            self.client.request(system_capacity=4, lat=40, lon=-105))
+        self.assertEqual(result.ac_annual, 6683.64501953125)
+        self.server.respond = lambda query: (500, 'error')
+        self.client.retry = RetryPolicy(max_retries=1, backoff_factor=0.01)
+        self.assertRaises(PVWattsError, self.loop.run_until_complete,
+                          self.client.request(system_capacity=4, lat=41,
+                                              lon=-105))
+        stats = metrics.stats
+        self.assertEqual(stats['counters'], {
+            'validate': 2, 'send': 3, 'first_byte': 3, 'retry': 1,
+            'decoded': 1, 'error': 1})
+        self.assertEqual(stats['errors'], {'PVWattsError': 1})
+        self.assertEqual(stats['bytes'], len(SAMPLE_RESPONSE))
+        self.assertFalse([params for params in payloads
+                          if 'api_key' in params])
+
+    def test_async_single_flight(self):
+        """Test identical concurrent tasks share one request"""
+        self.server.respond = lambda query: (time.sleep(0.2) or
+                                             (200, SAMPLE_RESPONSE))
+        flight = self.client.single_flight = AsyncSingleFlight()
+
+        tasks = [self.loop.create_task(self.client.request(
+            system_capacity=4, lat=40, lon=-105)) for _ in range(5)]
+        # a cancelled caller does not cancel the shared request
+        self.loop.call_later(0.05, tasks[0].cancel)
+        results = self.loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        self.assertIsInstance(results[0], asyncio.CancelledError)
+        self.assertEqual(results[1].ac_annual, 6683.64501953125)
+        for result in results[2:]:
+            self.assertIs(result, results[1])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(flight.stats,
+                         {'calls': 1, 'coalesced': 4, 'in_flight': 0})
+
+    def test_async_timeout_and_cancellation(self):
+        """Test timeouts and cancellation propagate"""
+        self.server.respond = lambda query: (time.sleep(0.5) or
+                                             (200, SAMPLE_RESPONSE))
+        self.assertRaises(asyncio.TimeoutError, self.loop.run_until_complete,
+                          self.client.request(system_capacity=4, lat=40,
+                                              lon=-105, timeout=0.1))
+
+        batch = [dict(system_capacity=4, lat=40, lon=-105)] * 6
+        agen = self.client.request_many(batch)
+        task = self.loop.create_task(agen.__anext__())
+        self.loop.call_later(0.1, task.cancel)
+        self.assertRaises(asyncio.CancelledError, self.loop.run_until_complete,
+                          task)
+        self.loop.run_until_complete(agen.aclose())
+        pending = [t for t in asyncio.all_tasks(self.loop) if not t.done()]
+        self.assertEqual(pending, [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,270 @@
+# coding: utf-8
+"""
+Time index, calendar rollups and time of use buckets of hourly outputs.
+
+Hourly outputs are the 8760 hours of a typical, non leap, year in the local
+standard time of the weather station, station_info['tz'] hours from UTC,
+hour 0 starting on January 1st at midnight. The functions take a series of
+8760 values or a stack of them, of shape (sites, 8760), and work on the
+last axis, so a whole portfolio is resampled or billed in one array
+operation:
+
+    >>> values, tz = stack(results)
+    >>> resample(values, 'M')                   # (sites, 12)
+    >>> tariff = Tariff(weekday, weekend, rates=[0.1, 0.3], tz=-8)
+    >>> tariff.cost(values, tz=tz)              # (sites,)
+
+Calendars are computed once per year and shared.
+"""
+from .pvwattsresult import MONTH_BOUNDS, MONTH_HOURS, import_numpy
+from .pvwattserror import PVWattsError
+
+import datetime
+import threading
+
+HOURS = 8760
+# Year the calendar follows by default, starting on a Monday as SAM and
+# URDB schedules assume
+YEAR = 2001
+FREQUENCIES = ('D', 'M', 'A')
+# Reductions of resample, numpy ufuncs reduced over each bucket
+REDUCERS = {'sum': 'add', 'mean': 'add', 'min': 'minimum', 'max': 'maximum'}
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def _is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def calendar(year=YEAR):
+    """
+    Return the calendar of the hours of a year as a dictionary of read only
+    arrays of 8760 integers: month (0-11), day of the year (0-364), hour
+    (0-23) and weekday (0 for Monday to 6)
+    """
+    with _calendars_lock:
+        arrays = _calendars.get(year)
+        if arrays is not None:
+            return arrays
+    if _is_leap(year):
+        raise PVWattsError('Hourly outputs cover a non leap year, %d is '
+                           'a leap year' % year)
+    numpy = import_numpy()
+    hours = numpy.arange(HOURS)
+    day = hours // 24
+    arrays = {'month': numpy.repeat(numpy.arange(12), MONTH_HOURS),
+              'day': day, 'hour': hours % 24,
+              'weekday': (day + datetime.date(year, 1, 1).weekday()) % 7}
+    for array in arrays.values():
+        array.flags.writeable = False
+    with _calendars_lock:
+        return _calendars.setdefault(year, arrays)
+
+
+def station_tz(result):
+    """
+    Return the time zone of the station of a result, hours from UTC, or
+    None when the response has no station_info
+    """
+    try:
+        station_info = result.station_info
+    except (AttributeError, KeyError):
+        return None
+    tz = (station_info or {}).get('tz')
+    return None if tz is None else float(tz)
+
+
+def time_index(tz=None, utc=False, year=YEAR):
+    """
+    Return the timestamps of the start of each hour as a datetime64[m]
+    array, in local standard time or, with utc, in UTC
+
+    :param tz: Hours from UTC of the local standard time, needed with utc
+    """
+    numpy = import_numpy()
+    calendar(year)
+    index = numpy.datetime64('%04d-01-01T00:00' % year, 'm') + \
+        numpy.arange(0, HOURS * 60, 60).astype('timedelta64[m]')
+    if utc:
+        if tz is None:
+            raise PVWattsError('The time zone is required for UTC '
+                               'timestamps')
+        index = index - numpy.timedelta64(int(round(tz * 60)), 'm')
+    return index
+
+
+def stack(results, name='ac', dtype='float64'):
+    """
+    Return the hourly field of results stacked in a (sites, 8760) array,
+    and the time zone of each site in an array, nan when unknown
+    """
+    numpy = import_numpy()
+    results = list(results)
+    values = numpy.empty((len(results), HOURS), dtype=dtype)
+    tz = numpy.empty(len(results))
+    for row, result in enumerate(results):
+        values[row] = result.column(name)
+        zone = station_tz(result)
+        tz[row] = numpy.nan if zone is None else zone
+    return values, tz
+
+
+def shift(values, hours):
+    """
+    Return values moved later by hours, wrapping around the year as the
+    year is a typical one. hours is a number, or one per row of a stack,
+    rounded to whole hours.
+    """
+    numpy = import_numpy()
+    values = numpy.asarray(values)
+    hours = numpy.rint(numpy.nan_to_num(numpy.asarray(hours, dtype=float)))
+    if hours.ndim == 0:
+        return numpy.roll(values, int(hours), axis=-1) if hours else values
+    # sites are in a handful of time zones, rows of a same shift are
+    # rolled together
+    shifted = numpy.empty_like(values)
+    for offset in numpy.unique(hours):
+        rows = hours == offset
+        shifted[rows] = numpy.roll(values[rows], int(offset), axis=-1)
+    return shifted
+
+
+def convert(values, tz, to):
+    """
+    Return values of the local standard time tz in the clock of the time
+    zone to, shifting them by the difference. Rows of unknown (nan) time
+    zone are left as they are.
+    """
+    numpy = import_numpy()
+    return shift(values, numpy.asarray(to, dtype=float) -
+                 numpy.asarray(tz, dtype=float))
+
+
+def resample(values, freq='M', how='sum'):
+    """
+    Roll hourly values up to days (D), months (M) or the year (A)
+
+    :param how: sum, mean, min or max of the hours of each period
+    :returns: Array of shape (..., 365), (..., 12) or (...)
+    """
+    numpy = import_numpy()
+    if freq not in FREQUENCIES:
+        raise PVWattsError('Unknown frequency %r, not one of %s'
+                           % (freq, ', '.join(FREQUENCIES)))
+    if how not in REDUCERS:
+        raise PVWattsError('Unknown reduction %r, not one of %s'
+                           % (how, ', '.join(sorted(REDUCERS))))
+    values = numpy.asarray(values)
+    if values.shape[-1:] != (HOURS,):
+        raise PVWattsError('Expected %d hourly values, got shape %r'
+                           % (HOURS, values.shape))
+    ufunc = getattr(numpy, REDUCERS[how])
+    if freq == 'D':
+        rolled = ufunc.reduce(values.reshape(values.shape[:-1] + (365, 24)),
+                              axis=-1)
+        hours = 24
+    elif freq == 'M':
+        rolled = ufunc.reduceat(values, (0,) + MONTH_BOUNDS, axis=-1)
+        hours = numpy.asarray(MONTH_HOURS)
+    else:
+        rolled = ufunc.reduce(values, axis=-1)
+        hours = HOURS
+    return rolled / hours if how == 'mean' else rolled
+
+
+class Tariff(object):
+    """
+    Time of use tariff: a period for each hour of weekdays and of weekend
+    days of each month, as in the energy rate schedules of URDB and SAM.
+    The period of each hour of the year is computed once, and hours are
+    bucketed by one reduction of the hours sorted by period, for any
+    number of sites.
+
+    :param weekday: 12 x 24 periods, numbered from 0, of weekday hours
+    :param weekend: 12 x 24 periods of weekend days and holidays, the
+                    weekday ones by default
+    :param rates: Price of energy in each period, per kWh
+    :param holidays: Days of the year (0-364) of the weekend periods
+    :param tz: Hours from UTC of the standard time of the schedule. Values
+               of sites in other time zones are shifted to it when their
+               time zone is given.
+    :param year: Year whose weekdays the calendar follows
+    """
+    def __init__(self, weekday, weekend=None, rates=None, holidays=(),
+                 tz=None, year=YEAR):
+        numpy = import_numpy()
+        weekday = numpy.asarray(weekday, dtype=int)
+        weekend = weekday if weekend is None else \
+            numpy.asarray(weekend, dtype=int)
+        if weekday.shape != (12, 24) or weekend.shape != (12, 24):
+            raise PVWattsError('Schedules must be 12 months by 24 hours')
+        if weekday.min() < 0 or weekend.min() < 0:
+            raise PVWattsError('Periods are numbered from 0')
+        days = calendar(year)
+        off = days['weekday'] >= 5
+        if len(holidays):
+            off = off | numpy.isin(days['day'], holidays)
+        self.periods = numpy.where(
+            off, weekend[days['month'], days['hour']],
+            weekday[days['month'], days['hour']])
+        self.count = int(max(weekday.max(), weekend.max())) + 1
+        if rates is not None:
+            rates = numpy.asarray(rates, dtype=float)
+            if rates.shape != (self.count,):
+                raise PVWattsError('Expected %d rates, one per period'
+                                   % self.count)
+        self.rates = rates
+        self.tz = tz
+        self.year = year
+        self._groupings = {}
+
+    def _grouping(self, monthly):
+        # hours sorted by bucket, the buckets present and where they start
+        grouping = self._groupings.get(monthly)
+        if grouping is None:
+            numpy = import_numpy()
+            buckets = self.periods
+            if monthly:
+                buckets = calendar(self.year)['month'] * self.count + buckets
+            order = numpy.argsort(buckets, kind='mergesort')
+            present, starts = numpy.unique(buckets[order], return_index=True)
+            grouping = self._groupings.setdefault(
+                monthly, (order, present, starts))
+        return grouping
+
+    def _local(self, values, tz):
+        if tz is None or self.tz is None:
+            return values
+        return convert(values, tz, self.tz)
+
+    def buckets(self, values, tz=None, monthly=False):
+        """
+        Return the sum of hourly values in each period, of shape
+        (..., periods), or (..., 12, periods) by month
+
+        :param tz: Time zone of the values, one per row of a stack, see
+                   stack
+        """
+        numpy = import_numpy()
+        values = self._local(numpy.asarray(values, dtype=float), tz)
+        order, present, starts = self._grouping(monthly)
+        width = self.count * (12 if monthly else 1)
+        totals = numpy.zeros(values.shape[:-1] + (width,))
+        totals[..., present] = numpy.add.reduceat(values[..., order], starts,
+                                                  axis=-1)
+        if monthly:
+            totals = totals.reshape(totals.shape[:-1] + (12, self.count))
+        return totals
+
+    def cost(self, values, tz=None, monthly=False):
+        """
+        Return the cost of hourly outputs in W, such as ac, at the rates of
+        the periods: for the year, of shape (...), or by month (..., 12)
+        """
+        if self.rates is None:
+            raise PVWattsError('The tariff has no rates')
+        # W over an hour is Wh, rates are per kWh
+        return self.buckets(values, tz=tz, monthly=monthly).dot(
+            self.rates) / 1000.0
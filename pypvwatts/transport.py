@@ -0,0 +1,416 @@
+# coding: utf-8
+"""
+HTTP transports the PVWatts client sends requests with.
+
+A transport has get(url, params, proxies, stream) returning a response with
+the part of the requests.Response interface the client uses: status_code,
+headers, content, json(), iter_content() and close(). The default
+HTTPClientTransport keeps connections alive over the standard library
+http.client, RequestsTransport sends them with a requests session and
+ReplayTransport records responses to a file and replays them offline.
+Modules are imported when a transport is created, not with pypvwatts.
+"""
+from .__version__ import VERSION
+from .pvwattscache import cache_key
+from .pvwattserror import PVWattsError
+
+import base64
+import collections
+import functools
+import json
+import threading
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+    from urllib.request import getproxies, proxy_bypass
+except ImportError:
+    from urllib import getproxies, proxy_bypass, urlencode
+    from urlparse import parse_qsl, urljoin, urlsplit
+
+USER_AGENT = ''.join(['pypvwatts/', VERSION, ' (Python)'])
+
+# Headers describing the encoded body, left out of recorded responses
+# which keep the decoded one
+ENCODING_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+# Redirect statuses followed by HTTPClientTransport, and how many in a row
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 30
+
+
+def create_session(pool_connections=10, pool_maxsize=10, max_retries=0):
+    """
+    Create a requests session with a keep-alive connection pool mounted
+    for both http and https
+
+    :param pool_connections: Number of connection pools to cache
+    :param pool_maxsize: Maximum number of connections kept per pool
+    :param max_retries: Retries on failed connections, passed along to
+                        requests' HTTPAdapter
+    :rtype: requests.Session
+    """
+    try:
+        import requests
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        raise ImportError('requests is required, install it with '
+                          'pip install pypvwatts[requests]')
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def _without_key(params):
+    return dict((name, value) for name, value in params.items()
+                if name != 'api_key')
+
+
+class Headers(dict):
+    """
+    Response headers, looked up case insensitively
+    """
+    def __init__(self, items=()):
+        dict.__init__(self, ((name.lower(), value) for name, value in items))
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+
+class Response(object):
+    """
+    Response of a transport, either buffered or read from a connection
+
+    :param content: Whole body, for buffered responses
+    :param raw: File like object the body is read from otherwise
+    :param release: Called with True once the body has been read and the
+                    connection can be reused, with False when it is closed
+                    before
+    """
+    def __init__(self, status_code, headers, content=None, raw=None,
+                 release=None):
+        self.status_code = status_code
+        self.headers = headers
+        self._content = content
+        self._raw = raw
+        self._release = release
+        self._decoder = None
+        if raw is not None and \
+                (headers.get('Content-Encoding') or '').lower() == 'gzip':
+            import zlib
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def iter_content(self, chunk_size=1):
+        """
+        Iterate over the decoded body in chunks of up to chunk_size bytes
+        """
+        if self._content is not None:
+            content = self._content
+            for start in range(0, len(content), chunk_size):
+                yield content[start:start + chunk_size]
+            return
+        try:
+            while self._raw is not None:
+                chunk = self._raw.read(chunk_size)
+                if not chunk:
+                    break
+                if self._decoder is not None:
+                    chunk = self._decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if self._decoder is not None:
+                chunk = self._decoder.flush()
+                if chunk:
+                    yield chunk
+            self._done(True)
+        finally:
+            self.close()
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self.iter_content(65536))
+        return self._content
+
+    def json(self):
+        return json.loads(self.content.decode('utf8'))
+
+    def _done(self, reusable):
+        raw, self._raw = self._raw, None
+        if raw is not None and self._release is not None:
+            self._release(reusable and not raw.will_close)
+
+    def close(self):
+        """
+        Release the connection, closing it when the body was not read
+        """
+        self._done(False)
+
+
+class Transport(object):
+    """
+    Base class for transports
+    """
+    def get(self, url, params=None, proxies=None, stream=False):
+        """
+        Send a GET request and return its Response. With stream the body
+        is only read as it is iterated over.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Close pooled connections. Transports stay usable after close.
+        """
+
+
+class HTTPClientTransport(Transport):
+    """
+    Keep-alive transport over the standard library http.client, the
+    default one. Idle connections are pooled per host, a pooled connection
+    the server has closed is replaced transparently. Responses are
+    requested gzip compressed. Without proxies, requests go through the
+    proxies of the environment (HTTP_PROXY, HTTPS_PROXY and NO_PROXY), as
+    with requests. Redirects are followed with GET requests, as requests
+    does, the api_key being left out of the query when the redirect leads
+    to another host.
+
+    :param pool_connections: Number of hosts connections are pooled for
+    :param pool_maxsize: Maximum number of idle connections kept per host
+    :param max_retries: Retries on failed connections
+    :param timeout: Socket timeout in seconds, None for no timeout
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0,
+                 timeout=None):
+        try:
+            import http.client as httplib
+        except ImportError:
+            import httplib
+        import socket
+        self._httplib = httplib
+        # errors of a pooled connection closed by the server, worth a retry
+        # on a new connection
+        self._stale_errors = (socket.error, httplib.BadStatusLine)
+        self._errors = (socket.error, httplib.HTTPException)
+        self._timeout = socket.timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.headers = {'User-Agent': USER_AGENT, 'Accept': '*/*',
+                        'Accept-Encoding': 'gzip',
+                        'Connection': 'keep-alive'}
+        self._pools = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _proxy_headers(proxy):
+        proxy = urlsplit(proxy)
+        if not proxy.username:
+            return {}
+        credentials = '%s:%s' % (proxy.username, proxy.password or '')
+        return {'Proxy-Authorization': 'Basic ' + base64.b64encode(
+            credentials.encode('utf8')).decode('ascii')}
+
+    @staticmethod
+    def _environment_proxies(host):
+        # read on each request, like requests does with trust_env
+        proxies = getproxies()
+        if not proxies or proxy_bypass(host):
+            return {}
+        return proxies
+
+    def _connect(self, key):
+        scheme, host, port, proxy = key
+        httplib = self._httplib
+        kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+        if proxy is None:
+            cls = httplib.HTTPSConnection if scheme == 'https' \
+                else httplib.HTTPConnection
+            return cls(host, port, **kwargs)
+        parts = urlsplit(proxy)
+        cls = httplib.HTTPSConnection if parts.scheme == 'https' \
+            else httplib.HTTPConnection
+        connection = cls(parts.hostname, parts.port, **kwargs)
+        if scheme == 'https':
+            # https is tunneled through the proxy, http sent to it
+            connection.set_tunnel(host, port,
+                                  headers=self._proxy_headers(proxy))
+        return connection
+
+    def _checkout(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool:
+                return pool.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self._lock:
+                pool = self._pools.pop(key, None)
+                if pool is None:
+                    pool = []
+                    while len(self._pools) >= self.pool_connections:
+                        for idle in self._pools.popitem(last=False)[1]:
+                            idle.close()
+                self._pools[key] = pool
+                if len(pool) < self.pool_maxsize:
+                    pool.append(connection)
+                    return
+        connection.close()
+
+    def get(self, url, params=None, proxies=None, stream=False):
+        query = urlencode([(name, value) for name, value in
+                           (params or {}).items() if value is not None])
+        if query:
+            url += ('&' if urlsplit(url).query else '?') + query
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._open(url, proxies)
+            location = response.headers.get('Location')
+            if response.status_code not in REDIRECTS or not location:
+                break
+            # the body is read so that the connection is reused
+            response.content
+            location = urljoin(url, location)
+            if urlsplit(location).hostname != urlsplit(url).hostname:
+                location = self._without_key(location)
+            url = location
+        else:
+            raise PVWattsError('Exceeded %d redirects' % MAX_REDIRECTS)
+        if not stream:
+            response.content
+        return response
+
+    @staticmethod
+    def _without_key(url):
+        parts = urlsplit(url)
+        query = urlencode([(name, value) for name, value in
+                           parse_qsl(parts.query, keep_blank_values=True)
+                           if name != 'api_key'])
+        return parts._replace(query=query).geturl()
+
+    def _open(self, url, proxies):
+        parts = urlsplit(url)
+        if proxies is None:
+            proxies = self._environment_proxies(parts.hostname)
+        proxy = proxies.get(parts.scheme)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        target = (parts.path or '/') + \
+            ('?' + parts.query if parts.query else '')
+        headers = self.headers
+        if proxy is not None and parts.scheme != 'https':
+            target = '%s://%s%s' % (parts.scheme, parts.netloc, target)
+            headers = dict(headers, **self._proxy_headers(proxy))
+        retries = self.max_retries
+        while True:
+            connection, reused = self._checkout(key)
+            try:
+                connection.request('GET', target, headers=headers)
+                raw = connection.getresponse()
+            except self._errors as e:
+                connection.close()
+                if reused and isinstance(e, self._stale_errors) and \
+                        not isinstance(e, self._timeout):
+                    continue
+                if retries > 0:
+                    retries -= 1
+                    continue
+                raise
+            break
+        return Response(raw.status, raw.msg, raw=raw, release=functools.
+                        partial(self._release, key, connection))
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, collections.OrderedDict()
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
+
+class RequestsTransport(Transport):
+    """
+    Transport sending requests with a requests session, see
+    create_session
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0,
+                 timeout=None, session=None):
+        self.session = session if session is not None else create_session(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            max_retries=max_retries)
+        self.timeout = timeout
+
+    def get(self, url, params=None, proxies=None, stream=False):
+        return self.session.get(url, params=params, proxies=proxies,
+                                stream=stream, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Records responses to a JSONL file, or replays them, for deterministic
+    offline runs. Requests are matched on their parameters, the api_key
+    left out, and the responses recorded for the same parameters are
+    replayed in order, the last one repeating.
+
+    :param path: JSONL file of recorded responses
+    :param transport: Transport recording responses, appended to path. Without
+                      one the recorded responses are replayed, and requests
+                      with none raise PVWattsError.
+    """
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = transport
+        self._records = {}
+        self._lock = threading.Lock()
+        if transport is None:
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records.setdefault(record['key'], []).append(
+                            record)
+
+    def get(self, url, params=None, proxies=None, stream=False):
+        params = params or {}
+        key = cache_key(params)
+        if self.transport is not None:
+            return self._record(key, url, params, proxies)
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                raise PVWattsError('No recorded response for %s' % (
+                    json.dumps(_without_key(params), sort_keys=True),))
+            record = records.pop(0) if len(records) > 1 else records[0]
+        return Response(record['status'], Headers(record['headers']),
+                        content=record['body'].encode('utf8'))
+
+    def _record(self, key, url, params, proxies):
+        response = self.transport.get(url, params=params, proxies=proxies)
+        record = {'key': key, 'params': _without_key(params),
+                  'status': response.status_code,
+                  'headers': [[name, value] for name, value in
+                              response.headers.items()
+                              if name.lower() not in ENCODING_HEADERS],
+                  'body': response.content.decode('utf8')}
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            with open(self.path, 'a') as file:
+                file.write(line + '\n')
+        return response
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
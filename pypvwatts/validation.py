@@ -0,0 +1,200 @@
+# coding: utf-8
+"""
+Declarative schema of the validated PVWatts request parameters.
+
+Every field is validated by the same table, either one value at a time
+(Field.validate, used by PVWatts.validate_* and PVWatts.build_params) or a
+whole batch of rows at once (validate_batch).
+"""
+from .pvwattserror import PVWattsValidationError
+
+import collections
+import numbers
+import sys
+
+if sys.version_info > (3,):
+    long = int
+    unicode = str
+
+NUMBER = (int, long, float)
+STRING = (str, unicode)
+# Checked types of NUMBER fields, numpy scalars included
+REAL = (numbers.Real,)
+
+
+class Field(object):
+    """
+    A validated request parameter
+
+    :param name: Parameter name
+    :param types: Accepted types, NUMBER or STRING
+    :param message: Error message when the value is out of range
+    :param minimum: Lowest accepted value
+    :param maximum: Highest accepted value
+    :param choices: Accepted values
+    :param exclusive: Whether minimum itself is rejected
+    """
+    def __init__(self, name, types, message, minimum=None, maximum=None,
+                 choices=None, exclusive=False):
+        self.name = name
+        self.types = types
+        self.message = message
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.exclusive = exclusive
+        # numpy integers are no int, but are registered as numbers.Real
+        self.checked = REAL if types is NUMBER else types
+        if types is STRING:
+            self.type_message = '%s must be str or unicode' % name
+        else:
+            self.type_message = '%s must be int, long or float' % name
+
+    def in_range(self, value):
+        if self.choices is not None:
+            return value in self.choices
+        if self.minimum is not None:
+            if value < self.minimum or (self.exclusive and
+                                        value == self.minimum):
+                return False
+        if self.maximum is not None and value > self.maximum:
+            return False
+        # NaN fails every comparison
+        return value == value
+
+    def validate(self, value):
+        """
+        Return the value, None included, or raise PVWattsValidationError
+        """
+        if value is None:
+            return
+        if not isinstance(value, self.checked):
+            raise PVWattsValidationError(self.type_message)
+        if not self.in_range(value):
+            raise PVWattsValidationError(self.message)
+        return value
+
+    def errors(self, column, numpy):
+        """
+        Return the indexes of invalid rows of a column and their messages,
+        checking the whole column at once
+        """
+        if isinstance(column, numpy.ndarray):
+            array = column
+        else:
+            array = numpy.asarray(column)
+            if array.dtype.kind not in 'biuf':
+                # keep the original objects, numpy would turn a mix of
+                # numbers and strings into strings
+                array = numpy.empty(len(column), dtype=object)
+                array[:] = list(column)
+        if self.types is NUMBER and array.dtype.kind in 'biuf':
+            present = numpy.ones(len(array), dtype=bool)
+            typed = present
+            values = array
+        elif self.types is STRING and array.dtype.kind == 'U':
+            present = typed = numpy.ones(len(array), dtype=bool)
+            values = array
+        else:
+            array = array.astype(object)
+            present = numpy.not_equal(array, None)
+            typed = numpy.fromiter(
+                (isinstance(value, self.checked) for value in array),
+                dtype=bool, count=len(array))
+            values = numpy.where(typed, array,
+                                 self.choices[0] if self.choices
+                                 else self.minimum or 0)
+            if self.types is NUMBER:
+                values = values.astype(float)
+        if self.choices is not None:
+            valid = numpy.isin(values, self.choices)
+        else:
+            valid = values == values
+            if self.minimum is not None:
+                valid &= (values > self.minimum if self.exclusive
+                          else values >= self.minimum)
+            if self.maximum is not None:
+                valid &= values <= self.maximum
+        wrong_type = present & ~typed
+        out_of_range = present & typed & ~valid
+        return ([(row, self.type_message)
+                 for row in numpy.flatnonzero(wrong_type).tolist()] +
+                [(row, self.message)
+                 for row in numpy.flatnonzero(out_of_range).tolist()])
+
+
+FIELDS = collections.OrderedDict((field.name, field) for field in (
+    Field('system_capacity', NUMBER,
+          'system_capacity must be >= 0.05 and <= 500000',
+          minimum=0.05, maximum=500000),
+    Field('module_type', NUMBER, 'module_type must be 0, 1 or 2',
+          choices=(0, 1, 2)),
+    Field('losses', NUMBER, r'losses must be >= -5\% and <= 99%',
+          minimum=-5, maximum=99),
+    Field('array_type', NUMBER, 'array_type must be 0, 1, 2, 3 or 4',
+          choices=(0, 1, 2, 3, 4)),
+    Field('tilt', NUMBER, 'tilt must be >= 0 and <= 90',
+          minimum=0, maximum=90),
+    Field('azimuth', NUMBER, 'azimuth must be >= 0 and <= 360',
+          minimum=0, maximum=360),
+    Field('lat', NUMBER, 'lat must be >= -90 and <= 90',
+          minimum=-90, maximum=90),
+    Field('lon', NUMBER, 'lon must be >= -180 and <= 180',
+          minimum=-180, maximum=180),
+    Field('dataset', STRING,
+          'dataset must be \'nsrdb\', \'tmy2\', \'tmy3\' or \'intl\'',
+          choices=('tmy2', 'tmy3', 'intl', 'nsrdb')),
+    Field('radius', NUMBER, 'radius must be >= 0', minimum=0),
+    Field('timeframe', STRING, 'dataset must be \'hourly\' or \'monthly\'',
+          choices=('hourly', 'monthly')),
+    Field('dc_ac_ratio', NUMBER, 'dc_ac_ratio must be positive',
+          minimum=0, exclusive=True),
+    Field('gcr', NUMBER, 'gcr must be >= 0 and <= 3', minimum=0, maximum=3),
+    Field('inv_eff', NUMBER, 'inv_eff must be >= 90 and <= 99.5',
+          minimum=90, maximum=99.5),
+))
+
+
+def validate_batch(batch):
+    """
+    Validate a batch of requests in one pass per field
+
+    :param batch: Dictionary mapping parameter names to columns (lists or
+                  numpy arrays), or a list of dictionaries of request
+                  arguments. Parameters without validation are ignored.
+    :return: List of (row, parameter, message) tuples for every invalid
+             value, sorted by row. Empty when the whole batch is valid.
+    :raises PVWattsValidationError: When columns differ in length
+    """
+    if not isinstance(batch, dict):
+        rows = list(batch)
+        names = set(name for row in rows for name in row)
+        batch = dict((name, [row.get(name) for row in rows])
+                     for name in names if name in FIELDS)
+    lengths = dict((name, len(column)) for name, column in batch.items())
+    if len(set(lengths.values())) > 1:
+        raise PVWattsValidationError(
+            'Columns must have the same length, got %s' % ', '.join(
+                '%s: %d' % item for item in sorted(lengths.items())))
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    errors = []
+    for order, (name, field) in enumerate(FIELDS.items()):
+        if name not in batch:
+            continue
+        column = batch[name]
+        if numpy is not None:
+            found = field.errors(column, numpy)
+        else:
+            found = []
+            for row, value in enumerate(column):
+                try:
+                    field.validate(value)
+                except PVWattsValidationError as e:
+                    found.append((row, str(e)))
+        errors.extend((row, order, name, message) for row, message in found)
+    errors.sort()
+    return [(row, name, message) for row, order, name, message in errors]
@@ -0,0 +1,187 @@
+# coding: utf-8
+"""
+Readers for the hourly weather files used by the local simulation engine.
+
+Two CSV layouts are supported:
+
+- TMY3 (NSRDB 1991-2005): a metadata line (USAF, name, state, time zone,
+  latitude, longitude, elevation), a header line and 8760 hour ending rows
+  with Date (MM/DD/YYYY) and Time (HH:MM) columns.
+- SAM CSV, as served by the NSRDB for PSM TMY data: a metadata header and
+  values line, a header line and hourly rows with Year, Month, Day, Hour and
+  Minute columns.
+"""
+from .pvwattsresult import import_numpy
+from .pvwattserror import PVWattsError
+
+import csv
+import io
+import os
+
+# Column names, lower cased and without units, of each weather variable
+COLUMNS = {
+    'ghi': ('ghi',),
+    'dni': ('dni',),
+    'dhi': ('dhi',),
+    'tamb': ('temperature', 'tdry', 'dry-bulb', 'temp'),
+    'wspd': ('wind speed', 'wspd'),
+    'albedo': ('surface albedo', 'albedo', 'alb'),
+}
+REQUIRED = ('ghi', 'dni', 'dhi', 'tamb', 'wspd')
+
+# Day of the non leap year at which each month starts
+MONTH_START = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+
+def _name(header):
+    return header.split('(')[0].strip().lower()
+
+
+def _float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Weather(object):
+    """
+    Hourly weather of a station for a typical year
+
+    :ivar lat: Station latitude
+    :ivar lon: Station longitude
+    :ivar tz: Time zone, hours from UTC of the local standard time
+    :ivar elevation: Station elevation in meters
+    :ivar location: Station identifier
+    :ivar ghi: Global horizontal irradiance (W/m2)
+    :ivar dni: Direct normal irradiance (W/m2)
+    :ivar dhi: Diffuse horizontal irradiance (W/m2)
+    :ivar tamb: Ambient temperature (C)
+    :ivar wspd: Wind speed (m/s)
+    :ivar albedo: Ground reflectance, None when the file has none
+    :ivar day: Day of the year of each row, starting at 0
+    :ivar hour: Local standard time of the sun position of each row, in
+                hours since midnight, at the middle of the hour
+    """
+    def __init__(self, lat, lon, tz, ghi, dni, dhi, tamb, wspd, day, hour,
+                 albedo=None, elevation=0.0, location='', city='', state='',
+                 file_id=None):
+        self.lat = lat
+        self.lon = lon
+        self.tz = tz
+        self.elevation = elevation
+        self.location = location
+        self.city = city
+        self.state = state
+        self.file_id = file_id
+        self.ghi = ghi
+        self.dni = dni
+        self.dhi = dhi
+        self.tamb = tamb
+        self.wspd = wspd
+        self.albedo = albedo
+        self.day = day
+        self.hour = hour
+
+    def __len__(self):
+        return len(self.ghi)
+
+    @property
+    def station_info(self):
+        """
+        Station details, in the shape of the PVWatts station_info response
+        """
+        return {'lat': self.lat, 'lon': self.lon, 'elev': self.elevation,
+                'tz': self.tz, 'location': self.location, 'city': self.city,
+                'state': self.state, 'solar_resource_file': self.file_id}
+
+
+def _columns(headers, rows, numpy):
+    names = [_name(header) for header in headers]
+    columns = {}
+    for variable, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                index = names.index(alias)
+                columns[variable] = numpy.array(
+                    [float(row[index]) for row in rows])
+                break
+        else:
+            if variable in REQUIRED:
+                raise PVWattsError('Weather file has no %s column' % variable)
+    return names, columns
+
+
+def _read_tmy3(meta, headers, rows, numpy):
+    names, columns = _columns(headers, rows, numpy)
+    date, time = names.index('date'), names.index('time')
+    months = numpy.array([int(row[date].split('/')[0]) for row in rows])
+    days = numpy.array([int(row[date].split('/')[1]) for row in rows])
+    # hour ending timestamps, the sun position is taken half an hour before
+    hours = numpy.array([int(row[time].split(':')[0]) for row in rows])
+    station = dict(location=meta[0].strip(), city=meta[1].strip(),
+                   state=meta[2].strip(), tz=float(meta[3]),
+                   lat=float(meta[4]), lon=float(meta[5]),
+                   elevation=_float(meta[6], 0.0))
+    return station, columns, months, days, hours - 0.5
+
+
+def _read_sam(meta, headers, rows, numpy):
+    info = dict(zip([_name(name) for name in meta[0]], meta[1]))
+    names, columns = _columns(headers, rows, numpy)
+
+    def column(name):
+        return numpy.array([int(float(row[names.index(name)]))
+                            for row in rows])
+
+    minutes = column('minute') if 'minute' in names else \
+        numpy.zeros(len(rows), dtype=int)
+    hours = column('hour') + minutes / 60.0
+    if not minutes.any():
+        # period beginning timestamps
+        hours = hours + 0.5
+    station = dict(location=info.get('location id', ''),
+                   city=info.get('city', ''), state=info.get('state', ''),
+                   tz=float(info.get('time zone', 0)),
+                   lat=float(info['latitude']), lon=float(info['longitude']),
+                   elevation=_float(info.get('elevation'), 0.0))
+    return station, columns, column('month'), column('day'), hours
+
+
+def read_weather(path):
+    """
+    Read a TMY3 or SAM CSV weather file, see the module documentation
+
+    :param path: File path, or an open text file
+    :rtype: Weather
+    """
+    numpy = import_numpy()
+    if hasattr(path, 'read'):
+        file_id = getattr(path, 'name', None)
+        lines = list(csv.reader(path))
+    else:
+        file_id = os.path.basename(path)
+        with io.open(path, newline='', encoding='utf8',
+                     errors='replace') as file:
+            lines = list(csv.reader(file))
+    if len(lines) < 3:
+        raise PVWattsError('Weather file is too short')
+    try:
+        if _name(lines[0][0]) == 'source':
+            station, columns, months, days, hours = _read_sam(
+                lines[:2], lines[2], lines[3:], numpy)
+        else:
+            station, columns, months, days, hours = _read_tmy3(
+                lines[0], lines[1], lines[2:], numpy)
+    except (IndexError, KeyError, ValueError) as e:
+        raise PVWattsError('Invalid weather file: %s' % e)
+
+    # typical years have no leap day, drop it from actual years
+    keep = ~((months == 2) & (days == 29))
+    day = numpy.asarray(MONTH_START)[months[keep] - 1] + days[keep] - 1
+    columns = dict((name, values[keep]) for name, values in columns.items())
+    if len(day) != 8760:
+        raise PVWattsError('Weather file must have 8760 hourly rows, not %d'
+                           % len(day))
+    return Weather(day=day, hour=hours[keep], file_id=file_id,
+                   **dict(station, **columns))
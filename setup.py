@@ -18,8 +18,15 @@ setup(
     long_description=open('README.md').read(),
     packages=['pypvwatts'],
     provides=['pypvwatts'],
-    requires=['requests'],
-    install_requires=['requests >= 2.1.0'],
+    install_requires=['futures; python_version < "3"'],
+    entry_points={
+        'console_scripts': ['pypvwatts = pypvwatts.cli:main'],
+    },
+    extras_require={
+        'async': ['aiohttp >= 3.0'],
+        'numpy': ['numpy'],
+        'requests': ['requests >= 2.1.0'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',